@@ -0,0 +1,36 @@
+# gunicorn.conf.py
+# Preload copy-on-write: o master carrega a app (Django, pandas, views) e o snapshot
+# uma vez, congela o heap (gc.freeze) e os workers herdam essas páginas no fork.
+# Ver structure/preload.py e a seção "Workers com preload" do README.
+#
+#   GUNICORN_PRELOAD=0   volta ao modo antigo (cada worker importa e carrega sozinho)
+#   WEB_CONCURRENCY      número de workers (padrão 4)
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '4'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+if preload_app:
+    # O master não inicia as threads de boot (structure/apps.py): threads não atravessam
+    # o fork. O primeiro worker as inicia no post_fork.
+    os.environ['BOOT_THREADS_AFTER_FORK'] = '1'
+
+
+def when_ready(server):
+    # Master, com a app já carregada e antes do primeiro fork
+    if preload_app:
+        from structure.preload import warm_master
+        result = warm_master()
+        server.log.info("Preload: snapshot %s em %.1f ms, %d objetos congelados",
+                        result["version"], result["ms"], result["frozen"])
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from structure.preload import reset_after_fork
+        reset_after_fork()
+        if worker.age == 1:
+            from structure.apps import start_boot_threads
+            start_boot_threads()
@@ -1,11 +1,19 @@
 # invest22/scraping/tasks.py
 # Importação opcional do Celery para evitar erro se não estiver instalado
 try:
-    from celery import shared_task
+    from celery import chain, shared_task
+    from celery.exceptions import Ignore
+    from celery.signals import worker_process_init, worker_process_shutdown
 except (ImportError, ModuleNotFoundError):
     # Se Celery não estiver disponível, cria um decorator dummy
-    def shared_task(func):
-        return func
+    # (aceita tanto `@shared_task` quanto `@shared_task(...)`)
+    def shared_task(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+    chain = None
+    Ignore = Exception
+    worker_process_init = worker_process_shutdown = None
 
 import os
 from django.conf import settings
@@ -20,10 +28,11 @@ logger = logging.getLogger(__name__)
 
 @shared_task
 def scheduled_scrape():
-    """Executa scraping apenas se o último scraping não for do dia atual.
+    """Executa scraping apenas se os dados atuais estiverem velhos.
 
-    O Celery Beat agenda esta task às 18:00. Aqui verificamos `media/metadata.json`.
-    Se `last_scrape` já for de hoje, não executamos novamente.
+    O Celery Beat agenda esta task pelo calendário da B3 (MarketSchedule). Aqui
+    verificamos `media/metadata.json`: se nenhum horário agendado passou desde
+    `last_scrape` (ex.: feriado, fim de semana), não executamos novamente.
     """
     try:
         metadata_path = os.path.join(settings.BASE_DIR, 'media', 'metadata.json')
@@ -52,57 +61,235 @@ def scheduled_scrape():
                     except Exception:
                         logger.warning('Não foi possível parsear next_allowed_attempt, prosseguindo com scraping')
 
+                # Mesma regra de validade da view: os dados só ficam velhos quando passa
+                # um horário agendado no calendário da B3 (sem pregão, nada a fazer)
+                # Um 304 (last_checked) confirma os dados publicados até aquele momento
                 last_scrape = meta.get('last_scrape')
-                if last_scrape:
+                if last_scrape and status == 'success':
                     try:
-                        last_dt = datetime.fromisoformat(last_scrape)
-                        # Converter last_dt para timezone de São Paulo antes de comparar
-                        last_dt_sp = last_dt.astimezone(pytz.timezone('America/Sao_Paulo'))
-                        hoje_sp = now().astimezone(pytz.timezone('America/Sao_Paulo')).date()
-                        if last_dt_sp.date() >= hoje_sp:
-                            logger.info('Scraping já realizado hoje (%s). Pule execução.', last_scrape)
-                            return 'Já atualizado hoje'
+                        from structure.market_calendar import is_stale, last_confirmed
+                        confirmed = last_confirmed(meta)
+                        if not is_stale(confirmed):
+                            logger.info('Dados ainda válidos pelo calendário da B3 (%s). Pule execução.', confirmed.isoformat())
+                            return 'Dados ainda válidos'
                     except Exception:
                         # se parse falhar, prossegue com a execução
                         logger.warning('Não foi possível parsear last_scrape, prosseguindo com scraping')
             except Exception:
                 logger.warning('Falha ao ler metadata.json — prosseguindo com scraping')
 
-        # Importa o comando de scraping aqui para evitar import durante carga do web (se celery não estiver presente)
+        # Se o token bucket do host estiver vazio (ou houver Retry-After ativo),
+        # reagenda em vez de prender o worker dormindo
         try:
-            from structure.management.commands.scrape_data import Command as ScrapeCommand
+            from structure.ratelimit import get_limiter
+            from structure.scrape_steps import SOURCE_URL
+            wait = get_limiter().wait_time(SOURCE_URL)
+            if wait > 0 and hasattr(scheduled_scrape, 'apply_async'):
+                scheduled_scrape.apply_async(countdown=int(wait) + 1)
+                logger.info('Limite de requisições ativo — scraping reagendado em %.0fs', wait)
+                return 'Reagendado (rate limit)'
         except Exception as e:
-            logger.error('Não foi possível importar ScrapeCommand: %s', e)
-            return f'Erro: import scraper: {e}'
+            logger.warning('Falha ao consultar rate limiter: %s', e)
 
-        # Executa o scraping (o comando grava acoes_raw.csv, acoes_filtradas.csv e metadata.json)
-        scraper = ScrapeCommand()
-        scraper.handle()
-
-        # Verifica se metadata foi atualizada com sucesso
-        if os.path.exists(metadata_path):
-            try:
-                with open(metadata_path, 'r', encoding='utf-8') as f:
-                    meta = json.load(f)
-                last_scrape = meta.get('last_scrape')
-                logger.info('Scraping concluído. metadata.last_scrape=%s', last_scrape)
-            except Exception:
-                logger.warning('Scraping finalizado, mas não foi possível ler metadata.json')
-
-        return 'Atualização executada'
+        # Dispara a cadeia fetch -> parse -> filter -> publish -> upload
+        return start_scrape_pipeline()
 
     except Exception as e:
         logger.exception('Erro durante a task scheduled_scrape:')
-        # Mesmo em caso de erro, tenta escrever metadata básica para debugging
+        # Registra o erro no metadata sem apagar o último scraping bem-sucedido
+        # (a página continua servindo aqueles dados, com a idade indicada)
         try:
-            metadata_error = {
-                "last_scrape": now().isoformat(),
-                "error": str(e),
-                "status": "error"
-            }
-            metadata_path = os.path.join(settings.BASE_DIR, "media", "metadata.json")
-            with open(metadata_path, "w", encoding="utf-8") as f:
-                json.dump(metadata_error, f, ensure_ascii=False, indent=4)
-        except:
+            from structure.scrape_steps import record_failure
+            record_failure({"error": str(e), "status": "error"})
+        except Exception:
             pass
         return f'Erro na atualização: {e}'
+
+
+@shared_task
+def scrape_details_task(papeis=None):
+    """Busca as páginas de detalhe dos Papéis da lista final (ou dos informados)."""
+    try:
+        from structure.details import scrape_details
+        payload = scrape_details(papeis)
+        logger.info('Detalhes atualizados: %s ok, %s erros', len(payload['tickers']), len(payload['errors']))
+        return {'ok': len(payload['tickers']), 'errors': payload['errors']}
+    except Exception as e:
+        logger.exception('Erro durante a task scrape_details_task:')
+        return f'Erro nos detalhes: {e}'
+
+
+# ------------------------------------------------------------------
+# Pipeline de scraping em etapas (structure/scrape_steps.py)
+# ------------------------------------------------------------------
+# Cada etapa é uma task com retries e time limits próprios (a validação não é
+# repetida: o mesmo staging daria o mesmo resultado); elas trocam apenas
+# referências a artefatos endereçados pelo conteúdo (captura / staging / snapshot).
+# O roteamento por fila fica em CELERY_TASK_ROUTES (settings): o Chrome roda na
+# fila `browser` e publish/upload na fila `publish`. Como as referências são caminhos
+# em media/, os workers dessas filas precisam compartilhar o disco (no Render, um
+# único serviço `celery-worker` consome as três).
+
+def start_scrape_pipeline(url=None):
+    """Enfileira a cadeia de tasks; sem Celery, executa as etapas no processo atual."""
+    from structure.scrape_steps import SOURCE_URL, run_steps
+    url = url or SOURCE_URL
+    if chain is None:
+        result = run_steps(url)
+        return 'Sem alterações na origem' if result is None else 'Atualização executada'
+    workflow = chain(
+        fetch_source_task.s(url),
+        parse_capture_task.s(),
+        filter_snapshot_task.s(),
+        validate_snapshot_task.s(),
+        publish_snapshot_task.s(),
+        upload_artifacts_task.s(),
+    )
+    async_result = workflow.apply_async()
+    logger.info('Pipeline de scraping enfileirado (%s)', async_result.id)
+    return f'Pipeline enfileirado ({async_result.id})'
+
+
+@shared_task(bind=True, max_retries=4, soft_time_limit=60, time_limit=90)
+def fetch_source_task(self, url=None):
+    """Consulta as fontes e grava a captura; desvia para o navegador se preciso."""
+    import requests
+    from structure.http_client import NotModified
+    from structure.ratelimit import RateLimited
+    from structure.scrape_steps import (SOURCE_URL, fetch_step, record_checked, record_precheck_failure,
+                                        retry_countdown)
+    from structure.sources import SourceHTTPError, SourceUnavailable
+    url = url or SOURCE_URL
+    try:
+        fetched = fetch_step(url)
+    except NotModified:
+        logger.info('Página de origem sem alterações (HTTP 304) — cadeia encerrada.')
+        record_checked()
+        raise Ignore()
+    except SourceUnavailable as e:
+        logger.info('Nenhuma fonte com dados novos (%s) — cadeia encerrada.', e)
+        raise Ignore()
+    except RateLimited as e:
+        raise self.retry(exc=e, countdown=e.wait + 1)
+    except (SourceHTTPError, requests.RequestException) as e:
+        if self.request.retries >= self.max_retries:
+            level, message = record_precheck_failure(url, getattr(e, 'status', None))
+            logger.error('%s', message)
+            raise
+        raise self.retry(exc=e, countdown=retry_countdown(self.request.retries))
+
+    if fetched['needs_browser']:
+        logger.warning('Tabela não encontrada na resposta HTTP — usando navegador (fila browser)')
+        return self.replace(fetch_browser_task.s(fetched))
+    return fetched
+
+
+@shared_task(bind=True, max_retries=2, soft_time_limit=120, time_limit=180)
+def fetch_browser_task(self, fetched):
+    """Carrega a tabela pelo Chrome headless (fila `browser`)."""
+    from structure.scrape_steps import browser_step, record_error
+    try:
+        return browser_step(fetched)
+    except Exception as e:
+        if self.request.retries >= self.max_retries:
+            record_error(fetched['url'], e)
+            raise
+        raise self.retry(exc=e, countdown=30)
+
+
+@shared_task(bind=True, max_retries=20, soft_time_limit=300, time_limit=360)
+def scrape_data_task(self, attempt=1):
+    """Roda `manage.py scrape_data`; pre-check sem sucesso volta pela fila com countdown."""
+    from django.core.management import call_command
+    from structure.ratelimit import RateLimited
+    try:
+        return call_command('scrape_data', attempt=attempt)
+    except RateLimited as e:
+        # RetryPrecheck traz a próxima tentativa; token indisponível repete a mesma
+        raise self.retry(exc=e, countdown=int(e.wait) + 1, kwargs={'attempt': getattr(e, 'attempt', attempt)})
+
+
+if worker_process_init is not None:
+    @worker_process_init.connect
+    def _warm_browser_pool(**kwargs):
+        """No worker da fila `browser` (BROWSER_POOL_WARM=1), sobe o Chrome antes da primeira task."""
+        if os.environ.get('BROWSER_POOL_WARM') != '1':
+            return
+        try:
+            from structure.browser import get_pool
+            get_pool().warm()
+        except Exception as e:
+            logger.warning("Não foi possível aquecer o Chrome headless: %s", e)
+
+    @worker_process_shutdown.connect
+    def _close_browser_pool(**kwargs):
+        from structure.browser import close_pool
+        close_pool()
+
+
+@shared_task(bind=True, max_retries=2, soft_time_limit=60, time_limit=90)
+def parse_capture_task(self, fetched):
+    """Captura -> acoes_raw.csv + snapshot no staging."""
+    from structure.scrape_steps import parse_step, record_error
+    try:
+        return parse_step(fetched)
+    except ValueError as e:
+        # HTML sem a tabela esperada: repetir não muda o resultado
+        record_error(fetched['url'], e)
+        raise
+    except OSError as e:
+        raise self.retry(exc=e, countdown=5)
+
+
+@shared_task(bind=True, max_retries=2, soft_time_limit=30, time_limit=60)
+def filter_snapshot_task(self, parsed):
+    """Aplica os filtros sobre o snapshot do staging."""
+    from structure.scrape_steps import filter_step, record_error
+    try:
+        return filter_step(parsed)
+    except ValueError as e:
+        record_error(parsed['url'], e)
+        raise
+    except OSError as e:
+        raise self.retry(exc=e, countdown=5)
+
+
+@shared_task(bind=True, max_retries=2, soft_time_limit=30, time_limit=60)
+def validate_snapshot_task(self, filtered):
+    """Checagens de qualidade; se falharem a cadeia para e o snapshot publicado continua."""
+    from structure.scrape_steps import validate_step
+    try:
+        return validate_step(filtered)
+    except OSError as e:
+        raise self.retry(exc=e, countdown=5)
+
+
+@shared_task(bind=True, max_retries=3, soft_time_limit=60, time_limit=90)
+def publish_snapshot_task(self, filtered):
+    """Publica o staging em media/ (fila `publish`)."""
+    from structure.scrape_steps import publish_step
+    try:
+        return publish_step(filtered)
+    except OSError as e:
+        raise self.retry(exc=e, countdown=5)
+
+
+@shared_task(bind=True, max_retries=5, soft_time_limit=120, time_limit=180)
+def upload_artifacts_task(self, published):
+    """Envia os artefatos publicados ao S3; só esta etapa é repetida se o upload falhar."""
+    from structure.scrape_steps import PublishError, retry_countdown, upload_step
+    try:
+        return upload_step(published)
+    except PublishError as e:
+        raise self.retry(exc=e, countdown=retry_countdown(self.request.retries))
+
+
+@shared_task(bind=True, max_retries=5, soft_time_limit=60, time_limit=90)
+def evaluate_alerts_task(self, previous_version, version, sinks=None):
+    """Alertas da troca de snapshot; se um sink falhar, só ele é repetido."""
+    from structure.alerts import run_alerts
+    result = run_alerts(previous_version, version, sinks=sinks)
+    if result['failed']:
+        from structure.scrape_steps import retry_countdown
+        raise self.retry(kwargs={'sinks': result['failed']}, countdown=retry_countdown(self.request.retries))
+    return result
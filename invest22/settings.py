@@ -88,6 +88,16 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'America/Sao_Paulo'
 
+# Etapas do scraping (invest22/scraping/tasks.py). As etapas trocam caminhos locais
+# (captura, staging), então os workers das filas celery, browser e publish precisam
+# enxergar o mesmo media/: na mesma máquina/disco, ou um único worker com todas as filas.
+#   celery -A invest22 worker -Q celery,publish,browser --concurrency 2
+CELERY_TASK_ROUTES = {
+    'invest22.scraping.tasks.fetch_browser_task': {'queue': 'browser'},
+    'invest22.scraping.tasks.publish_snapshot_task': {'queue': 'publish'},
+    'invest22.scraping.tasks.upload_artifacts_task': {'queue': 'publish'},
+}
+
 # Cache Configuration (Redis para compartilhar dados entre worker e web)
 CACHES = {
     'default': {
@@ -96,17 +106,16 @@ CACHES = {
     }
 }
 
-# Importação opcional do Celery para evitar erro durante deploy
-try:
-    from celery.schedules import crontab
-except (ImportError, ModuleNotFoundError):
-    crontab = None
+# Agenda pelo calendário da B3 (structure/market_calendar.py): só em dias de pregão,
+# a cada SCRAPE_INTRADAY_MINUTES durante o pregão e uma vez após o fechamento.
+# MarketSchedule é None se o Celery não estiver instalado.
+from structure.market_calendar import MarketSchedule
 
-if crontab is not None:
+if MarketSchedule is not None:
     CELERY_BEAT_SCHEDULE = {
         'update-stock-data': {
             'task': 'invest22.scraping.tasks.scheduled_scrape',
-            'schedule': crontab(hour=18, minute=0),
+            'schedule': MarketSchedule(),
         },
     }
 else:
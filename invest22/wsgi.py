@@ -5,3 +5,15 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "invest22.settings")
 
 application = get_wsgi_application()
 app = application
+
+# Aquecimento no boot: rotas/views (importam requests, pandas...) e o template da página
+# são carregados aqui, não na primeira requisição (BOOT_WARM=0 desliga)
+if os.environ.get("BOOT_WARM", "1") != "0":
+    try:
+        from django.template.loader import get_template
+        from django.urls import get_resolver
+
+        get_resolver().reverse_dict  # importa as views e monta o índice do {% url %}
+        get_template("structure/index.html")
+    except Exception as e:
+        print(f"⚠️ Falha no aquecimento do boot: {e}")
@@ -1,3 +1,187 @@
+// Tabela interativa: o snapshot chega uma vez como JSON colunar (/dados/<versão>.json,
+// cacheável para sempre) e ordenação, filtros e a tabela completa com rolagem virtual
+// rodam no navegador, sem ida ao servidor.
+const COLUNAS_SELECIONADAS = ['Papel', 'Liq.2meses', 'Mrg Ebit', 'EV/EBIT', 'P/L'];
+const COLUNAS_INTEIRAS = new Set(['Liq.2meses', 'Patrim. Líq', 'Magic Formula']);
+const ALTURA_LINHA = 37;      // px, altura fixa das linhas na rolagem virtual
+const LINHAS_EXTRAS = 10;     // linhas renderizadas além da área visível
+const LIMITE_VIRTUAL = 100;   // acima disso a tabela usa rolagem virtual
+
+const fmtInteiro = new Intl.NumberFormat('pt-BR', { maximumFractionDigits: 0 });
+const fmtDecimal = new Intl.NumberFormat('pt-BR', { minimumFractionDigits: 2, maximumFractionDigits: 2, useGrouping: false });
+
+function formatar(coluna, valor) {
+  if (valor === null || valor === undefined) return '';
+  return COLUNAS_INTEIRAS.has(coluna) ? fmtInteiro.format(valor) : fmtDecimal.format(valor);
+}
+
+function escapar(texto) {
+  return String(texto).replace(/[&<>"]/g, (c) => ({ '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;' }[c]));
+}
+
+// Filtro numérico digitado no cabeçalho: ">10", "<=5", "1..3" ou um valor exato
+function criarFiltro(texto) {
+  const t = texto.trim().replace(/\./g, '').replace(',', '.');
+  if (!t) return null;
+  const intervalo = texto.trim().match(/^(-?[\d.,]*)\s*\.\.\s*(-?[\d.,]*)$/);
+  const numero = (s) => (s === '' ? NaN : Number(s.replace(/\./g, '').replace(',', '.')));
+  if (intervalo) {
+    const min = numero(intervalo[1]);
+    const max = numero(intervalo[2]);
+    return (v) => v !== null && (isNaN(min) || v >= min) && (isNaN(max) || v <= max);
+  }
+  const op = t.match(/^(>=|<=|>|<|=)?\s*(-?\d+(\.\d+)?)$/);
+  if (!op) return null;
+  const alvo = Number(op[2]);
+  switch (op[1]) {
+    case '>': return (v) => v !== null && v > alvo;
+    case '>=': return (v) => v !== null && v >= alvo;
+    case '<': return (v) => v !== null && v < alvo;
+    case '<=': return (v) => v !== null && v <= alvo;
+    default: return (v) => v !== null && v === alvo;
+  }
+}
+
+class TabelaInterativa {
+  constructor(container) {
+    this.container = container;
+    this.dados = null;
+    this.modo = 'selecionadas';
+    this.ordem = null;          // { coluna, asc }
+    this.busca = '';
+    this.filtros = {};          // coluna -> função
+    this.textosFiltro = {};     // coluna -> texto digitado (recolocado ao remontar)
+    this.linhas = [];           // índices das linhas visíveis após filtro/ordem
+    this.agendado = false;
+  }
+
+  async carregar(url) {
+    const resposta = await fetch(url);
+    if (!resposta.ok) throw new Error(`HTTP ${resposta.status}`);
+    this.dados = await resposta.json();
+    this.indice = {};
+    this.dados.columns.forEach((nome, i) => { this.indice[nome] = i; });
+    this.container.dataset.version = this.dados.version;
+    this.montar();
+  }
+
+  colunas() {
+    return this.modo === 'selecionadas' ? COLUNAS_SELECIONADAS : ['Papel', ...this.dados.columns];
+  }
+
+  valor(coluna, linha) {
+    if (coluna === 'Papel') return this.dados.papel[linha];
+    const i = this.indice[coluna];
+    return i === undefined ? null : this.dados.values[i][linha];
+  }
+
+  montar() {
+    const total = this.dados.papel.length;
+    const outroModo = this.modo === 'selecionadas'
+      ? `Ver todas as ações (${total})`
+      : `Ver as ${this.dados.selected.length} selecionadas`;
+    const cabecalho = this.colunas().map((c) => {
+      const seta = this.ordem && this.ordem.coluna === c ? (this.ordem.asc ? ' ▲' : ' ▼') : '';
+      return `<th data-coluna="${escapar(c)}" style="cursor:pointer">${escapar(c)}${seta}</th>`;
+    }).join('');
+    const filtros = this.colunas().map((c) => (c === 'Papel'
+      ? `<th><input class="form-control form-control-sm" data-busca placeholder="Buscar" value="${escapar(this.busca)}"></th>`
+      : `<th><input class="form-control form-control-sm" data-filtro="${escapar(c)}" placeholder="ex.: >10" value="${escapar(this.textosFiltro[c] || '')}"></th>`)).join('');
+
+    this.container.innerHTML = `
+      <div class="tabela-controles mb-2"><button type="button" class="btn btn-success btn-sm" data-modo>${outroModo}</button>
+        <span class="filtros ms-2" data-contagem></span></div>
+      <div class="tabela-rolagem" style="max-height:70vh;overflow:auto">
+        <table class="table table-striped">
+          <thead style="position:sticky;top:0"><tr>${cabecalho}</tr><tr>${filtros}</tr></thead>
+          <tbody></tbody>
+        </table>
+      </div>`;
+    this.corpo = this.container.querySelector('tbody');
+    this.rolagem = this.container.querySelector('.tabela-rolagem');
+
+    this.container.querySelector('[data-modo]').addEventListener('click', () => {
+      this.modo = this.modo === 'selecionadas' ? 'todas' : 'selecionadas';
+      this.ordem = null;
+      this.filtros = {};
+      this.textosFiltro = {};
+      this.montar();
+    });
+    this.container.querySelectorAll('th[data-coluna]').forEach((th) => th.addEventListener('click', () => {
+      const coluna = th.dataset.coluna;
+      const asc = this.ordem && this.ordem.coluna === coluna ? !this.ordem.asc : true;
+      this.ordem = { coluna, asc };
+      this.montar();
+    }));
+    const busca = this.container.querySelector('[data-busca]');
+    busca.addEventListener('input', () => { this.busca = busca.value; this.atualizar(); });
+    this.container.querySelectorAll('[data-filtro]').forEach((input) => input.addEventListener('input', () => {
+      const filtro = criarFiltro(input.value);
+      this.textosFiltro[input.dataset.filtro] = input.value;
+      if (filtro) this.filtros[input.dataset.filtro] = filtro;
+      else delete this.filtros[input.dataset.filtro];
+      this.atualizar();
+    }));
+    this.rolagem.addEventListener('scroll', () => this.agendar());
+    this.atualizar();
+  }
+
+  atualizar() {
+    const base = this.modo === 'selecionadas'
+      ? this.dados.selected.slice()
+      : Array.from({ length: this.dados.papel.length }, (_, i) => i);
+    const busca = this.busca.trim().toUpperCase();
+    const filtros = Object.entries(this.filtros);
+    let linhas = base.filter((linha) => (!busca || this.dados.papel[linha].includes(busca))
+      && filtros.every(([coluna, filtro]) => filtro(this.valor(coluna, linha))));
+
+    if (this.ordem) {
+      const { coluna, asc } = this.ordem;
+      const sinal = asc ? 1 : -1;
+      linhas.sort((a, b) => {
+        const va = this.valor(coluna, a);
+        const vb = this.valor(coluna, b);
+        if (va === vb) return a - b;
+        if (va === null) return 1;   // ausentes sempre no fim
+        if (vb === null) return -1;
+        return (va < vb ? -1 : 1) * sinal;
+      });
+    }
+    this.linhas = linhas;
+    this.container.querySelector('[data-contagem]').textContent = `${linhas.length} ações`;
+    this.rolagem.scrollTop = 0;
+    this.desenhar();
+  }
+
+  agendar() {
+    if (this.agendado || this.linhas.length <= LIMITE_VIRTUAL) return;
+    this.agendado = true;
+    requestAnimationFrame(() => { this.agendado = false; this.desenhar(); });
+  }
+
+  linhaHtml(linha, colunas) {
+    return `<tr style="height:${ALTURA_LINHA}px">${colunas.map((c) => `<td>${escapar(c === 'Papel' ? this.valor(c, linha) : formatar(c, this.valor(c, linha)))}</td>`).join('')}</tr>`;
+  }
+
+  desenhar() {
+    const colunas = this.colunas();
+    const total = this.linhas.length;
+    let inicio = 0;
+    let fim = total;
+    if (total > LIMITE_VIRTUAL) {
+      // Só as linhas na área visível (+ folga) viram DOM; espaçadores mantêm a barra de rolagem
+      const visiveis = Math.ceil(this.rolagem.clientHeight / ALTURA_LINHA) || 30;
+      inicio = Math.max(0, Math.floor(this.rolagem.scrollTop / ALTURA_LINHA) - LINHAS_EXTRAS);
+      fim = Math.min(total, inicio + visiveis + 2 * LINHAS_EXTRAS);
+    }
+    const partes = [];
+    if (inicio > 0) partes.push(`<tr style="height:${inicio * ALTURA_LINHA}px"></tr>`);
+    for (let i = inicio; i < fim; i += 1) partes.push(this.linhaHtml(this.linhas[i], colunas));
+    if (fim < total) partes.push(`<tr style="height:${(total - fim) * ALTURA_LINHA}px"></tr>`);
+    this.corpo.innerHTML = partes.join('');
+  }
+}
+
 document.addEventListener("DOMContentLoaded", () => {
   const el = document.getElementById('data-atual');
   // Se o servidor não forneceu a data, preenche com a data de hoje
@@ -7,4 +191,38 @@ document.addEventListener("DOMContentLoaded", () => {
     const dataFormatada = hoje.toLocaleDateString('pt-BR', opcoes);
     el.textContent = ` - ${dataFormatada}`;
   }
+
+  const tabela = document.querySelector('.tabela[data-updates-url]');
+  if (!tabela) return;
+
+  // Com snapshot disponível a página traz só a URL dos dados; a tabela é montada aqui
+  let interativa = null;
+  if (tabela.dataset.jsonUrl && window.fetch) {
+    interativa = new TabelaInterativa(tabela);
+    interativa.carregar(tabela.dataset.jsonUrl).catch(() => {
+      const fallback = tabela.querySelector('noscript');
+      if (fallback) tabela.innerHTML = fallback.textContent;
+      interativa = null;
+    });
+  }
+
+  // Atualizações ao vivo: o servidor avisa quando um scraping publica
+  if (!window.EventSource) return;
+  const versao = tabela.dataset.version || '';
+  const url = tabela.dataset.updatesUrl + (versao ? `?v=${encodeURIComponent(versao)}` : '');
+  const fonte = new EventSource(url);
+  fonte.addEventListener('tabela', (evento) => {
+    const dados = JSON.parse(evento.data);
+    if (dados.version === tabela.dataset.version) return;
+    if (interativa && dados.dados_url) {
+      interativa.carregar(dados.dados_url).catch(() => {});
+    } else {
+      tabela.innerHTML = dados.tabela_html;
+      tabela.dataset.version = dados.version;
+    }
+    if (dados.data_atual) el.textContent = dados.data_atual;
+    // Chegou um scraping novo: o aviso de dados antigos não vale mais
+    const aviso = document.getElementById('aviso-dados');
+    if (aviso) aviso.remove();
+  });
 });
@@ -0,0 +1,328 @@
+# structure/alerts.py
+# Alertas de mudança na lista final e de cruzamento de limites, avaliados sobre a
+# diferença entre o snapshot anterior e o novo (nunca sobre o histórico inteiro).
+#
+# Regras em media/alert_rules.json (ou ALERT_RULES_FILE):
+#
+#   [
+#     {"id": "lista", "tipo": "lista"},                               entrou/saiu das 22
+#     {"id": "petr", "tipo": "lista", "papeis": ["PETR4"], "eventos": ["saiu"]},
+#     {"id": "ev-baixo", "tipo": "limite", "campo": "EV/EBIT", "op": "<", "valor": 3},
+#     {"id": "liq", "tipo": "limite", "campo": "Liq.2meses", "op": ">", "valor": 1e9,
+#      "papeis": ["VALE3"], "sinks": ["webhook"]}
+#   ]
+#
+# Um alerta de limite dispara quando o Papel passa a satisfazer a condição (valor
+# anterior fora, novo dentro). As regras de limite ficam indexadas por (campo, op,
+# Papel) com os limites ordenados: para cada linha que mudou, as regras cruzadas são
+# um intervalo achado por busca binária. O custo vai com as linhas alteradas (e os
+# alertas disparados), não com regras x Papéis.
+#
+# Entrega: ALERT_SINKS=file,webhook,email (ou caminho "modulo.Classe" de um sink
+# próprio), em lotes de ALERT_BATCH_SIZE, pela task `evaluate_alerts_task`.
+import json
+import logging
+import os
+import threading
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.utils.timezone import now
+
+logger = logging.getLogger(__name__)
+
+RULE_TYPES = ('lista', 'limite')
+OPERATORS = ('<', '>')
+LIST_EVENTS = ('entrou', 'saiu')
+
+
+class AlertRuleError(ValueError):
+    """Regra de alerta inválida (mensagem aponta a regra)."""
+
+
+def rules_path() -> str:
+    return os.environ.get('ALERT_RULES_FILE') or os.path.join(settings.BASE_DIR, 'media', 'alert_rules.json')
+
+
+class RuleSet:
+    """Regras compiladas: listas por Papel e índices ordenados de limites."""
+
+    def __init__(self, rules: list):
+        self.rules = {}
+        self.list_rules = []
+        self.columns = set()
+        thresholds = defaultdict(list)
+        for i, rule in enumerate(rules):
+            rule = dict(rule)
+            rule_id = str(rule.get('id') or f'regra-{i + 1}')
+            if rule_id in self.rules:
+                raise AlertRuleError(f"id de regra repetido: {rule_id}")
+            rule['id'] = rule_id
+            kind = rule.get('tipo')
+            if kind not in RULE_TYPES:
+                raise AlertRuleError(f"{rule_id}: tipo deve ser {' ou '.join(RULE_TYPES)}")
+            papeis = rule.get('papeis')
+            rule['papeis'] = [str(p).upper() for p in papeis] if papeis else None
+            if kind == 'lista':
+                events = rule.get('eventos') or list(LIST_EVENTS)
+                if any(e not in LIST_EVENTS for e in events):
+                    raise AlertRuleError(f"{rule_id}: eventos devem ser {LIST_EVENTS}")
+                rule['eventos'] = list(events)
+                self.list_rules.append(rule)
+            else:
+                if rule.get('op') not in OPERATORS or not rule.get('campo'):
+                    raise AlertRuleError(f"{rule_id}: limite precisa de campo e op ('<' ou '>')")
+                try:
+                    rule['valor'] = float(rule['valor'])
+                except (KeyError, TypeError, ValueError):
+                    raise AlertRuleError(f"{rule_id}: valor numérico obrigatório")
+                self.columns.add(rule['campo'])
+                for papel in rule['papeis'] or [None]:
+                    thresholds[(rule['campo'], rule['op'], papel)].append((rule['valor'], rule_id))
+            self.rules[rule_id] = rule
+
+        # (campo, op, Papel ou None) -> (limites ordenados, ids na mesma ordem)
+        self.thresholds = {}
+        for key, items in thresholds.items():
+            items.sort()
+            self.thresholds[key] = (np.array([v for v, _ in items], dtype=np.float64), [r for _, r in items])
+        # campo -> Papel (None = todos) -> operadores com índice
+        self._by_column = defaultdict(lambda: defaultdict(list))
+        for (campo, op, papel) in self.thresholds:
+            self._by_column[campo][papel].append(op)
+
+    def crossed(self, campo: str, papel: str, old: float, new: float) -> list:
+        """Ids das regras de `campo` cuja condição passou a valer de `old` para `new`."""
+        if not np.isfinite(new):
+            return []
+        fired = []
+        by_papel = self._by_column.get(campo)
+        if not by_papel:
+            return fired
+        keys = [(op, None) for op in by_papel.get(None, ())] + [(op, papel) for op in by_papel.get(papel, ())]
+        for op, only in keys:
+            values, ids = self.thresholds[(campo, op, only)]
+            if op == '>':
+                # valor > t: dispara para t em [old, new)
+                lo = int(np.searchsorted(values, old, 'left')) if np.isfinite(old) else 0
+                hi = int(np.searchsorted(values, new, 'left'))
+            else:
+                # valor < t: dispara para t em (new, old]
+                lo = int(np.searchsorted(values, new, 'right'))
+                hi = int(np.searchsorted(values, old, 'right')) if np.isfinite(old) else len(values)
+            fired.extend(ids[lo:hi])
+        return fired
+
+
+_rules_lock = threading.Lock()
+_rules_cache = (None, None)
+
+
+def load_rules(path: str = None) -> RuleSet:
+    """Regras do arquivo (recompiladas só quando ele muda); sem arquivo, só a regra da lista."""
+    global _rules_cache
+    path = path or rules_path()
+    try:
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        key = (path, None, None)
+    cached_key, rules = _rules_cache
+    if cached_key == key:
+        return rules
+    with _rules_lock:
+        if key[1] is None:
+            rules = RuleSet([{"id": "lista", "tipo": "lista"}])
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            rules = RuleSet(data.get('regras', []) if isinstance(data, dict) else data)
+        _rules_cache = (key, rules)
+    return rules
+
+
+def diff_snapshots(old, new, columns) -> dict:
+    """Linhas do snapshot `new` que mudaram em `columns` e entradas/saídas da lista final.
+
+    A comparação é por coluna (vetorizada); só as linhas alteradas seguem adiante.
+    """
+    # Mesmos Papéis na mesma ordem (o caso comum entre dois scrapings): alinhamento direto
+    same_rows = old.rows == new.rows and bytes(old._papel_buf) == bytes(new._papel_buf)
+    if same_rows:
+        old_rows = np.arange(new.rows)
+    else:
+        old_rows = np.array([old.row_index.get(p, -1) for p in new.papeis()], dtype=np.int64)
+    present = old_rows >= 0
+
+    changes = {}
+    for campo in columns:
+        if not new.has_column(campo):
+            continue
+        new_col = np.asarray(new.column(campo), dtype=np.float64)
+        old_col = np.full(new.rows, np.nan)
+        if old.has_column(campo):
+            old_col[present] = np.asarray(old.column(campo), dtype=np.float64)[old_rows[present]]
+        same = (old_col == new_col) | (np.isnan(old_col) & np.isnan(new_col))
+        rows = np.flatnonzero(~same)
+        if len(rows):
+            changes[campo] = (rows, old_col[rows], new_col[rows])
+
+    old_list = old.papeis(old.selected)
+    new_list = new.papeis(new.selected)
+    old_pos = {p: i for i, p in enumerate(old_list, start=1)}
+    new_pos = {p: i for i, p in enumerate(new_list, start=1)}
+    return {
+        "changes": changes,
+        "changed_rows": int(len(np.unique(np.concatenate([c[0] for c in changes.values()])))) if changes else 0,
+        "entered": [(p, new_pos[p], old_pos.get(p)) for p in new_list if p not in old_pos],
+        "left": [(p, old_pos[p]) for p in old_list if p not in new_pos],
+    }
+
+
+def evaluate(old, new, rules: RuleSet = None) -> list:
+    """Alertas disparados na passagem do snapshot `old` para `new`."""
+    rules = rules or load_rules()
+    diff = diff_snapshots(old, new, sorted(rules.columns))
+    base = {"versao": new.version, "versao_anterior": old.version, "data": now().isoformat()}
+    alerts = []
+
+    for rule in rules.list_rules:
+        only = set(rule['papeis']) if rule['papeis'] else None
+        if 'entrou' in rule['eventos']:
+            for papel, position, _ in diff['entered']:
+                if only is None or papel in only:
+                    alerts.append({**base, "regra": rule['id'], "tipo": "entrou", "papel": papel, "posicao": position})
+        if 'saiu' in rule['eventos']:
+            for papel, position in diff['left']:
+                if only is None or papel in only:
+                    alerts.append({**base, "regra": rule['id'], "tipo": "saiu", "papel": papel,
+                                   "posicao_anterior": position})
+
+    for campo, (rows, old_values, new_values) in diff['changes'].items():
+        for row, before, after in zip(rows.tolist(), old_values.tolist(), new_values.tolist()):
+            papel = new.papel(row)
+            for rule_id in rules.crossed(campo, papel, before, after):
+                rule = rules.rules[rule_id]
+                alerts.append({
+                    **base, "regra": rule_id, "tipo": "limite", "papel": papel, "campo": campo,
+                    "op": rule['op'], "valor": rule['valor'],
+                    "anterior": before if np.isfinite(before) else None, "atual": after,
+                })
+    logger.info("Alertas %s -> %s: %s linha(s) alterada(s), %s alerta(s)",
+                old.version, new.version, diff['changed_rows'], len(alerts))
+    return alerts
+
+
+# --- Sinks ------------------------------------------------------------------------
+
+class FileSink:
+    """Acrescenta cada alerta como uma linha JSON (ALERT_FILE, padrão media/alerts.jsonl)."""
+    name = 'file'
+
+    def __init__(self):
+        self.path = os.environ.get('ALERT_FILE') or os.path.join(settings.BASE_DIR, 'media', 'alerts.jsonl')
+
+    def send(self, batch: list):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(a, ensure_ascii=False) + '\n' for a in batch))
+
+
+class WebhookSink:
+    """POST de `{"alertas": [...]}` em ALERT_WEBHOOK_URL."""
+    name = 'webhook'
+
+    def __init__(self):
+        self.url = os.environ.get('ALERT_WEBHOOK_URL')
+        if not self.url:
+            raise AlertRuleError("ALERT_WEBHOOK_URL não definido")
+
+    def send(self, batch: list):
+        import requests
+        response = requests.post(self.url, json={"alertas": batch}, timeout=10)
+        response.raise_for_status()
+
+
+class EmailSink:
+    """Um e-mail por lote para ALERT_EMAIL_TO (lista separada por vírgula), via EMAIL_* do Django."""
+    name = 'email'
+
+    def __init__(self):
+        self.to = [a.strip() for a in os.environ.get('ALERT_EMAIL_TO', '').split(',') if a.strip()]
+        if not self.to:
+            raise AlertRuleError("ALERT_EMAIL_TO não definido")
+
+    def send(self, batch: list):
+        from django.core.mail import send_mail
+        lines = [describe(a) for a in batch]
+        send_mail(f"[invest22] {len(batch)} alerta(s)", '\n'.join(lines), None, self.to)
+
+
+SINKS = {cls.name: cls for cls in (FileSink, WebhookSink, EmailSink)}
+
+
+def describe(alert: dict) -> str:
+    if alert['tipo'] == 'entrou':
+        return f"{alert['papel']} entrou na lista (posição {alert['posicao']})"
+    if alert['tipo'] == 'saiu':
+        return f"{alert['papel']} saiu da lista (estava em {alert['posicao_anterior']})"
+    return (f"{alert['papel']}: {alert['campo']} {alert['op']} {alert['valor']:g} "
+            f"({alert['anterior']} -> {alert['atual']}) [{alert['regra']}]")
+
+
+def configured_sinks() -> list:
+    return [s.strip() for s in os.environ.get('ALERT_SINKS', '').split(',') if s.strip()]
+
+
+def make_sink(name: str):
+    if name in SINKS:
+        return SINKS[name]()
+    from django.utils.module_loading import import_string
+    return import_string(name)()
+
+
+def deliver(alerts: list, rules: RuleSet = None, sinks: list = None) -> list:
+    """Entrega os alertas em lotes por sink. Retorna os sinks que falharam."""
+    rules = rules or load_rules()
+    sinks = sinks if sinks is not None else configured_sinks()
+    batch_size = max(1, int(os.environ.get('ALERT_BATCH_SIZE', '100')))
+    failed = []
+    for name in sinks:
+        # Regras com "sinks" só vão para os sinks listados
+        batch = [a for a in alerts if name in (rules.rules.get(a['regra'], {}).get('sinks') or [name])]
+        if not batch:
+            continue
+        try:
+            sink = make_sink(name)
+            for i in range(0, len(batch), batch_size):
+                sink.send(batch[i:i + batch_size])
+        except Exception as e:
+            logger.warning("Falha ao entregar %s alerta(s) pelo sink %s: %s", len(batch), name, e)
+            failed.append(name)
+    return failed
+
+
+def run_alerts(previous_version: str, version: str, sinks: list = None, root: str = None) -> dict:
+    """Avalia a troca `previous_version` -> `version` do snapshot e entrega os alertas."""
+    from structure.snapshot import load_snapshot
+    old = load_snapshot(root, previous_version)
+    new = load_snapshot(root, version)
+    if old is None or new is None:
+        logger.warning("Alertas ignorados: snapshot %s ou %s não existe mais", previous_version, version)
+        return {"alerts": 0, "failed": []}
+    rules = load_rules()
+    alerts = evaluate(old, new, rules)
+    failed = deliver(alerts, rules, sinks) if alerts else []
+    return {"alerts": len(alerts), "failed": failed}
+
+
+def queue_alerts(published: dict):
+    """Enfileira a avaliação da troca de versão recém-publicada (sem Celery, roda aqui)."""
+    previous, version = published.get("previous_version"), published.get("snapshot_version")
+    if not configured_sinks() or not previous or previous == version:
+        return None
+    from invest22.scraping.tasks import evaluate_alerts_task
+    if hasattr(evaluate_alerts_task, 'apply_async'):
+        return evaluate_alerts_task.apply_async(args=(previous, version))
+    return run_alerts(previous, version)
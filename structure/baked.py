@@ -0,0 +1,117 @@
+# structure/baked.py
+# Snapshot "assado" na imagem do deploy (management command `bake_snapshot`).
+#
+# No build, o snapshot mais recente (media/ local ou S3) é gravado em BAKED_DIR
+# (padrão <BASE_DIR>/baked, fora de media/ porque o disco persistente é montado
+# por cima de media/ só no boot), com o mesmo layout de media/:
+#   baked/acoes_raw.csv, baked/acoes_filtradas.csv, baked/metadata.json
+#   baked/snapshot/<versão>/ (colunas binárias + table.html pré-renderizada)
+#   baked/snapshot/CURRENT
+#
+# No boot (StructureConfig.ready), `install_baked()` copia o snapshot para media/
+# quando media/ está vazio ou mais antigo, abre e aquece o snapshot e o instala no
+# processo: a primeira requisição não faz rede (S3, Redis) nem scraping.
+import json
+import logging
+import os
+import shutil
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+FILES = ('acoes_raw.csv', 'acoes_filtradas.csv', 'metadata.json')
+
+
+def baked_dir() -> str:
+    return os.environ.get('BAKED_DIR') or os.path.join(settings.BASE_DIR, 'baked')
+
+
+def _read_json(path: str) -> dict:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _copy_atomic(src: str, dst: str):
+    tmp = f'{dst}.tmp-{os.getpid()}'
+    shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+
+def _copy_version(src_root: str, dst_root: str, version: str):
+    """Copia snapshot/<versão> de uma raiz para outra (troca atômica do diretório)."""
+    dst = os.path.join(dst_root, version)
+    if os.path.isdir(dst):
+        return
+    os.makedirs(dst_root, exist_ok=True)
+    tmp = os.path.join(dst_root, f'.tmp-{version}-{os.getpid()}')
+    shutil.rmtree(tmp, ignore_errors=True)
+    shutil.copytree(os.path.join(src_root, version), tmp)
+    try:
+        os.replace(tmp, dst)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def write_fragment(snap) -> str:
+    """Grava a tabela da página (table.html) dentro do diretório da versão."""
+    from structure.formatting import snapshot_table_html
+    from structure.snapshot import FRAGMENT_FILE
+
+    html = snapshot_table_html(snap)
+    path = os.path.join(snap.path, FRAGMENT_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(html)
+    os.replace(path + '.tmp', path)
+    return html
+
+
+def _is_newer(baked_meta: dict, media_meta: dict) -> bool:
+    from structure.degradation import _parse_time
+    baked_at = _parse_time(baked_meta.get('last_scrape'))
+    media_at = _parse_time(media_meta.get('last_scrape'))
+    return baked_at is not None and (media_at is None or baked_at > media_at)
+
+
+def install_baked(source: str = None, media: str = None) -> dict:
+    """Instala o snapshot assado em media/ (se for mais novo) e aquece o snapshot do processo.
+
+    Retorna {"installed", "version", "ms"}; sem BAKED_DIR (desenvolvimento) não faz nada.
+    """
+    from structure.snapshot import activate_version, load_snapshot, read_current_version, swap_snapshot
+
+    started = time.perf_counter()
+    source = source or baked_dir()
+    media = media or os.path.join(settings.BASE_DIR, 'media')
+    version = read_current_version(os.path.join(source, 'snapshot'))
+    if not version:
+        return {"installed": False, "version": None, "ms": 0.0}
+
+    snap_root = os.path.join(media, 'snapshot')
+    media_meta = _read_json(os.path.join(media, 'metadata.json'))
+    installed = False
+    if read_current_version(snap_root) is None or _is_newer(_read_json(os.path.join(source, 'metadata.json')), media_meta):
+        os.makedirs(media, exist_ok=True)
+        _copy_version(os.path.join(source, 'snapshot'), snap_root, version)
+        # Dados primeiro, metadata por último (mesma ordem da publicação)
+        for name in FILES:
+            src = os.path.join(source, name)
+            if os.path.exists(src):
+                _copy_atomic(src, os.path.join(media, name))
+        # Sem anúncio no Redis: cada worker instala a mesma versão no próprio boot
+        activate_version(version, snap_root, announce=False)
+        installed = True
+
+    if os.path.abspath(snap_root) == os.path.abspath(os.path.join(settings.BASE_DIR, 'media', 'snapshot')):
+        snap = load_snapshot(snap_root)
+        if snap is not None:
+            swap_snapshot(snap.warm(), snap_root)
+            version = snap.version
+    ms = round((time.perf_counter() - started) * 1000, 1)
+    logger.info("Snapshot assado %s: versão %s (%.1f ms)", "instalado" if installed else "já presente", version, ms)
+    return {"installed": installed, "version": version, "ms": ms}
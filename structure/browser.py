@@ -0,0 +1,262 @@
+# structure/browser.py
+# Carregamento da tabela pelo Chrome headless (fallback quando o HTML não traz a tabela).
+#
+# Um `BrowserPool` por processo mantém um Chrome headless aquecido entre scrapings:
+# o caminho do chromedriver é resolvido uma vez (CHROMEDRIVER_PATH, arquivo de
+# cache ou PATH; o webdriver-manager só é chamado se nada disso existir), imagens
+# e CSS ficam desligados nas prefs do Chrome, e o navegador é reciclado depois de
+# BROWSER_MAX_PAGES páginas, quando a árvore de processos passa de
+# BROWSER_MAX_RSS_MB ou quando falha no health check.
+#
+# O Selenium é importado só aqui dentro, para que web e workers sem navegador
+# não precisem carregá-lo.
+import atexit
+import logging
+import os
+import shutil
+import threading
+import time
+
+from django.conf import settings
+
+from structure.ratelimit import get_limiter
+
+logger = logging.getLogger(__name__)
+
+
+def _driver_cache_file() -> str:
+    return os.environ.get('CHROMEDRIVER_CACHE_FILE') or os.path.join(settings.BASE_DIR, 'media', '.chromedriver_path')
+
+
+_driver_path = None
+
+
+def driver_path() -> str:
+    """Caminho do chromedriver, resolvido uma vez e lembrado entre processos."""
+    global _driver_path
+    if _driver_path and os.path.exists(_driver_path):
+        return _driver_path
+    path = os.environ.get('CHROMEDRIVER_PATH')
+    cache_file = _driver_cache_file()
+    if not path and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                cached = f.read().strip()
+            if cached and os.path.exists(cached):
+                path = cached
+        except OSError:
+            pass
+    if not path:
+        path = shutil.which('chromedriver')
+    if not path:
+        # Última opção: download/resolução pela rede, gravada para os próximos processos
+        from webdriver_manager.chrome import ChromeDriverManager
+        path = ChromeDriverManager().install()
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            tmp = cache_file + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(path)
+            os.replace(tmp, cache_file)
+        except OSError as e:
+            logger.warning("Não foi possível gravar o cache do chromedriver: %s", e)
+    _driver_path = path
+    return path
+
+
+def _tree_rss_mb(root_pid: int):
+    """RSS (MB) de `root_pid` e descendentes, lido de /proc. None fora do Linux."""
+    if not root_pid or not os.path.isdir('/proc'):
+        return None
+    children = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat', 'rb') as f:
+                stat = f.read()
+            # O nome do processo (campo 2) pode ter espaços: ppid vem depois do último ')'
+            ppid = int(stat[stat.rindex(b')') + 2:].split()[1])
+            children.setdefault(ppid, []).append(int(name))
+        except (OSError, ValueError, IndexError):
+            continue
+    total_kb = 0
+    pending = [root_pid]
+    while pending:
+        pid = pending.pop()
+        pending.extend(children.get(pid, []))
+        try:
+            with open(f'/proc/{pid}/status', 'r') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total_kb += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+    return total_kb / 1024
+
+
+class BrowserPool:
+    """Um Chrome headless reaproveitado entre páginas (um navegador por processo)."""
+
+    def __init__(self, max_pages: int = None, max_rss_mb: float = None, page_timeout: int = None):
+        self.max_pages = max_pages or int(os.environ.get('BROWSER_MAX_PAGES', '50'))
+        self.max_rss_mb = max_rss_mb or float(os.environ.get('BROWSER_MAX_RSS_MB', '768'))
+        self.page_timeout = page_timeout or int(os.environ.get('BROWSER_PAGE_TIMEOUT', '20'))
+        self._lock = threading.Lock()
+        self._driver = None
+        self.pages = 0
+        self.started_at = None
+        self.recycled = 0
+
+    def _options(self):
+        from selenium.webdriver.chrome.options import Options
+
+        options = Options()
+        options.add_argument("--headless=new")
+        options.add_argument("--disable-gpu")
+        options.add_argument("--no-sandbox")
+        options.add_argument("--disable-dev-shm-usage")
+        options.add_argument("--disable-extensions")
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        # A tabela é HTML puro: sem imagens, CSS nem fontes
+        options.add_experimental_option('prefs', {
+            'profile.managed_default_content_settings.images': 2,
+            'profile.managed_default_content_settings.stylesheets': 2,
+            'profile.managed_default_content_settings.fonts': 2,
+        })
+        # Não espera recursos secundários: o WebDriverWait aguarda a tabela
+        options.page_load_strategy = 'eager'
+        return options
+
+    def _start(self):
+        from selenium import webdriver
+        from selenium.webdriver.chrome.service import Service
+
+        started = time.perf_counter()
+        self._driver = webdriver.Chrome(service=Service(driver_path()), options=self._options())
+        self._driver.set_page_load_timeout(self.page_timeout * 2)
+        self.pages = 0
+        self.started_at = time.time()
+        logger.info("Chrome headless iniciado em %.1fs", time.perf_counter() - started)
+
+    def _quit(self):
+        driver, self._driver = self._driver, None
+        if driver is not None:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+    def _pid(self):
+        try:
+            return self._driver.service.process.pid
+        except Exception:
+            return None
+
+    def rss_mb(self):
+        return _tree_rss_mb(self._pid()) if self._driver is not None else None
+
+    def healthy(self) -> bool:
+        """Chromedriver vivo e respondendo a um comando simples."""
+        if self._driver is None:
+            return False
+        try:
+            process = self._driver.service.process
+            if process is not None and process.poll() is not None:
+                return False
+            return self._driver.execute_script('return 1') == 1
+        except Exception:
+            return False
+
+    def _needs_recycle(self) -> str:
+        if self.pages >= self.max_pages:
+            return f"{self.pages} páginas"
+        rss = self.rss_mb()
+        if rss is not None and rss > self.max_rss_mb:
+            return f"RSS {rss:.0f} MB"
+        return ''
+
+    def _ensure(self):
+        if self._driver is not None and not self.healthy():
+            logger.warning("Chrome headless não respondeu ao health check — reiniciando")
+            self._quit()
+        if self._driver is None:
+            self._start()
+
+    def warm(self):
+        """Sobe o navegador antes da primeira página (ex.: ao iniciar o worker)."""
+        with self._lock:
+            self._ensure()
+        return self
+
+    def load_table(self, url: str, element_id: str = 'resultado') -> str:
+        """Carrega `url` e devolve o outerHTML do elemento `element_id`."""
+        from selenium.common.exceptions import TimeoutException, WebDriverException
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        with self._lock:
+            for attempt in (1, 2):
+                self._ensure()
+                try:
+                    self._driver.get(url)
+                    table_el = WebDriverWait(self._driver, self.page_timeout).until(
+                        EC.presence_of_element_located((By.ID, element_id))
+                    )
+                    html = table_el.get_attribute("outerHTML")
+                    self.pages += 1
+                    break
+                except TimeoutException:
+                    # A página carregou sem a tabela: outro navegador não muda isso
+                    self.pages += 1
+                    raise
+                except WebDriverException as e:
+                    # Navegador travado/morto: descarta e tenta uma vez com um novo
+                    logger.warning("Falha no Chrome headless (%s) — tentativa %s/2", e.__class__.__name__, attempt)
+                    self._quit()
+                    if attempt == 2:
+                        raise
+            reason = self._needs_recycle()
+            if reason:
+                logger.info("Reciclando Chrome headless (%s)", reason)
+                self._quit()
+                self.recycled += 1
+            return html
+
+    def close(self):
+        with self._lock:
+            self._quit()
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> BrowserPool:
+    """Pool deste processo (refeito após fork)."""
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = BrowserPool()
+            _pool_pid = os.getpid()
+    return _pool
+
+
+def close_pool():
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.close()
+
+
+atexit.register(close_pool)
+
+
+def load_table_with_browser(url: str) -> str:
+    """Carrega a página no Chrome headless e devolve o HTML da tabela `resultado`."""
+    # O carregamento pelo navegador é outra requisição ao site: passa pelo mesmo limiter
+    get_limiter().acquire(url)
+    return get_pool().load_table(url)
@@ -0,0 +1,185 @@
+# structure/captures.py
+# Armazena o HTML bruto de cada `resultado.php` obtido, comprimido e endereçado
+# pelo conteúdo, para reprocessar offline (sem voltar ao site).
+#
+#   media/captures/<sha[:2]>/<sha256>.html.zst   (ou .html.gz sem zstandard)
+#   media/captures/index.jsonl                  uma linha por captura (data, url, sha)
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.utils.timezone import now
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except Exception:
+    zstandard = None
+
+INDEX_FILE = 'index.jsonl'
+_index_lock = threading.Lock()
+
+
+def captures_root() -> str:
+    return os.path.join(settings.BASE_DIR, 'media', 'captures')
+
+
+def _codec():
+    return 'zst' if zstandard is not None else 'gz'
+
+
+def _capture_path(root, sha, codec):
+    return os.path.join(root, sha[:2], f'{sha}.html.{codec}')
+
+
+class CaptureWriter:
+    """Comprime e faz hash do HTML em streaming, enquanto ele é consumido.
+
+    Uso: `writer.wrap(chunks)` repassa os pedaços adiante e grava uma cópia;
+    `commit()` move o arquivo para o endereço do conteúdo e registra no índice.
+    """
+
+    def __init__(self, url: str, root: str = None):
+        self.url = url
+        self.root = root or captures_root()
+        self.codec = _codec()
+        self._sha = hashlib.sha256()
+        self._size = 0
+        os.makedirs(self.root, exist_ok=True)
+        self._tmp_path = os.path.join(self.root, f'.tmp-{os.getpid()}-{threading.get_ident()}.{self.codec}')
+        self._raw = open(self._tmp_path, 'wb')
+        if self.codec == 'zst':
+            self._out = zstandard.ZstdCompressor(level=10).stream_writer(self._raw)
+        else:
+            self._out = gzip.GzipFile(fileobj=self._raw, mode='wb', compresslevel=6, mtime=0)
+
+    def write(self, chunk):
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if chunk:
+            self._sha.update(chunk)
+            self._size += len(chunk)
+            self._out.write(chunk)
+
+    def wrap(self, chunks):
+        if isinstance(chunks, (str, bytes)):
+            chunks = (chunks,)
+        for chunk in chunks:
+            self.write(chunk)
+            yield chunk
+
+    def _close(self):
+        try:
+            self._out.close()
+        finally:
+            if not self._raw.closed:
+                self._raw.close()
+
+    def commit(self, fetched_at: str = None) -> dict:
+        self._close()
+        sha = self._sha.hexdigest()
+        path = _capture_path(self.root, sha, self.codec)
+        if os.path.exists(path):
+            os.remove(self._tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self._tmp_path, path)
+        entry = {
+            "sha256": sha,
+            "fetched_at": fetched_at or now().isoformat(),
+            "url": self.url,
+            "codec": self.codec,
+            "size": self._size,
+            "path": os.path.relpath(path, self.root),
+        }
+        with _index_lock, open(os.path.join(self.root, INDEX_FILE), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        return entry
+
+    def discard(self):
+        self._close()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+
+def store_capture(body, url: str, fetched_at: str = None, root: str = None) -> dict:
+    """Grava um corpo HTML inteiro (str ou bytes) e retorna a entrada do índice."""
+    writer = CaptureWriter(url, root=root)
+    try:
+        writer.write(body)
+    except Exception:
+        writer.discard()
+        raise
+    return writer.commit(fetched_at)
+
+
+def iter_index(root: str = None):
+    root = root or captures_root()
+    path = os.path.join(root, INDEX_FILE)
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logger.warning("Linha inválida no índice de capturas: %s", line[:200])
+
+
+def find_capture(ref: str, root: str = None) -> dict:
+    """Localiza uma captura por prefixo do sha256 ou caminho. Levanta LookupError."""
+    root = root or captures_root()
+    if os.path.isfile(ref):
+        name = os.path.basename(ref)
+        return {"sha256": name.split('.')[0], "path": os.path.abspath(ref), "codec": name.rsplit('.', 1)[-1],
+                "fetched_at": None, "url": None}
+    matches = {}
+    for entry in iter_index(root):
+        if entry['sha256'].startswith(ref):
+            matches[entry['sha256']] = entry   # a última ocorrência vence
+    if not matches:
+        raise LookupError(f"Captura não encontrada: {ref}")
+    if len(matches) > 1:
+        raise LookupError(f"Prefixo ambíguo ({len(matches)} capturas): {ref}")
+    return next(iter(matches.values()))
+
+
+def read_capture(entry: dict, root: str = None) -> str:
+    root = root or captures_root()
+    path = entry['path'] if os.path.isabs(entry['path']) else os.path.join(root, entry['path'])
+    with open(path, 'rb') as f:
+        data = f.read()
+    if entry.get('codec') == 'zst' or path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError("zstandard não está instalado para ler capturas .zst")
+        data = zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    else:
+        data = gzip.decompress(data)
+    return data.decode('utf-8')
+
+
+def capture_stream(chunks, url: str, root: str = None):
+    """Repassa os pedaços de HTML adiante e grava a captura quando terminarem.
+
+    Se o consumo for interrompido (erro ou gerador abandonado) a captura é descartada.
+    """
+    writer = CaptureWriter(url, root=root)
+    try:
+        yield from writer.wrap(chunks)
+    except BaseException:
+        writer.discard()
+        raise
+    try:
+        writer.commit()
+    except Exception as e:
+        logger.warning("Falha ao gravar captura de %s: %s", url, e)
@@ -0,0 +1,301 @@
+# structure/degradation.py
+# Política de degradação da página inicial: serve sempre a tabela mais recente que
+# existir em alguma camada, sem esperar a fonte, e informa a idade dela.
+#
+#   snapshot   media/snapshot/CURRENT (mmap, já aberto no processo)
+#   csv        media/acoes_filtradas.csv
+#   historico  último dia de media/history/ (só se não houver snapshot)
+#   redis      chaves `acoes_filtradas` / `metadata` do cache do Django
+#   s3         acoes_filtradas.csv / metadata.json em AWS_S3_BUCKET
+#
+# As camadas locais são avaliadas a cada requisição (só metadados; a tabela é montada
+# apenas para a camada escolhida). Redis e S3 ficam em cache no processo por
+# DEGRADE_REMOTE_TTL segundos e são renovados em segundo plano; só são lidos na hora
+# quando não há nada local (ex.: disco efêmero logo após o deploy).
+#
+# Dados vencidos pelo calendário da B3 disparam uma atualização em segundo plano
+# (`scheduled_scrape`, que respeita cooldown e rate limit), no máximo uma por
+# DEGRADE_REFRESH_SECONDS por processo (0 desliga). A requisição nunca espera a fonte.
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import pytz
+from django.conf import settings
+from django.utils import timezone as dj_tz
+from django.utils.timezone import now
+
+logger = logging.getLogger(__name__)
+
+TIERS = ('snapshot', 'csv', 'historico', 'redis', 's3')
+TIER_LABELS = {
+    'snapshot': 'do snapshot local',
+    'csv': 'do CSV local',
+    'historico': 'do arquivo histórico',
+    'redis': 'do cache Redis',
+    's3': 'da cópia no S3',
+}
+_EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+
+def _parse_time(value):
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return moment if moment.tzinfo else pytz.utc.localize(moment)
+
+
+def _candidate(tier, last_scrape, render, version=None, checked=None) -> dict:
+    return {"tier": tier, "last_scrape": last_scrape, "render": render, "snapshot_version": version,
+            "checked": checked}
+
+
+def _records_html(records) -> str:
+    import pandas as pd
+    from structure.formatting import format_display_frame
+    df = pd.DataFrame(records)
+    return format_display_frame(df).to_html(classes="table table-striped", index=False, border=0)
+
+
+# --- Camadas locais --------------------------------------------------------------
+
+def _snapshot_candidate(meta: dict):
+    from structure.formatting import snapshot_table_html
+    from structure.snapshot import get_snapshot
+    snap = get_snapshot()
+    if snap is None or not len(snap.selected):
+        return None
+    # O metadata só vale para o snapshot que ele descreve
+    if meta.get('snapshot_version') in (None, snap.version):
+        last, checked = _parse_time(meta.get('last_scrape')), _parse_time(meta.get('last_checked'))
+    else:
+        last = checked = None
+    last = last or _parse_time(snap.manifest.get('created_at'))
+    return _candidate('snapshot', last, lambda: snapshot_table_html(snap), snap.version, checked)
+
+
+def _csv_candidate(meta: dict):
+    path = os.path.join(settings.BASE_DIR, 'media', 'acoes_filtradas.csv')
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    # O metadata é publicado junto com o CSV; o mtime muda em checkout/deploy
+    last = _parse_time(meta.get('last_scrape')) or datetime.fromtimestamp(mtime, tz=pytz.utc)
+
+    def render():
+        import pandas as pd
+        return _records_html(pd.read_csv(path, encoding='utf-8-sig', dtype=str))
+
+    return _candidate('csv', last, render, checked=_parse_time(meta.get('last_checked')))
+
+
+def _history_candidate():
+    from structure.formatting import snapshot_table_html
+    from structure.history import history_dir, list_days
+    from structure.snapshot import load_snapshot
+    for day in reversed(list_days()):
+        snap = load_snapshot(os.path.join(history_dir(day), 'snapshot'))
+        if snap is not None and len(snap.selected):
+            return _candidate('historico', _parse_time(snap.manifest.get('created_at')),
+                              lambda: snapshot_table_html(snap))
+    return None
+
+
+# --- Camadas remotas (cache no processo) ------------------------------------------
+
+def _redis_candidate():
+    from django.core.cache import cache
+    records, meta = cache.get('acoes_filtradas'), cache.get('metadata')
+    if not records:
+        return None
+    last = _parse_time(meta.get('last_scrape')) if isinstance(meta, dict) else None
+    return _candidate('redis', last, lambda: _records_html(records))
+
+
+def _s3_candidate():
+    bucket = os.environ.get('AWS_S3_BUCKET')
+    if not bucket:
+        return None
+    import pandas as pd
+    from structure.s3_utils import get_csv_df, get_json
+    meta = get_json(bucket, 'metadata.json')
+    df = pd.read_csv(get_csv_df(bucket, 'acoes_filtradas.csv'), encoding='utf-8-sig', dtype=str)
+    return _candidate('s3', _parse_time(meta.get('last_scrape')), lambda: _records_html(df))
+
+
+_remote_lock = threading.Lock()
+_remote = {"at": 0.0, "candidates": [], "loading": False}
+
+
+def _load_remote():
+    candidates = []
+    for tier, probe in (('redis', _redis_candidate), ('s3', _s3_candidate)):
+        try:
+            found = probe()
+        except Exception as e:
+            logger.warning("Camada %s indisponível: %s", tier, e)
+            found = None
+        if found is not None:
+            candidates.append(found)
+    with _remote_lock:
+        _remote.update(at=time.monotonic(), candidates=candidates, loading=False)
+    return candidates
+
+
+def _remote_candidates(block: bool) -> list:
+    ttl = float(os.environ.get('DEGRADE_REMOTE_TTL', '60'))
+    with _remote_lock:
+        fresh = _remote["at"] and time.monotonic() - _remote["at"] < ttl
+        if fresh:
+            return list(_remote["candidates"])
+        if not block:
+            if not _remote["loading"]:
+                _remote["loading"] = True
+                threading.Thread(target=_load_remote, daemon=True).start()
+            return list(_remote["candidates"])
+    return _load_remote()
+
+
+# --- Política ---------------------------------------------------------------------
+
+def _age_text(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    if minutes < 1:
+        return "agora"
+    if minutes < 60:
+        return f"há {minutes} min"
+    hours = minutes // 60
+    if hours < 48:
+        return f"há {hours} h"
+    return f"há {hours // 24} dias"
+
+
+def _sentence(notes: list) -> str:
+    text = "; ".join(notes)
+    return text[:1].upper() + text[1:] + "."
+
+
+def choose(candidates: list):
+    """Candidata mais recente; empate fica com a camada que vem antes em TIERS."""
+    candidates = [c for c in candidates if c is not None]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda c: (c["last_scrape"] or _EPOCH, -TIERS.index(c["tier"])))
+
+
+def serve_table(meta: dict = None, refresh: bool = True):
+    """Tabela mais recente entre as camadas, com idade e aviso. None se não houver nenhuma.
+
+    Com `refresh`, dados vencidos (e fonte fora de cooldown) disparam `request_refresh()`.
+
+    O dict devolvido traz `tabela_html`, `data_atual`, `snapshot_version` (só para o
+    snapshot local, que tem /dados/<versão>.json), `tier`, `stale` e `aviso`.
+    """
+    from structure.market_calendar import is_stale
+
+    meta = meta if isinstance(meta, dict) else {}
+    local = []
+    for tier, probe in (('snapshot', lambda: _snapshot_candidate(meta)), ('csv', lambda: _csv_candidate(meta))):
+        try:
+            local.append(probe())
+        except Exception as e:
+            logger.warning("Camada %s indisponível: %s", tier, e)
+    if not any(c is not None and c["tier"] == 'snapshot' for c in local):
+        try:
+            local.append(_history_candidate())
+        except Exception as e:
+            logger.warning("Camada historico indisponível: %s", e)
+    local = [c for c in local if c is not None]
+    candidates = local + _remote_candidates(block=not local)
+
+    tabela_html = None
+    while candidates and tabela_html is None:
+        best = choose(candidates)
+        try:
+            tabela_html = best["render"]()
+        except Exception as e:
+            logger.warning("Falha ao montar a tabela da camada %s: %s", best["tier"], e)
+            candidates = [c for c in candidates if c is not best]
+    if tabela_html is None:
+        return None
+
+    last = best["last_scrape"]
+    # Um 304 da origem (last_checked) confirma os dados locais sem mudar a data exibida
+    confirmed = max(filter(None, (last, best["checked"])), default=None)
+    stale = confirmed is None or is_stale(confirmed)
+    notes = []
+    if last is not None:
+        local_time = last.astimezone(dj_tz.get_default_timezone())
+        data_atual = local_time.strftime("%d/%m/%Y %H:%M")
+        if stale:
+            notes.append(f"Dados de {data_atual} ({_age_text((now() - last).total_seconds())})")
+    else:
+        data_atual = None
+        notes.append("Dados sem data de atualização")
+    if best["tier"] != 'snapshot':
+        notes.append(f"servidos {TIER_LABELS[best['tier']]}")
+    next_allowed = _parse_time(meta.get('next_allowed_attempt')) if meta.get('status') == 'forbidden' else None
+    if stale and next_allowed and next_allowed > now():
+        notes.append("a fonte está em pausa até "
+                     + next_allowed.astimezone(dj_tz.get_default_timezone()).strftime("%d/%m %H:%M"))
+    elif stale and refresh and _refresh_interval() > 0:
+        request_refresh()
+        notes.append("atualização em andamento")
+
+    return {
+        "tabela_html": tabela_html,
+        "data_atual": data_atual,
+        "snapshot_version": best["snapshot_version"],
+        "tier": best["tier"],
+        "stale": stale,
+        "aviso": _sentence(notes) if stale or best["tier"] != 'snapshot' else None,
+    }
+
+
+def _refresh_interval() -> float:
+    return float(os.environ.get('DEGRADE_REFRESH_SECONDS', '300'))
+
+
+_refresh_lock = threading.Lock()
+_last_refresh = [0.0]
+
+
+def request_refresh() -> bool:
+    """Enfileira `scheduled_scrape` no Celery (no máximo uma vez por DEGRADE_REFRESH_SECONDS).
+
+    O envio acontece numa thread para a requisição não esperar pelo broker; sem broker
+    disponível, as etapas rodam ali mesmo, no processo web (`run_steps`, sem Celery).
+    """
+    interval = _refresh_interval()
+    if interval <= 0:
+        return False
+    with _refresh_lock:
+        if _last_refresh[0] and time.monotonic() - _last_refresh[0] < interval:
+            return False
+        _last_refresh[0] = time.monotonic()
+
+    def run():
+        from invest22.scraping.tasks import scheduled_scrape
+        try:
+            async_result = scheduled_scrape.delay()
+            logger.info("Atualização enfileirada no Celery (%s)", async_result.id)
+            return
+        except Exception as e:
+            logger.warning("Broker indisponível (%s) — atualizando no próprio processo", e)
+        # Não passa por scheduled_scrape: ela enfileira a cadeia e precisaria do broker de novo
+        from structure.scrape_steps import run_steps
+        try:
+            result = run_steps()
+            logger.info("Atualização em segundo plano: snapshot %s",
+                        result.get("snapshot_version") if result else "sem alterações")
+        except Exception as e:
+            logger.warning("Falha na atualização em segundo plano: %s", e)
+
+    threading.Thread(target=run, daemon=True, name='degrade-refresh').start()
+    return True
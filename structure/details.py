@@ -0,0 +1,221 @@
+# structure/details.py
+# Scraper das páginas de detalhe (`detalhes.php?papel=XXXX`) dos Papéis selecionados.
+#
+# As páginas são buscadas em paralelo num pool de threads, com limite de
+# concorrência e token bucket por host, retries com o mesmo backoff do
+# `scrape_data` (SCRAPE_HTTP_MAX_ATTEMPTS / SCRAPE_HTTP_BACKOFF_BASE / ...)
+# e cache por ticker com TTL no cache do Django (Redis).
+import json
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import quote
+
+import requests
+from bs4 import BeautifulSoup
+from django.conf import settings
+from django.utils.timezone import now
+
+from structure.http_client import get_session
+from structure.ratelimit import HostLimiter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "https://www.fundamentus.com.br"
+CACHE_PREFIX = 'detalhes:'
+
+# Rótulo na página -> campo no resultado
+DETAIL_FIELDS = {
+    'Setor': 'setor',
+    'Subsetor': 'segmento',
+    'Nro. Ações': 'nro_acoes',
+    'Últ balanço processado': 'ultimo_balanco',
+}
+
+
+def base_url() -> str:
+    return os.environ.get('FUNDAMENTUS_BASE_URL', DEFAULT_BASE_URL).rstrip('/')
+
+
+def detail_url(papel: str, base: str = None) -> str:
+    return f"{(base or base_url()).rstrip('/')}/detalhes.php?papel={quote(str(papel), safe='')}"
+
+
+def _retry_settings():
+    return {
+        # Pelo menos uma tentativa (0 deixaria _get sem requisição nem erro para levantar)
+        'max_attempts': max(1, int(os.environ.get("SCRAPE_HTTP_MAX_ATTEMPTS", "4"))),
+        'base_backoff': float(os.environ.get("SCRAPE_HTTP_BACKOFF_BASE", "1.5")),
+        'max_backoff': float(os.environ.get("SCRAPE_HTTP_MAX_BACKOFF", "60")),
+        'jitter': float(os.environ.get("SCRAPE_HTTP_JITTER", "1.5")),
+    }
+
+
+def _backoff(attempt: int, cfg: dict, retry_after=None) -> float:
+    if retry_after:
+        try:
+            return min(cfg['max_backoff'], float(retry_after))
+        except (TypeError, ValueError):
+            pass
+    return min(cfg['max_backoff'], cfg['base_backoff'] * (2 ** (attempt - 1))) + random.uniform(0, cfg['jitter'])
+
+
+def _parse_int(value: str):
+    digits = value.replace('.', '').replace(' ', '')
+    return int(digits) if digits.isdigit() else None
+
+
+def _parse_date(value: str):
+    try:
+        return datetime.strptime(value, "%d/%m/%Y").date().isoformat()
+    except ValueError:
+        return None
+
+
+def parse_detail_page(html: str) -> dict:
+    """Extrai setor, segmento, número de ações e data do último balanço."""
+    soup = BeautifulSoup(html, "html.parser")
+    found = {}
+    for label_td in soup.select("td.label"):
+        label_el = label_td.select_one("span.txt") or label_td
+        label = label_el.get_text(strip=True)
+        if label not in DETAIL_FIELDS:
+            continue
+        data_td = label_td.find_next_sibling("td")
+        if data_td is None:
+            continue
+        found[DETAIL_FIELDS[label]] = data_td.get_text(strip=True)
+
+    if not found:
+        raise ValueError("Campos de detalhe não encontrados no HTML")
+
+    result = {field: found.get(field) for field in DETAIL_FIELDS.values()}
+    if result['nro_acoes'] is not None:
+        result['nro_acoes'] = _parse_int(result['nro_acoes'])
+    if result['ultimo_balanco'] is not None:
+        result['ultimo_balanco'] = _parse_date(result['ultimo_balanco'])
+    return result
+
+
+class DetailFetcher:
+    """Busca páginas de detalhe com concorrência limitada por host."""
+
+    def __init__(self, base: str = None, max_workers: int = None, limiter: HostLimiter = None,
+                 use_cache: bool = True, cache_ttl: int = None, session: requests.Session = None):
+        self.base = base or base_url()
+        self.max_workers = max_workers or int(os.environ.get('DETAILS_MAX_WORKERS', '4'))
+        self.limiter = limiter or HostLimiter()
+        self.use_cache = use_cache
+        self.cache_ttl = cache_ttl if cache_ttl is not None else int(os.environ.get('DETAILS_CACHE_TTL', str(24 * 3600)))
+        self.retry = _retry_settings()
+        # Sessão compartilhada do processo (structure/http_client.py): mesmos headers e pool
+        self.session = session or get_session()
+
+    def _cache_get(self, papel):
+        if not self.use_cache:
+            return None
+        try:
+            from django.core.cache import cache
+            return cache.get(CACHE_PREFIX + papel)
+        except Exception:
+            return None
+
+    def _cache_set(self, papel, value):
+        if not self.use_cache:
+            return
+        try:
+            from django.core.cache import cache
+            cache.set(CACHE_PREFIX + papel, value, timeout=self.cache_ttl)
+        except Exception:
+            logger.debug("Cache indisponível ao gravar detalhes de %s", papel)
+
+    def _get(self, url: str) -> str:
+        cfg = self.retry
+        last_error = None
+        for attempt in range(1, cfg['max_attempts'] + 1):
+            retry_after = None
+            try:
+                with self.limiter.slot(url):
+                    r = self.session.get(url, timeout=15)
+                self.limiter.limiter.note_response(url, r)
+                if r.status_code == 200:
+                    return r.text
+                retry_after = r.headers.get('Retry-After')
+                last_error = requests.HTTPError(f"status {r.status_code}", response=r)
+                if 400 <= r.status_code < 500 and r.status_code not in (403, 408, 429):
+                    break
+            except requests.RequestException as e:
+                last_error = e
+            if attempt < cfg['max_attempts']:
+                sleep_for = _backoff(attempt, cfg, retry_after)
+                logger.warning("Detalhes: falha em %s (tentativa %s/%s): %s — dormindo %.1fs",
+                               url, attempt, cfg['max_attempts'], last_error, sleep_for)
+                time.sleep(sleep_for)
+        raise last_error
+
+    def fetch_one(self, papel: str) -> dict:
+        cached = self._cache_get(papel)
+        if cached is not None:
+            return cached
+        data = parse_detail_page(self._get(detail_url(papel, self.base)))
+        data['papel'] = papel
+        data['fetched_at'] = now().isoformat()
+        self._cache_set(papel, data)
+        return data
+
+    def fetch_many(self, papeis) -> tuple:
+        """Retorna (resultados, erros), ambos dicts indexados pelo Papel."""
+        results, errors = {}, {}
+        papeis = list(dict.fromkeys(str(p).strip() for p in papeis if str(p).strip()))
+        if not papeis:
+            return results, errors
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(papeis))) as pool:
+            futures = {papel: pool.submit(self.fetch_one, papel) for papel in papeis}
+            for papel, future in futures.items():
+                try:
+                    results[papel] = future.result()
+                except Exception as e:
+                    logger.warning("Detalhes: falha ao obter %s: %s", papel, e)
+                    errors[papel] = str(e)
+        return results, errors
+
+
+def default_papeis():
+    """Papéis da lista final (snapshot binário ou acoes_filtradas.csv)."""
+    try:
+        from structure.snapshot import get_snapshot
+        snap = get_snapshot()
+        if snap is not None and len(snap.selected) > 0:
+            return snap.papeis(snap.selected)
+    except Exception:
+        pass
+    final_path = os.path.join(settings.BASE_DIR, 'media', 'acoes_filtradas.csv')
+    if os.path.exists(final_path):
+        import pandas as pd
+        return pd.read_csv(final_path, encoding='utf-8-sig', dtype=str)['Papel'].dropna().tolist()
+    return []
+
+
+def scrape_details(papeis=None, base: str = None, use_cache: bool = True, output_path: str = None) -> dict:
+    """Busca os detalhes e grava `media/detalhes.json`. Retorna o conteúdo gravado."""
+    papeis = default_papeis() if papeis is None else papeis
+    started = time.perf_counter()
+    fetcher = DetailFetcher(base=base, use_cache=use_cache)
+    results, errors = fetcher.fetch_many(papeis)
+
+    payload = {
+        "generated_at": now().isoformat(),
+        "source_url": fetcher.base,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        "tickers": results,
+        "errors": errors,
+    }
+    output_path = output_path or os.path.join(settings.BASE_DIR, 'media', 'detalhes.json')
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False, indent=4)
+    os.replace(output_path + '.tmp', output_path)
+    return payload
@@ -1,6 +1,12 @@
 import pandas as pd
 import numpy as np
 
+# Colunas usadas pelos filtros e colunas publicadas em acoes_filtradas.csv
+FILTER_COLUMNS = ['Liq.2meses', 'Mrg Ebit', 'EV/EBIT', 'P/L']
+FINAL_COLUMNS = ['Papel', 'Liq.2meses', 'Mrg Ebit', 'EV/EBIT', 'P/L']
+LIMIT = 22
+
+
 def clean_numeric(value):
     """Converte valores BR/EN para float sem alterar texto original."""
     if pd.isna(value):
@@ -24,6 +30,54 @@ def clean_numeric(value):
         return np.nan
 
 
+def passes_filters(liq, mrg_ebit, ev_ebit, pl):
+    """Critérios da lista (escalares ou arrays numpy já convertidos por clean_numeric)."""
+    return (
+        (liq >= 1_000_000)      # liquidez mínima
+        & (mrg_ebit > 0)        # margem > 0
+        & (ev_ebit > 0)         # EV/EBIT > 0
+        & (pl > 0)              # P/L > 0
+    )
+
+
+def top_k(values, idx, k=None, ascending=True):
+    """Os `k` itens de `idx` com menor (ou maior) `values`, já ordenados.
+
+    Usa np.argpartition no subconjunto e só ordena os `k` escolhidos
+    (O(m) + O(k log k)). Valores NaN/inf ficam de fora; empates seguem a
+    ordem das linhas.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    idx = np.asarray(idx, dtype=np.int64)
+    idx = idx[np.isfinite(values[idx])]
+    vals = values[idx] if ascending else -values[idx]
+    if k is not None and k < len(idx):
+        if k <= 0:
+            return idx[:0]
+        threshold = vals[np.argpartition(vals, k - 1)[k - 1]]
+        below = np.flatnonzero(vals < threshold)
+        ties = np.flatnonzero(vals == threshold)[:k - len(below)]
+        chosen = np.concatenate([below, ties])
+        idx, vals = idx[chosen], vals[chosen]
+    return idx[np.lexsort((idx, vals))]
+
+
+def filter_mask(liq, mrg_ebit, ev_ebit, pl):
+    return passes_filters(*(np.asarray(a, dtype=np.float64) for a in (liq, mrg_ebit, ev_ebit, pl)))
+
+
+def rank_rows(liq, mrg_ebit, ev_ebit, pl, limit=LIMIT):
+    """Índices das linhas aprovadas, ordenadas por EV/EBIT crescente (top `limit`)."""
+    mask = filter_mask(liq, mrg_ebit, ev_ebit, pl)
+    return top_k(ev_ebit, np.flatnonzero(mask), limit)
+
+
+def select_from_snapshot(snap, limit=LIMIT):
+    """Lista final direto do snapshot: máscara dos filtros + índice pré-ordenado de EV/EBIT."""
+    mask = filter_mask(*(snap.column(c) for c in FILTER_COLUMNS))
+    return snap.top_n('EV/EBIT', limit, mask=mask)
+
+
 def apply_filters(df_raw):
     df = df_raw.copy()
 
@@ -33,22 +87,9 @@ def apply_filters(df_raw):
     df['EVEBIT_num'] = df['EV/EBIT'].apply(clean_numeric)
     df['PL_num'] = df['P/L'].apply(clean_numeric)
 
-    # ================= FILTROS =================
-
-    df = df[df['Liq_num'] >= 1_000_000]     # liquidez mínima
-    df = df[df['MrgEbit_num'] > 0]          # margem > 0
-    df = df[df['EVEBIT_num'] > 0]           # EV/EBIT > 0
-    df = df[df['PL_num'] > 0]               # P/L > 0
-
-    # ================ ORDENAÇÃO =================
-    df = df.sort_values(by='EVEBIT_num', ascending=True)
-
-    # Lista final
-    result = df["Papel"].tolist()
-
-    # DEBUG
-    print("QTD:", len(result))
-    print(result)
+    # ================= FILTROS + ORDENAÇÃO =================
+    mask = filter_mask(df['Liq_num'], df['MrgEbit_num'], df['EVEBIT_num'], df['PL_num'])
+    order = top_k(df['EVEBIT_num'], np.flatnonzero(mask), LIMIT)
 
-    # LIMITA A 22 (se quiser)
-    return result[:22]
+    # Lista final (já limitada a 22)
+    return df["Papel"].iloc[order].tolist()
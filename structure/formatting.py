@@ -0,0 +1,185 @@
+# structure/formatting.py
+# Números no padrão brasileiro (1.234.567,89) para a tabela da página.
+#
+# `format_br` formata a coluna inteira de uma vez: arredonda em inteiros (mesmo
+# resultado do str.format usado antes) e agrupa os milhares fatiando a parte inteira
+# em blocos de 3 dígitos, sem função por célula. As colunas do snapshot
+# formatadas ficam em cache por versão, e `table_html` monta o <table> direto das
+# colunas de texto, com a mesma saída de DataFrame.to_html(classes=..., index=False, border=0).
+import functools
+
+import numpy as np
+import pandas as pd
+
+# Coluna -> (casas decimais, agrupar milhares)
+DISPLAY_FORMATS = {
+    'Liq.2meses': (0, True),
+    'Mrg Ebit': (2, False),
+    'EV/EBIT': (2, False),
+    'P/L': (2, False),
+}
+DISPLAY_COLUMNS = ['Papel', 'Liq.2meses', 'Mrg Ebit', 'EV/EBIT', 'P/L']
+TABLE_CLASSES = 'table table-striped'
+
+
+def format_value_br(value, decimals: int = 2, thousands: bool = True) -> str:
+    """Formata um único número; NaN vira ''."""
+    n = float(value)
+    if n != n:
+        return ''
+    if thousands and abs(n) >= 1000:
+        s = f"{n:,.{decimals}f}"
+        return s.replace(',', 'X').replace('.', ',').replace('X', '.')
+    return f"{n:.{decimals}f}".replace('.', ',')
+
+
+def parse_br(values) -> np.ndarray:
+    """Versão vetorizada de filters.clean_numeric: '1.234,56', '4,50', '81,71%' -> float."""
+    series = values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        return series.to_numpy(dtype=np.float64)
+    text = np.char.strip(np.asarray(series.fillna('').to_numpy(dtype=object), dtype=str))
+    text = np.char.replace(text, '%', '')
+    both = (np.char.find(text, '.') >= 0) & (np.char.find(text, ',') >= 0)
+    text = np.where(both, np.char.replace(text, '.', ''), text)
+    text = np.char.replace(text, ',', '.')
+    empty = (text == '') | (text == '-') | (text == 'N/A')
+    try:
+        return np.where(empty, 'nan', text).astype(np.float64)
+    except ValueError:
+        # Algum texto não numérico: conversão célula a célula, inválidos viram NaN
+        return pd.to_numeric(pd.Series(text, dtype=object), errors='coerce').to_numpy(dtype=np.float64, copy=True)
+
+
+def _digit_matrix(units: np.ndarray, width: int) -> np.ndarray:
+    """Inteiros >= 0 -> matriz (n, width) de dígitos ASCII, com zeros à esquerda."""
+    powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+    return ((units[:, None] // powers) % 10 + ord('0')).astype(np.uint8)
+
+
+def _as_bytes(matrix: np.ndarray) -> np.ndarray:
+    """Matriz (n, w) de bytes -> array de n strings b'...' de largura w."""
+    if matrix.shape[1] == 0:
+        return np.zeros(len(matrix), dtype='S1')
+    return np.ascontiguousarray(matrix).view(f'S{matrix.shape[1]}').ravel()
+
+
+def format_br(values, decimals: int = 2, thousands: bool = True, fallback=None) -> np.ndarray:
+    """Formata uma coluna numérica inteira no padrão BR (array de str).
+
+    Arredonda como '%.Nf' (valor binário exato): a conta é feita em inteiros, os
+    dígitos saem de uma matriz de bytes e os pontos de milhar entram a cada 3
+    colunas dessa matriz. Só empates aparentes (x,xx5) e valores enormes/infinitos
+    passam pelo formatador do Python. Posições NaN recebem o texto original de
+    `fallback` (quando houver), como o formatador antigo fazia com valores que não
+    eram números ('-', 'N/A').
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    missing = np.isnan(values)
+    scale = 10 ** decimals
+    scaled = np.abs(np.where(np.isfinite(values), values, 0.0)) * scale
+    slow = ~np.isfinite(values) | (scaled >= 2.0 ** 52)
+    slow |= np.abs(scaled - np.floor(scaled) - 0.5) <= scaled * 1e-12 + 1e-12
+    units = np.rint(np.where(slow, 0.0, scaled)).astype(np.int64)
+    integer = units // scale
+    if thousands:
+        # Menor que 1000 mas arredonda para 1000: o formatador antigo não agrupa
+        slow |= (np.abs(values) < 1000) & (integer >= 1000)
+    slow &= ~missing
+    integer[slow] = 0
+
+    width = max(1, len(str(int(integer.max())))) if n else 1
+    if thousands:
+        groups = -(-width // 3)
+        digits = _digit_matrix(integer, groups * 3).reshape(n, groups, 3)
+        dots = np.full((n, groups, 1), ord('.'), dtype=np.uint8)
+        digits = np.concatenate([dots, digits], axis=2).reshape(n, groups * 4)[:, 1:]
+    else:
+        digits = _digit_matrix(integer, width)
+    # Zeros (e pontos) de preenchimento saem, mas o último dígito sempre fica
+    text = np.char.add(np.char.lstrip(_as_bytes(digits[:, :-1]), b'0.'), _as_bytes(digits[:, -1:]))
+    text = np.char.add(np.where(np.signbit(values), b'-', b''), text)
+    if decimals:
+        frac = _as_bytes(_digit_matrix(units % scale, decimals))
+        text = np.char.add(np.char.add(text, b','), frac)
+    out = text.astype(str).astype(object)
+    if slow.any():
+        out[slow] = [format_value_br(v, decimals, thousands) for v in values[slow].tolist()]
+    if missing.any():
+        out[missing] = ''
+        if fallback is not None:
+            original = np.asarray(fallback, dtype=object)[missing]
+            out[missing] = [x if isinstance(x, str) else '' for x in original]
+    return out
+
+
+def format_display_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Cópia de `df` com as colunas de DISPLAY_FORMATS formatadas (texto)."""
+    df2 = df.copy()
+    for col, (decimals, thousands) in DISPLAY_FORMATS.items():
+        if col in df2.columns:
+            raw = df2[col]
+            df2[col] = format_br(parse_br(raw), decimals, thousands, fallback=raw.to_numpy(dtype=object))
+    return df2
+
+
+_column_cache = {}
+
+
+def snapshot_column(snap, name: str, decimals: int = 2, thousands: bool = True) -> np.ndarray:
+    """Coluna `name` do snapshot inteira formatada, memoizada por versão."""
+    key = (snap.version, name, decimals, thousands)
+    cached = _column_cache.get(key)
+    if cached is None:
+        if any(k[0] != snap.version for k in _column_cache):
+            # Versão nova publicada: as colunas da anterior não servem mais
+            _column_cache.clear()
+        cached = format_br(snap.column(name), decimals, thousands)
+        _column_cache[key] = cached
+    return cached
+
+
+def _escape(cells: np.ndarray) -> np.ndarray:
+    cells = np.asarray(cells, dtype=str)
+    for char, entity in (('&', '&amp;'), ('<', '&lt;'), ('>', '&gt;')):
+        cells = np.char.replace(cells, char, entity)
+    return cells
+
+
+@functools.lru_cache(maxsize=16)
+def _table_head(header: tuple, classes: str) -> str:
+    # Cabeçalho gerado pelo próprio pandas uma vez: mesmas classes/atributos do to_html
+    html = pd.DataFrame(columns=list(header)).to_html(classes=classes, index=False, border=0)
+    return html[:html.index('<tbody>')]
+
+
+def table_html(header, cells, classes: str = TABLE_CLASSES) -> str:
+    """<table> igual ao DataFrame.to_html(classes, index=False, border=0), a partir das colunas de texto."""
+    rows = None
+    for column in cells:
+        td = np.char.add(np.char.add('      <td>', _escape(column)), '</td>\n')
+        rows = td if rows is None else np.char.add(rows, td)
+    body = ''
+    if rows is not None and len(rows):
+        body = ''.join(np.char.add(np.char.add('    <tr>\n', rows), '    </tr>\n').tolist())
+    return f"{_table_head(tuple(header), classes)}<tbody>\n{body}  </tbody>\n</table>"
+
+
+def snapshot_table_html(snap, columns=None, rows=None, classes: str = TABLE_CLASSES) -> str:
+    """Tabela HTML das linhas `rows` (padrão: selecionadas) do snapshot, sem DataFrame."""
+    if columns is None and rows is None and classes == TABLE_CLASSES and getattr(snap, 'fragment', None):
+        # Snapshot preparado pelo bake_snapshot: a tabela da página já vem pronta
+        return snap.fragment
+    columns = list(columns or DISPLAY_COLUMNS)
+    rows = np.asarray(snap.selected if rows is None else rows, dtype=np.int64)
+    cells = []
+    for name in columns:
+        if name == 'Papel':
+            cells.append(np.array(snap.papeis(rows), dtype=object))
+        elif snap.has_column(name):
+            decimals, thousands = DISPLAY_FORMATS.get(name, (2, True))
+            cells.append(snapshot_column(snap, name, decimals, thousands)[rows])
+        else:
+            cells.append(np.full(len(rows), '', dtype=object))
+    return table_html(columns, cells, classes)
@@ -0,0 +1,75 @@
+# structure/history.py
+# Arquivo diário dos snapshots: media/history/<AAAA-MM-DD>/ tem o mesmo layout de
+# media/ (acoes_raw.csv, acoes_filtradas.csv, snapshot/<versão>/ + snapshot/CURRENT).
+import logging
+import os
+import shutil
+from datetime import datetime
+
+import pytz
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+TZ_SP = pytz.timezone('America/Sao_Paulo')
+
+
+def history_root() -> str:
+    return os.path.join(settings.BASE_DIR, 'media', 'history')
+
+
+def day_for(timestamp) -> str:
+    """Data (AAAA-MM-DD, horário de São Paulo) de um datetime ou ISO string."""
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    if timestamp.tzinfo is None:
+        timestamp = pytz.utc.localize(timestamp)
+    return timestamp.astimezone(TZ_SP).date().isoformat()
+
+
+def history_dir(day: str, root: str = None) -> str:
+    return os.path.join(root or history_root(), day)
+
+
+def archive_media(day: str, media_dir: str = None, root: str = None) -> str:
+    """Copia os artefatos atuais de `media_dir` para o arquivo do dia `day`."""
+    media_dir = media_dir or os.path.join(settings.BASE_DIR, 'media')
+    target = history_dir(day, root)
+    tmp = target + f'.tmp-{os.getpid()}'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    for name in ('acoes_raw.csv', 'acoes_filtradas.csv'):
+        src = os.path.join(media_dir, name)
+        if os.path.exists(src):
+            shutil.copy2(src, os.path.join(tmp, name))
+
+    from structure.snapshot import CURRENT_FILE, read_current_version
+    snap_root = os.path.join(media_dir, 'snapshot')
+    version = read_current_version(snap_root)
+    if version and os.path.isdir(os.path.join(snap_root, version)):
+        shutil.copytree(os.path.join(snap_root, version), os.path.join(tmp, 'snapshot', version))
+        with open(os.path.join(tmp, 'snapshot', CURRENT_FILE), 'w', encoding='utf-8') as f:
+            f.write(version)
+
+    # Troca o diretório do dia inteiro (a última versão do dia vence)
+    old = None
+    if os.path.exists(target):
+        old = target + f'.old-{os.getpid()}'
+        os.replace(target, old)
+    os.replace(tmp, target)
+    if old:
+        shutil.rmtree(old, ignore_errors=True)
+    return target
+
+
+def list_days(root: str = None) -> list:
+    """Dias arquivados em ordem crescente."""
+    root = root or history_root()
+    if not os.path.isdir(root):
+        return []
+    days = []
+    for name in os.listdir(root):
+        if len(name) == 10 and name[4] == '-' and name[7] == '-' and os.path.isdir(os.path.join(root, name)):
+            days.append(name)
+    return sorted(days)
@@ -0,0 +1,118 @@
+# structure/http_client.py
+# Cliente HTTP único para o site de origem.
+#
+# Uma `requests.Session` de vida longa por processo (pool de conexões keep-alive),
+# descompressão gzip/deflate (e brotli, se o pacote `brotli` estiver instalado),
+# requisições condicionais com ETag / Last-Modified e passagem obrigatória pelo
+# rate limiter compartilhado.
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from structure.ratelimit import get_limiter
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli  # noqa: F401  (habilita a decodificação 'br' no urllib3)
+    _ACCEPT_ENCODING = "gzip, deflate, br"
+except Exception:
+    try:
+        import brotlicffi  # noqa: F401
+        _ACCEPT_ENCODING = "gzip, deflate, br"
+    except Exception:
+        _ACCEPT_ENCODING = "gzip, deflate"
+
+DEFAULT_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36 Edg/120.0.0.0"
+    ),
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
+    "Accept-Language": "pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7,es;q=0.6",
+    "Accept-Encoding": _ACCEPT_ENCODING,
+    "DNT": "1",
+    "Connection": "keep-alive",
+    "Upgrade-Insecure-Requests": "1",
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class NotModified(Exception):
+    """A origem respondeu 304: o conteúdo não mudou desde o último scraping."""
+
+    def __init__(self, response):
+        super().__init__("Conteúdo não modificado (HTTP 304)")
+        self.response = response
+
+
+def get_session() -> requests.Session:
+    """Sessão compartilhada do processo (conexões reaproveitadas entre chamadas)."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                session.headers.update(DEFAULT_HEADERS)
+                pool_size = int(os.environ.get('SCRAPE_HTTP_POOL_SIZE', '8'))
+                # Retries só de conexão: status HTTP são tratados por quem chama (backoff/cooldown)
+                retries = Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.5, respect_retry_after_header=False)
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retries)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def validators_from_metadata(meta) -> dict:
+    """ETag / Last-Modified guardados no metadata.json do último scraping ok."""
+    if not isinstance(meta, dict) or meta.get('status') != 'success':
+        return {}
+    return {
+        'etag': meta.get('source_etag'),
+        'last_modified': meta.get('source_last_modified'),
+    }
+
+
+def validators_from_response(response) -> dict:
+    headers = getattr(response, 'headers', None) or {}
+    return {
+        'source_etag': headers.get('ETag'),
+        'source_last_modified': headers.get('Last-Modified'),
+    }
+
+
+def fetch(url: str, validators: dict = None, wait: bool = True, timeout: float = 15,
+          stream: bool = False, headers: dict = None) -> requests.Response:
+    """GET pelo cliente compartilhado.
+
+    - `validators`: {'etag', 'last_modified'} -> If-None-Match / If-Modified-Since;
+      se a origem responder 304 levanta NotModified.
+    - `wait=False`: não espera token do rate limiter (levanta RateLimited).
+    Não chama raise_for_status: o status fica a cargo de quem chama.
+    """
+    limiter = get_limiter()
+    if wait:
+        limiter.acquire(url)
+    else:
+        limiter.check(url)
+
+    req_headers = dict(headers or {})
+    validators = validators or {}
+    if validators.get('etag'):
+        req_headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        req_headers['If-Modified-Since'] = validators['last_modified']
+
+    r = get_session().get(url, timeout=timeout, stream=stream, headers=req_headers)
+    limiter.note_response(url, r)
+    if r.status_code == 304:
+        r.close()
+        raise NotModified(r)
+    return r
@@ -0,0 +1,137 @@
+from django.core.management.base import BaseCommand, CommandError
+import json
+import os
+import shutil
+import tempfile
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Grava o snapshot mais recente (media/ local ou S3) em BAKED_DIR para a imagem do deploy: '
+            'colunas binárias + tabela pré-renderizada, instaladas no boot sem rede')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', choices=('auto', 'local', 's3'), default='auto',
+                            help='De onde puxar o snapshot (auto = o mais recente entre media/ e S3)')
+        parser.add_argument('--output', help='Diretório de saída (padrão: BAKED_DIR ou <BASE_DIR>/baked)')
+        parser.add_argument('--measure', action='store_true',
+                            help='Depois de gravar, mede o cold start (instalação + primeira resposta 200) num media/ vazio')
+
+    def handle(self, *args, **options):
+        from structure.baked import baked_dir
+
+        output = os.path.abspath(options['output'] or baked_dir())
+        candidates = []
+        if options['source'] in ('auto', 'local'):
+            candidates.append(self._local_candidate())
+        if options['source'] in ('auto', 's3'):
+            candidates.append(self._s3_candidate())
+        candidates = [c for c in candidates if c is not None]
+        if not candidates:
+            raise CommandError("Nenhum snapshot encontrado (media/ local ou S3)")
+
+        from structure.degradation import _EPOCH, _parse_time
+        best = max(candidates, key=lambda c: _parse_time(c["metadata"].get('last_scrape')) or _EPOCH)
+
+        started = time.perf_counter()
+        tmp = f'{output}.tmp-{os.getpid()}'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        try:
+            version = best["write"](tmp)
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        old = None
+        if os.path.exists(output):
+            old = f'{output}.old-{os.getpid()}'
+            os.replace(output, old)
+        os.replace(tmp, output)
+        if old:
+            shutil.rmtree(old, ignore_errors=True)
+
+        size = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(output) for f in files)
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Snapshot {version} ({best['origin']}, last_scrape={best['metadata'].get('last_scrape')}) "
+            f"gravado em {output}: {size / 1024:.0f} KiB em {(time.perf_counter() - started) * 1000:.0f} ms"))
+
+        if options['measure']:
+            self._measure(output)
+
+    def _finish(self, target: str, snap_root: str, metadata: dict) -> str:
+        """Pré-renderiza a tabela e grava o metadata apontando para a versão assada."""
+        from structure.baked import write_fragment
+        from structure.snapshot import load_snapshot
+
+        snap = load_snapshot(snap_root)
+        write_fragment(snap)
+        # A idade exibida vem do metadata só quando a versão bate (structure/degradation.py)
+        metadata = {**metadata, "snapshot_version": snap.version}
+        with open(os.path.join(target, 'metadata.json'), 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, ensure_ascii=False, indent=4)
+        return snap.version
+
+    def _local_candidate(self):
+        from structure.baked import _copy_version
+        from structure.scrape_steps import media_dir, read_metadata
+        from structure.snapshot import activate_version, read_current_version, snapshot_root
+
+        version = read_current_version(snapshot_root())
+        metadata = read_metadata()
+        if not version or not isinstance(metadata, dict) or not metadata.get('last_scrape'):
+            return None
+
+        def write(target):
+            for name in ('acoes_raw.csv', 'acoes_filtradas.csv'):
+                src = os.path.join(media_dir(), name)
+                if os.path.exists(src):
+                    shutil.copy2(src, os.path.join(target, name))
+            snap_root = os.path.join(target, 'snapshot')
+            _copy_version(snapshot_root(), snap_root, version)
+            activate_version(version, snap_root, keep=1, announce=False)
+            return self._finish(target, snap_root, metadata)
+
+        return {"origin": "media/ local", "metadata": metadata, "write": write}
+
+    def _s3_candidate(self):
+        bucket = os.environ.get('AWS_S3_BUCKET')
+        if not bucket:
+            return None
+        import pandas as pd
+        from structure.s3_utils import get_csv_df, get_json
+        from structure.snapshot import write_snapshot_from_df
+
+        try:
+            metadata = get_json(bucket, 'metadata.json')
+            raw = pd.read_csv(get_csv_df(bucket, 'acoes_raw.csv'), encoding='utf-8-sig', dtype=str)
+            final = pd.read_csv(get_csv_df(bucket, 'acoes_filtradas.csv'), encoding='utf-8-sig', dtype=str)
+        except Exception as e:
+            self.stdout.write(self.style.WARNING(f"⚠️ Falha ao ler o S3 ({bucket}): {e}"))
+            return None
+
+        def write(target):
+            raw.to_csv(os.path.join(target, 'acoes_raw.csv'), index=False, encoding='utf-8-sig')
+            final.to_csv(os.path.join(target, 'acoes_filtradas.csv'), index=False, encoding='utf-8-sig')
+            snap_root = os.path.join(target, 'snapshot')
+            write_snapshot_from_df(raw, final['Papel'].astype(str).tolist(), root=snap_root)
+            return self._finish(target, snap_root, metadata)
+
+        return {"origin": f"s3://{bucket}", "metadata": metadata if isinstance(metadata, dict) else {}, "write": write}
+
+    def _measure(self, output: str):
+        """Boot com media/ vazio: instala o snapshot assado e faz a primeira requisição."""
+        from django.test import Client, override_settings
+        from structure.baked import install_baked
+
+        with tempfile.TemporaryDirectory() as base, override_settings(BASE_DIR=base):
+            started = time.perf_counter()
+            result = install_baked(output)
+            response = Client(HTTP_HOST='localhost').get('/')
+            total = (time.perf_counter() - started) * 1000
+        if response.status_code != 200:
+            raise CommandError(f"Cold start respondeu {response.status_code}")
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Cold start: instalação {result['ms']:.1f} ms, primeira resposta 200 em {total:.1f} ms"))
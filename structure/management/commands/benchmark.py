@@ -0,0 +1,175 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+import multiprocessing as mp
+import os
+import resource
+import statistics
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _proc_memory_kb():
+    """Retorna (rss_kb, pss_kb) do processo atual.
+
+    PSS divide as páginas compartilhadas pelo número de processos que as mapeiam,
+    então é a métrica certa para comparar memória "real" por worker.
+    Fora do Linux só temos o pico de RSS (ru_maxrss).
+    """
+    rss = pss = None
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1])
+                    break
+        with open('/proc/self/smaps_rollup', 'r') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    pss = int(line.split()[1])
+                    break
+    except OSError:
+        pass
+    if rss is None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss, pss
+
+
+def _snapshot_worker(mode, media_dir, barrier, results):
+    """Simula um worker gunicorn carregando os dados de uma das duas formas."""
+    import numpy as np
+    import pandas as pd
+    from structure.snapshot import load_snapshot
+
+    rss0, pss0 = _proc_memory_kb()
+    if mode == 'csv':
+        raw = pd.read_csv(os.path.join(media_dir, 'acoes_raw.csv'), encoding='utf-8-sig', dtype=str)
+        final = pd.read_csv(os.path.join(media_dir, 'acoes_filtradas.csv'), encoding='utf-8-sig', dtype=str)
+        keep = (raw, final)
+    else:
+        snap = load_snapshot(os.path.join(media_dir, 'snapshot'))
+        # Toca todas as páginas, como faria uma consulta que varre as colunas
+        checksum = float(np.nansum(snap.numeric))
+        keep = (snap, checksum, snap.papeis())
+    rss1, pss1 = _proc_memory_kb()
+
+    # Todos os workers vivos ao mesmo tempo para que o PSS reflita o compartilhamento
+    barrier.wait()
+    rss2, pss2 = _proc_memory_kb()
+    results.put({
+        'mode': mode,
+        'rss_kb': rss2,
+        'pss_kb': pss2,
+        'rss_delta_kb': rss1 - rss0,
+        'pss_delta_kb': (pss2 - pss0) if pss0 is not None and pss2 is not None else None,
+    })
+    barrier.wait()
+    del keep
+
+
+def _run_snapshot_suite(cmd, workers, media_dir):
+    from structure.snapshot import load_snapshot, write_snapshot_from_df
+    import pandas as pd
+    from structure.filters import apply_filters
+
+    snap_root = os.path.join(media_dir, 'snapshot')
+    if load_snapshot(snap_root) is None:
+        raw = pd.read_csv(os.path.join(media_dir, 'acoes_raw.csv'), encoding='utf-8-sig', dtype=str)
+        write_snapshot_from_df(raw, apply_filters(raw), root=snap_root)
+
+    ctx = mp.get_context('spawn')
+    for mode in ('csv', 'mmap'):
+        barrier = ctx.Barrier(workers)
+        results = ctx.Queue()
+        procs = [ctx.Process(target=_snapshot_worker, args=(mode, media_dir, barrier, results)) for _ in range(workers)]
+        for p in procs:
+            p.start()
+        rows = [results.get(timeout=120) for _ in procs]
+        for p in procs:
+            p.join()
+        rss = statistics.mean(r['rss_kb'] for r in rows)
+        delta = statistics.mean(r['rss_delta_kb'] for r in rows)
+        pss_deltas = [r['pss_delta_kb'] for r in rows if r['pss_delta_kb'] is not None]
+        pss_txt = f"{statistics.mean(pss_deltas):.0f} KB" if pss_deltas else "n/d"
+        cmd.stdout.write(
+            f"{mode:>5}: {workers} workers | RSS médio {rss:.0f} KB | "
+            f"custo dos dados por worker: RSS +{delta:.0f} KB, PSS +{pss_txt}"
+        )
+
+
+def _timed(fn, repeat=5):
+    """Mediana (ms) de `repeat` execuções de `fn`."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def _run_formatting_suite(cmd, workers, media_dir):
+    """Formatação pt-BR da tabela raw inteira: célula a célula vs. colunas vetorizadas."""
+    import pandas as pd
+    from structure.filters import apply_filters, clean_numeric
+    from structure.formatting import (format_br, format_value_br, parse_br, snapshot_column,
+                                      snapshot_table_html, table_html)
+    from structure.snapshot import load_snapshot, write_snapshot_from_df
+
+    raw = pd.read_csv(os.path.join(media_dir, 'acoes_raw.csv'), encoding='utf-8-sig', dtype=str)
+    columns = list(raw.columns[1:])
+
+    def cellwise():
+        df2 = raw.copy()
+        for col in columns:
+            df2[col] = df2[col].apply(lambda x: format_value_br(clean_numeric(x)) if pd.notna(clean_numeric(x)) else (x if pd.notna(x) else ''))
+        return df2
+
+    def vectorized():
+        df2 = raw.copy()
+        for col in columns:
+            df2[col] = format_br(parse_br(df2[col]), fallback=df2[col].to_numpy(dtype=object))
+        return df2
+
+    parsed = [parse_br(raw[col]) for col in columns]
+    formatted = vectorized()
+    cells = [formatted[c].to_numpy(dtype=object) for c in formatted.columns]
+    cmd.stdout.write(f"Tabela raw: {len(raw)} linhas x {len(columns)} colunas numéricas")
+    cmd.stdout.write(f"  célula a célula (apply):   {_timed(cellwise):8.1f} ms")
+    cmd.stdout.write(f"  vetorizado (format_br):    {_timed(vectorized):8.1f} ms")
+    cmd.stdout.write(f"  só format_br (já float):   {_timed(lambda: [format_br(v) for v in parsed]):8.1f} ms")
+    cmd.stdout.write(f"  DataFrame.to_html:         {_timed(lambda: formatted.to_html(classes='table table-striped', index=False, border=0)):8.1f} ms")
+    cmd.stdout.write(f"  table_html direto:         {_timed(lambda: table_html(list(formatted.columns), cells)):8.1f} ms")
+
+    snap_root = os.path.join(media_dir, 'snapshot')
+    snap = load_snapshot(snap_root)
+    if snap is None:
+        write_snapshot_from_df(raw, apply_filters(raw), root=snap_root)
+        snap = load_snapshot(snap_root)
+    first = _timed(lambda: snapshot_column(snap, 'Liq.2meses', 0, True), repeat=1)
+    cmd.stdout.write(f"  coluna do snapshot (1ª vez / memoizada): {first:.2f} ms / "
+                     f"{_timed(lambda: snapshot_column(snap, 'Liq.2meses', 0, True)):.3f} ms")
+    cmd.stdout.write(f"  tabela das selecionadas (snapshot_table_html): {_timed(lambda: snapshot_table_html(snap)):.2f} ms")
+
+
+SUITES = {
+    'snapshot': _run_snapshot_suite,
+    'formatting': _run_formatting_suite,
+}
+
+
+class Command(BaseCommand):
+    help = 'Executa benchmarks locais (memória/tempo) sobre os artefatos em media/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('suite', choices=sorted(SUITES.keys()))
+        parser.add_argument('--workers', type=int, default=4, help='Número de processos simulando workers')
+        parser.add_argument('--media-dir', default=None, help='Diretório com os artefatos (padrão: media/)')
+
+    def handle(self, *args, **options):
+        media_dir = options['media_dir'] or os.path.join(settings.BASE_DIR, 'media')
+        if not os.path.exists(os.path.join(media_dir, 'acoes_raw.csv')):
+            raise CommandError(f"acoes_raw.csv não encontrado em {media_dir}")
+        started = time.perf_counter()
+        SUITES[options['suite']](self, max(1, options['workers']), media_dir)
+        self.stdout.write(self.style.SUCCESS(f"✔ benchmark '{options['suite']}' concluído em {time.perf_counter() - started:.1f}s"))
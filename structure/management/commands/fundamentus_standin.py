@@ -0,0 +1,172 @@
+from django.core.management.base import BaseCommand, CommandError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import hashlib
+import json
+import random
+import threading
+import time
+import logging
+
+from structure.captures import find_capture, iter_index, read_capture
+
+logger = logging.getLogger(__name__)
+
+
+class StandinState:
+    """Páginas servidas, sorteio de falhas e contadores (compartilhados entre threads)."""
+
+    def __init__(self, pages, latency_ms, jitter_ms, p403, p429, p5xx, retry_after, seed=None):
+        self.pages = pages
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.p403, self.p429, self.p5xx = p403, p429, p5xx
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._next = 0
+        self.counts = {}
+        self.started = time.time()
+
+    def next_page(self):
+        with self._lock:
+            page = self.pages[self._next % len(self.pages)]
+            self._next += 1
+            return page
+
+    def draw(self):
+        """Sorteia a resposta desta requisição: (status, atraso em segundos)."""
+        with self._lock:
+            delay = max(0.0, self._random.gauss(self.latency_ms, self.jitter_ms)) / 1000 if self.jitter_ms else self.latency_ms / 1000
+            roll = self._random.random()
+        if roll < self.p403:
+            return 403, delay
+        if roll < self.p403 + self.p429:
+            return 429, delay
+        if roll < self.p403 + self.p429 + self.p5xx:
+            return 503, delay
+        return 200, delay
+
+    def count(self, status):
+        with self._lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            total = sum(self.counts.values())
+            return {
+                "requests": total,
+                "by_status": {str(k): v for k, v in sorted(self.counts.items())},
+                "uptime_s": round(time.time() - self.started, 1),
+                "pages": len(self.pages),
+            }
+
+
+def _make_handler(state: StandinState):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        server_version = 'fundamentus-standin'
+
+        def log_message(self, fmt, *args):
+            logger.debug("standin: " + fmt, *args)
+
+        def _send(self, status, body=b'', headers=None):
+            self.send_response(status)
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if self.command != 'HEAD' and body:
+                self.wfile.write(body)
+            state.count(status)
+
+        def do_GET(self):
+            if self.path.startswith('/__stats'):
+                body = json.dumps(state.stats()).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+
+            status, delay = state.draw()
+            if delay:
+                time.sleep(delay)
+            if status != 200:
+                headers = {'Content-Type': 'text/html; charset=utf-8'}
+                if status in (429, 503) and state.retry_after is not None:
+                    headers['Retry-After'] = str(state.retry_after)
+                self._send(status, f"<html><body>{status}</body></html>".encode('utf-8'), headers)
+                return
+
+            body, etag = state.next_page()
+            if self.headers.get('If-None-Match') == etag:
+                self._send(304, headers={'ETag': etag})
+                return
+            self._send(200, body, {'Content-Type': 'text/html; charset=utf-8', 'ETag': etag})
+
+        do_HEAD = do_GET
+
+    return Handler
+
+
+def _load_pages(refs, rotate):
+    """HTML das capturas pedidas (ou da última de resultado.php / todas com --rotate)."""
+    entries = []
+    if refs:
+        entries = [find_capture(ref) for ref in refs]
+    else:
+        index = [e for e in iter_index() if 'resultado.php' in (e.get('url') or '')]
+        entries = index if rotate else index[-1:]
+    if not entries:
+        raise CommandError("Nenhuma captura encontrada: rode um scraping (media/captures/) ou passe --capture")
+    pages = []
+    for entry in entries:
+        body = read_capture(entry).encode('utf-8')
+        pages.append((body, '"%s"' % hashlib.sha256(body).hexdigest()[:16]))
+    return pages
+
+
+class Command(BaseCommand):
+    help = 'Servidor local que imita resultado.php com capturas gravadas, latência e falhas injetadas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--capture', action='append', default=[],
+                            help='Captura a servir (prefixo do sha256 ou caminho); repetível')
+        parser.add_argument('--rotate', action='store_true',
+                            help='Sem --capture: alterna entre todas as capturas de resultado.php')
+        parser.add_argument('--latency-ms', type=float, default=300.0, help='Latência média por resposta')
+        parser.add_argument('--jitter-ms', type=float, default=100.0, help='Desvio padrão da latência')
+        parser.add_argument('--p403', type=float, default=0.0, help='Fração de respostas 403')
+        parser.add_argument('--p429', type=float, default=0.0, help='Fração de respostas 429')
+        parser.add_argument('--p5xx', type=float, default=0.0, help='Fração de respostas 503')
+        parser.add_argument('--retry-after', type=int, default=30, help='Retry-After (s) em 429/503; -1 omite')
+        parser.add_argument('--seed', type=int, default=None, help='Semente do sorteio de falhas/latência')
+
+    def handle(self, *args, **options):
+        pages = _load_pages(options['capture'], options['rotate'])
+        state = StandinState(
+            pages,
+            latency_ms=options['latency_ms'],
+            jitter_ms=options['jitter_ms'],
+            p403=options['p403'],
+            p429=options['p429'],
+            p5xx=options['p5xx'],
+            retry_after=None if options['retry_after'] < 0 else options['retry_after'],
+            seed=options['seed'],
+        )
+        server = ThreadingHTTPServer((options['host'], options['port']), _make_handler(state))
+        server.daemon_threads = True
+        url = f"http://{options['host']}:{server.server_port}/resultado.php"
+        self.stdout.write(self.style.SUCCESS(f"Stand-in servindo {len(pages)} página(s) em {url}"))
+        self.stdout.write(f"  use FUNDAMENTUS_URL={url} no web/worker; contadores em /__stats")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(json.dumps(state.stats(), ensure_ascii=False))
@@ -0,0 +1,145 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from urllib.parse import urlsplit
+import asyncio
+import json
+import os
+import time
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+async def _get(host, port, path, timeout):
+    """GET simples (HTTP/1.1, Connection: close). Retorna (status, bytes do corpo)."""
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(
+            f"GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nAccept-Encoding: gzip\r\n"
+            f"User-Agent: invest22-loadtest\r\nConnection: close\r\n\r\n".encode('latin-1')
+        )
+        await writer.drain()
+        data = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    status_line = data.split(b'\r\n', 1)[0].split()
+    status = int(status_line[1]) if len(status_line) > 1 else 0
+    head, _, body = data.partition(b'\r\n\r\n')
+    return status, len(body)
+
+
+def _mark_stale(metadata_path):
+    """Deixa o metadata vencido para a próxima requisição cair no scraping síncrono."""
+    try:
+        with open(metadata_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = {}
+    meta['last_scrape'] = '2000-01-03T13:00:00+00:00'
+    tmp = metadata_path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=4)
+    os.replace(tmp, metadata_path)
+
+
+async def _run(base, paths, rps, duration, timeout, max_inflight, stale_metadata):
+    parts = urlsplit(base)
+    host, port = parts.hostname, parts.port or 80
+    results = {path: [] for path in paths}
+    semaphore = asyncio.Semaphore(max_inflight)
+    total = max(1, int(rps * duration))
+    started = time.perf_counter()
+
+    async def one(i, path):
+        # Carga em malha aberta: a latência conta a partir do horário agendado,
+        # então fila no cliente (servidor lento) aparece nos percentis
+        scheduled = started + i / rps
+        async with semaphore:
+            if stale_metadata:
+                _mark_stale(stale_metadata)
+            try:
+                status, size = await _get(host, port, path, timeout)
+                error = None
+            except Exception as e:
+                status, size, error = 0, 0, e.__class__.__name__
+        results[path].append((time.perf_counter() - scheduled, status, size, error))
+
+    tasks = []
+    for i in range(total):
+        delay = started + i / rps - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(i, paths[i % len(paths)])))
+    await asyncio.gather(*tasks)
+    return results, time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = 'Gerador de carga (asyncio) com p50/p95/p99 e throughput por caminho'
+
+    def add_arguments(self, parser):
+        parser.add_argument('base', nargs='?', default='http://127.0.0.1:8000',
+                            help='URL base do servidor (padrão: http://127.0.0.1:8000)')
+        parser.add_argument('--path', action='append', default=[],
+                            help='Caminho a exercitar (repetível; padrão: /)')
+        parser.add_argument('--rps', type=float, default=20.0, help='Requisições por segundo (alvo)')
+        parser.add_argument('--duration', type=float, default=30.0, help='Duração em segundos')
+        parser.add_argument('--timeout', type=float, default=60.0, help='Timeout por requisição')
+        parser.add_argument('--max-inflight', type=int, default=500, help='Limite de requisições simultâneas')
+        parser.add_argument('--sync', action='store_true',
+                            help='Vence o metadata.json antes de cada requisição (mede o caminho de dados vencidos)')
+        parser.add_argument('--media-dir', default=None, help='media/ do servidor testado (para --sync)')
+        parser.add_argument('--json', action='store_true', help='Imprime o relatório em JSON')
+
+    def handle(self, *args, **options):
+        if options['rps'] <= 0 or options['duration'] <= 0:
+            raise CommandError('--rps e --duration precisam ser positivos')
+        paths = options['path'] or ['/']
+        stale = None
+        if options['sync']:
+            media_dir = options['media_dir'] or os.path.join(settings.BASE_DIR, 'media')
+            stale = os.path.join(media_dir, 'metadata.json')
+            backup = open(stale, 'rb').read() if os.path.exists(stale) else None
+
+        try:
+            results, elapsed = asyncio.run(_run(
+                options['base'].rstrip('/'), paths, options['rps'], options['duration'],
+                options['timeout'], options['max_inflight'], stale,
+            ))
+        finally:
+            if stale and backup is not None:
+                with open(stale, 'wb') as f:
+                    f.write(backup)
+
+        report = {'mode': 'sync' if stale else 'cached', 'target_rps': options['rps'],
+                  'elapsed_s': round(elapsed, 2), 'paths': {}}
+        for path, rows in results.items():
+            latencies = np.array([r[0] for r in rows]) * 1000
+            ok = [r for r in rows if 200 <= r[1] < 400]
+            by_status = {}
+            for _, status, _, error in rows:
+                key = error or str(status)
+                by_status[key] = by_status.get(key, 0) + 1
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (0, 0, 0)
+            report['paths'][path] = {
+                'requests': len(rows),
+                'ok': len(ok),
+                'throughput_rps': round(len(ok) / elapsed, 2),
+                'p50_ms': round(float(p50), 1),
+                'p95_ms': round(float(p95), 1),
+                'p99_ms': round(float(p99), 1),
+                'max_ms': round(float(latencies.max()), 1) if len(latencies) else 0,
+                'by_status': by_status,
+            }
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+            return
+        self.stdout.write(f"Modo {report['mode']} | alvo {options['rps']:g} req/s por {elapsed:.1f}s")
+        for path, r in report['paths'].items():
+            self.stdout.write(
+                f"  {path}: {r['requests']} req, {r['ok']} ok, {r['throughput_rps']} req/s | "
+                f"p50 {r['p50_ms']} ms, p95 {r['p95_ms']} ms, p99 {r['p99_ms']} ms, máx {r['max_ms']} ms | {r['by_status']}"
+            )
@@ -1,338 +1,304 @@
 from django.core.management.base import BaseCommand
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from webdriver_manager.chrome import ChromeDriverManager
-import pandas as pd
 import os
-from io import StringIO
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from structure.filters import apply_filters
+from structure.browser import load_table_with_browser
+from structure.pipeline import iter_table_rows, run_pipeline
+from structure.scrape_steps import (SOURCE_URL, filter_step, parse_step, publish_step, read_metadata, record_checked,
+                                    record_failure, record_precheck_failure, retry_countdown, stage_rows, upload_step,
+                                    validate_step)
+from structure.validation import ValidationFailed
+from structure.sources import configured_sources, fetch_first, get_health
+from structure.http_client import NotModified, fetch, validators_from_metadata, validators_from_response
+from structure.ratelimit import RateLimited
+from structure.captures import capture_stream, find_capture, iter_index, read_capture, store_capture
+from structure.history import day_for, history_dir
+from structure.timeseries import sync_series
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from django.conf import settings
+from urllib.parse import urlparse
 import json
-from django.utils.timezone import now
-from datetime import datetime, timedelta
-from django.utils import timezone as dj_tz
-import pytz
-import requests
 import time
-import random
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+class RetryPrecheck(RateLimited):
+    """Pre-check sem resposta utilizável; `attempt` é a próxima tentativa, daqui a `wait` segundos."""
 
+    def __init__(self, host: str, wait: float, attempt: int, status=None):
+        super().__init__(host, wait)
+        self.attempt = attempt
+        self.status = status
 
-class Command(BaseCommand):
-    help = 'Scrape the main table from Fundamentus, save raw and filtered'
-
-    def handle(self, *args, **kwargs):
-        url = "https://www.fundamentus.com.br/resultado.php"
-
-        # Configuráveis por env vars
-        max_attempts = int(os.environ.get("SCRAPE_HTTP_MAX_ATTEMPTS", "4"))
-        base_backoff = float(os.environ.get("SCRAPE_HTTP_BACKOFF_BASE", "1.5"))
-        max_backoff = float(os.environ.get("SCRAPE_HTTP_MAX_BACKOFF", "60"))
-        jitter = float(os.environ.get("SCRAPE_HTTP_JITTER", "1.5"))
 
-        # Etapa 0: checagem preliminar via requests para detectar 403/ban antes de abrir o webdriver
-        session = requests.Session()
-        session.headers.update({
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36 Edg/120.0.0.0",
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
-            "Accept-Language": "pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7,es;q=0.6",
-            "Accept-Encoding": "gzip, deflate, br",
-            "DNT": "1",
-            "Connection": "keep-alive",
-            "Upgrade-Insecure-Requests": "1",
-            "Sec-Fetch-Dest": "document",
-            "Sec-Fetch-Mode": "navigate",
-            "Sec-Fetch-Site": "none",
-            "Sec-Fetch-User": "?1",
-            "Cache-Control": "max-age=0",
-        })
+def _replay_to_history(entry, day):
+    """Reprocessa uma captura para media/history/<day>/ (executado no pool de processos)."""
+    html = read_capture(entry)
+    result = run_pipeline(iter_table_rows(html), media_dir=history_dir(day))
+    return {
+        "day": day,
+        "sha256": entry["sha256"],
+        "rows_raw": result["rows_raw"],
+        "rows_filtered": result["rows_filtered"],
+        "snapshot_version": result["snapshot_version"],
+        "wall_ms": result["wall_ms"],
+    }
 
-        attempt = 0
-        allowed = False
-        last_status = None
-        while attempt < max_attempts:
-            try:
-                attempt += 1
-                # Pequena pausa para simular comportamento humano
-        time.sleep(2)
-        r = session.get(url, timeout=15)
-                last_status = r.status_code
-                if r.status_code == 200:
-                    allowed = True
-                    break
-                elif r.status_code == 403:
-                    # se 403, log diagnóstico (opcional) e espera com backoff exponencial + jitter e tenta novamente
-                    if os.environ.get('SCRAPE_VERBOSE_LOGGING') == '1':
-                        try:
-                            resp_headers = dict(r.headers) if getattr(r, 'headers', None) is not None else None
-                            body = getattr(r, 'text', '')
-                            if isinstance(body, str):
-                                body = body[:1000].replace('\n', ' ').replace('\r', ' ')
-                            logger.warning('Pre-scrape diagnostic: 403 detected (command). resp_headers=%s body_snip=%s', {k: resp_headers.get(k) for k in ['Server', 'X-Cache', 'Content-Type'] if resp_headers and k in resp_headers}, body)
-                        except Exception:
-                            logger.debug('Erro ao coletar dados de resposta para logging verboso (command)')
-                    sleep_for = min(max_backoff, base_backoff * (2 ** (attempt - 1))) + random.uniform(0, jitter)
-                    logger.warning("Pre-scrape check: recebido 403, tentativa %s/%s — dormindo %.1fs", attempt, max_attempts, sleep_for)
-                    time.sleep(sleep_for)
-                    continue
-                else:
-                    # para outros status 5xx/4xx, também tenta com backoff
-                    sleep_for = min(max_backoff, base_backoff * (2 ** (attempt - 1))) + random.uniform(0, jitter)
-                    logger.warning("Pre-scrape check: status %s, tentativa %s/%s — dormindo %.1fs", r.status_code, attempt, max_attempts, sleep_for)
-                    time.sleep(sleep_for)
-                    continue
-            except Exception as e:
-                sleep_for = min(max_backoff, base_backoff * (2 ** (attempt - 1))) + random.uniform(0, jitter)
-                logger.warning("Pre-scrape check: erro na tentativa %s/%s: %s — dormindo %.1fs", attempt, max_attempts, e, sleep_for)
-                time.sleep(sleep_for)
-
-        if not allowed:
-            # grava metadata com forbidden para evitar tentativas repetidas
-            try:
-                media_dir = os.path.join(settings.BASE_DIR, 'media')
-                os.makedirs(media_dir, exist_ok=True)
-                # Calcula backoff exponencial persistido via forbidden_count
-                try:
-                    existing = None
-                    metadata_path = os.path.join(settings.BASE_DIR, "media", "metadata.json")
-                    if os.path.exists(metadata_path):
-                        try:
-                            with open(metadata_path, 'r', encoding='utf-8') as f:
-                                existing = json.load(f)
-                        except Exception:
-                            existing = None
 
-                    existing_count = int(existing.get('forbidden_count', 0)) if isinstance(existing, dict) else 0
-                    new_count = existing_count + 1
-
-                    base_hours = int(os.environ.get("SCRAPE_BACKOFF_BASE_HOURS", "2"))
-                    max_hours = int(os.environ.get("SCRAPE_BACKOFF_MAX_HOURS", "168"))
-                    backoff_hours = min(base_hours * (2 ** (new_count - 1)), max_hours)
-                    next_allowed = (now() + timedelta(hours=backoff_hours)).isoformat()
+class Command(BaseCommand):
+    help = 'Scrape the main table from Fundamentus, save raw and filtered'
 
-                    tz_sp = pytz.timezone('America/Sao_Paulo')
-                    metadata = {
-                        "last_scrape": now().isoformat(),
-                        "last_scrape_local": now().astimezone(tz_sp).strftime("%d/%m/%Y %H:%M:%S %z"),
-                        "last_attempt": now().isoformat(),
-                        "last_attempt_local": now().astimezone(tz_sp).strftime("%d/%m/%Y %H:%M:%S %z"),
-                        "next_allowed_attempt": next_allowed,
-                        "next_allowed_attempt_local": (datetime.fromisoformat(next_allowed).astimezone(tz_sp).strftime("%d/%m/%Y %H:%M:%S %z")),
-                        "status": "forbidden" if last_status == 403 else "error",
-                        "http_status": last_status,
-                        "forbidden_count": new_count,
-                        "backoff_hours": backoff_hours,
-                        "source_url": url
-                    }
+    def add_arguments(self, parser):
+        parser.add_argument('--replay', metavar='CAPTURA', default=None,
+                            help='Reprocessa uma captura (prefixo do sha256 ou caminho) em vez de acessar o site')
+        parser.add_argument('--replay-all', action='store_true',
+                            help='Reconstrói media/history/ a partir de todas as capturas (uma por dia)')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Processos usados no --replay-all (padrão: nº de CPUs)')
+        parser.add_argument('--attempt', type=int, default=None,
+                            help='Tentativa do pre-check (usada pela scrape_data_task, que reagenda as falhas)')
 
-                    # Só grava se não houver um next_allowed_attempt futuro já presente
-                    should_write = True
-                    try:
-                        if existing and existing.get('status') == 'forbidden' and existing.get('next_allowed_attempt'):
-                            existing_next = datetime.fromisoformat(existing.get('next_allowed_attempt'))
-                            if existing_next > now().astimezone(dj_tz.get_default_timezone()):
-                                should_write = False
-                    except Exception:
-                        should_write = True
+    def handle(self, *args, **kwargs):
+        url = SOURCE_URL
+
+        if kwargs.get('replay'):
+            return self._replay_one(kwargs['replay'])
+        if kwargs.get('replay_all'):
+            return self._replay_all(kwargs.get('workers'))
+
+        # Tentativas do pre-check (SCRAPE_HTTP_MAX_ATTEMPTS); o backoff entre elas vem de
+        # retry_countdown e é cumprido pela fila do Celery, não por sleep no processo
+        max_attempts = max(1, int(os.environ.get("SCRAPE_HTTP_MAX_ATTEMPTS", "4")))
+        attempt = kwargs.get('attempt') or 1
+
+        # Etapa 0: GET condicional pelo cliente HTTP compartilhado (keep-alive, gzip/br,
+        # rate limit). Detecta 403/ban antes de abrir o webdriver e, com o ETag /
+        # Last-Modified do último scraping, termina num 304 barato se nada mudou.
+        validators = {}
+        try:
+            with open(os.path.join(settings.BASE_DIR, "media", "metadata.json"), 'r', encoding='utf-8') as f:
+                validators = validators_from_metadata(json.load(f))
+        except Exception:
+            validators = {}
 
-                    if should_write:
-                        meta_tmp = metadata_path + '.tmp'
-                        with open(meta_tmp, "w", encoding="utf-8") as f:
-                            json.dump(metadata, f, ensure_ascii=False, indent=4)
-                        os.replace(meta_tmp, metadata_path)
-                        self.stdout.write(self.style.ERROR(f"Pre-check falhou (status={last_status}). metadata.json atualizado com status '{metadata['status']}' (backoff={backoff_hours}h)."))
-                    else:
-                        # Atualiza apenas forbidden_count se estiver em cooldown para aumentar backoff
-                        try:
-                            existing = existing or {}
-                            existing['forbidden_count'] = new_count
-                            with open(metadata_path + '.tmp', 'w', encoding='utf-8') as f:
-                                json.dump(existing, f, ensure_ascii=False, indent=4)
-                            os.replace(metadata_path + '.tmp', metadata_path)
-                            self.stdout.write(self.style.WARNING("Pre-check falhou, mas já existe cooldown ativo — incrementado forbidden_count."))
-                        except Exception:
-                            self.stdout.write(self.style.WARNING("Pre-check falhou e não foi possível incrementar forbidden_count."))
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f"Falha ao calcular/gravar backoff metadata: {e}"))
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f"Falha ao escrever metadata após pre-check: {e}"))
+        try:
+            r, last_status = self._precheck(url, validators, attempt, max_attempts)
+        except NotModified:
+            # Nada mudou na origem: sem parse, sem escrita
+            record_checked()
+            self.stdout.write(self.style.SUCCESS("✔ Página de origem sem alterações (HTTP 304) — nada a fazer."))
+            return
+        except RateLimited as e:
+            if kwargs.get('attempt') is not None:
+                # Chamado pela scrape_data_task: ela reagenda com o countdown
+                raise
+            if self._retry_later(getattr(e, 'attempt', attempt), e.wait):
+                return
+            r, last_status = None, getattr(e, 'status', None)
+
+        if r is None:
+            get_health().record('fundamentus', False, status=last_status)
+            if self._failover(url):
+                return
+            # grava metadata com forbidden/erro e backoff para evitar tentativas repetidas
+            level, message = record_precheck_failure(url, last_status)
+            self.stdout.write(getattr(self.style, level)(message))
             return
 
-        # Pequeno atraso aleatório antes de abrir o webdriver para dispersar solicitações
-        time.sleep(random.uniform(0.5, 2.5))
-
-        options = Options()
-        options.add_argument("--headless=new")
-        options.add_argument("--disable-gpu")
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-dev-shm-usage")
-
-        service = Service(ChromeDriverManager().install())
-        driver = webdriver.Chrome(service=service, options=options)
-        
-
-        
         try:
-            driver.get(url)
-
-            table_el = WebDriverWait(driver, 20).until(
-                EC.presence_of_element_located((By.ID, "resultado"))
-            )
-
-            table_html = table_el.get_attribute("outerHTML")
-
-            # ============================================================
-            # PASSO 1: Faz scraping e monta df_raw SEM ALTERAR NADA
-            # ============================================================
-            from bs4 import BeautifulSoup
-
-            soup = BeautifulSoup(table_html, "html.parser")
-            rows = []
-
-            for tr in soup.select("tr"):
-                tds = [td.get_text(strip=True) for td in tr.find_all(["td", "th"])]
-                if tds:
-                    rows.append(tds)
-
-            import pandas as pd
-            df_raw = pd.DataFrame(rows[1:], columns=rows[0])
-            
-            # CRÍTICO: Converte todas as colunas para string para preservar formato
-            for col in df_raw.columns:
-                df_raw[col] = df_raw[col].apply(
-                    lambda x: str(x) if pd.notna(x) and str(x) != 'nan' else ''
-                )
-
-            # Salva acoes_raw.csv exatamente como veio (sem alterações)
-            raw_path = os.path.join(settings.BASE_DIR, 'media', 'acoes_raw.csv')
-            os.makedirs(os.path.dirname(raw_path), exist_ok=True)
-            raw_tmp = raw_path + '.tmp'
-            df_raw.to_csv(raw_tmp, index=False, encoding='utf-8-sig')
-            os.replace(raw_tmp, raw_path)
-            self.stdout.write(self.style.SUCCESS(f"✔ acoes_raw.csv salvo: {raw_path}"))
-
-            # ============================================================
-
-            # Garante que lista_final é uma lista PLANA de strings
-            lista_final = apply_filters(df_raw)
-
-            # Achata a lista se vier como lista de listas/tuplas
-            lista_final = [x[0] if isinstance(x, (list, tuple)) else x for x in lista_final]
-
-            # Converte tudo para string
-            lista_final = [str(x).strip() for x in lista_final]
-
             # ============================================================
-            # PASSO 3: Montagem final - reabre raw, seleciona e reordena
+            # PASSO 1-3: pipeline em streaming (raw em blocos + filtros + snapshot)
             # ============================================================
-            # Reabre acoes_raw.csv (garante que está lendo dados originais)
-            df_raw_reload = pd.read_csv(
-                raw_path,
-                encoding='utf-8-sig',
-                dtype=str  # Mantém tudo como string
+            # As linhas são lidas do HTML por um gerador; o CSV raw é gravado em
+            # blocos e acoes_filtradas.csv sai das colunas já convertidas, sem reler o raw.
+            # A resposta do pre-check já é a página completa: usa o corpo direto.
+            # O navegador só é aberto se a tabela não vier no HTML (ex.: conteúdo via JS).
+            # Tudo vai para um staging: media/ só muda depois da validação.
+            source_validators = validators_from_response(r)
+            if r.encoding is None:
+                r.encoding = r.apparent_encoding
+            try:
+                # O corpo também vai comprimido para media/captures/ (replay offline)
+                chunks = capture_stream(r.iter_content(chunk_size=64 * 1024, decode_unicode=True), url)
+                staged = stage_rows(iter_table_rows(chunks, fallback=False), url, **source_validators)
+            except ValueError as e:
+                logger.warning("Tabela não encontrada na resposta HTTP (%s) — usando navegador", e)
+                table_html = self._load_table_with_browser(url)
+                try:
+                    store_capture(table_html, url)
+                except Exception as capture_error:
+                    logger.warning("Falha ao gravar captura do navegador: %s", capture_error)
+                staged = stage_rows(iter_table_rows(table_html), url, **source_validators)
+            self.stdout.write(
+                f"Pipeline: {staged['rows_raw']} linhas em {staged['pipeline']['wall_ms']:.0f} ms, "
+                f"pico de memória {staged['pipeline']['peak_kb']} KB"
             )
 
-            # Seleciona apenas os tickers da lista_final
-            df_final = df_raw_reload[df_raw_reload['Papel'].isin(lista_final)]
-
-            # Reordena exatamente na ordem da lista_final
-            df_final = df_final.set_index('Papel').loc[lista_final].reset_index()
-
-            # ---- FILTRO DE COLUNAS AQUI ----
-            colunas_finais = ['Papel', 'Liq.2meses', 'Mrg Ebit', 'EV/EBIT', 'P/L']
-            df_final = df_final[colunas_finais]
-
-            # Salva acoes_filtradas.csv (sem alterar conteúdo, apenas seleção e ordem)
-            final_path = os.path.join(settings.BASE_DIR, 'media', 'acoes_filtradas.csv')
-            final_tmp = final_path + '.tmp'
-            df_final.to_csv(final_tmp, index=False, encoding='utf-8-sig')
-            os.replace(final_tmp, final_path)
-            self.stdout.write(self.style.SUCCESS("✔ acoes_filtradas.csv salvo."))
-
             # ============================================================
-            # PASSO 4 → METADATA (agora está no local correto)
+            # PASSO 4 → VALIDAÇÃO e publicação (raw, filtrado, snapshot, metadata, histórico)
             # ============================================================
-            tz_sp = pytz.timezone('America/Sao_Paulo')
-            metadata = {
-                "last_scrape": now().isoformat(),
-                "last_scrape_local": now().astimezone(tz_sp).strftime("%d/%m/%Y %H:%M:%S %z"),
-                "rows_raw": len(df_raw),
-                "rows_filtered": len(df_final),
-                "source_url": url,
-                "status": "success"
-            }
-
-            metadata_path = os.path.join(settings.BASE_DIR, "media", "metadata.json")
-            meta_tmp = metadata_path + '.tmp'
-            with open(meta_tmp, "w", encoding="utf-8") as f:
-                json.dump(metadata, f, ensure_ascii=False, indent=4)
-            os.replace(meta_tmp, metadata_path)
-
+            try:
+                validated = validate_step(staged)
+            except ValidationFailed as e:
+                self.stdout.write(self.style.ERROR(f"✖ {e}. Dados publicados mantidos; relatório em metadata.json."))
+                return
+            published = publish_step(validated)
+            self.stdout.write(self.style.SUCCESS("✔ acoes_raw.csv e acoes_filtradas.csv publicados."))
+            if published["snapshot_version"]:
+                self.stdout.write(self.style.SUCCESS(f"✔ snapshot binário salvo (versão {published['snapshot_version']})."))
             self.stdout.write(self.style.SUCCESS("✔ metadata.json salvo."))
 
-            # PASSO 5: UPLOAD PARA S3 (se configurado)
-            bucket = os.environ.get('AWS_S3_BUCKET')
-            if bucket:
+            # PASSO 5: UPLOAD PARA S3 (se configurado) — em paralelo, metadata.json por último
+            if os.environ.get('AWS_S3_BUCKET'):
                 try:
-                    from structure.s3_utils import upload_file
-
-                    # Upload dos arquivos gerados
-                    upload_file(final_path, bucket, 'acoes_filtradas.csv')
-                    upload_file(metadata_path, bucket, 'metadata.json')
-                    upload_file(raw_path, bucket, 'acoes_raw.csv')
-
-                    self.stdout.write(self.style.SUCCESS(f"✔ Arquivos enviados para S3: s3://{bucket}/"))
+                    uploaded = upload_step(published)
+                    for key, obj in uploaded['s3'].items():
+                        self.stdout.write(f"  s3://{os.environ['AWS_S3_BUCKET']}/{key}: {obj['status']} ({obj.get('ms') or 0:.0f} ms)")
+                    self.stdout.write(self.style.SUCCESS(f"✔ Arquivos publicados em s3://{os.environ['AWS_S3_BUCKET']}/"))
                 except Exception as e:
                     self.stdout.write(self.style.WARNING(f"⚠️ Erro no upload S3: {e}"))
-
-            # Se S3 estiver configurado, faça upload dos artefatos para o bucket
-            bucket = os.environ.get('AWS_S3_BUCKET')
-            if bucket:
-                try:
-                    from structure.s3_utils import upload_file
-                    # Upload raw, filtered e metadata
-                    upload_file(raw_path, bucket, 'acoes_raw.csv')
-                    upload_file(final_path, bucket, 'acoes_filtradas.csv')
-                    upload_file(metadata_path, bucket, 'metadata.json')
-                    self.stdout.write(self.style.SUCCESS(f"✔ artifacts uploaded to s3://{bucket}/"))
-                except Exception as e:
-                    self.stdout.write(self.style.WARNING(f"Warning: upload to S3 failed: {e}"))
-
-
         except Exception as e:
-            # Em caso de erro, grava metadata com status de erro para facilitar debug
+            # Em caso de erro, grava o status no metadata (sem perder o último scraping bom)
             try:
-                metadata = {
-                    "last_scrape": now().isoformat(),
-                    "rows_raw": 0,
-                    "rows_filtered": 0,
-                    "source_url": url,
-                    "status": "error",
-                    "error": str(e)
-                }
-                metadata_path = os.path.join(settings.BASE_DIR, "media", "metadata.json")
-                meta_tmp = metadata_path + '.tmp'
-                os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
-                with open(meta_tmp, "w", encoding="utf-8") as f:
-                    json.dump(metadata, f, ensure_ascii=False, indent=4)
-                os.replace(meta_tmp, metadata_path)
+                record_failure({"source_url": url, "status": "error", "error": str(e)})
                 self.stdout.write(self.style.ERROR(f"Erro durante scraping: {e}. metadata.json atualizado com erro."))
             except Exception:
                 # se falhar ao salvar metadata, apenas logamos
                 self.stdout.write(self.style.ERROR(f"Erro durante scraping e falha ao gravar metadata: {e}"))
-            finally:
-                driver.quit()
             return
-        finally:
+
+    def _precheck(self, url, validators, attempt, max_attempts):
+        """Uma tentativa do pre-check; devolve (resposta 200 ou None, último status).
+
+        Falha antes da última tentativa levanta RetryPrecheck com o backoff; token
+        indisponível no rate limiter levanta RateLimited (mesma tentativa).
+        """
+        host = urlparse(url).netloc
+        try:
+            r = fetch(url, validators=validators, wait=False)
+        except (NotModified, RateLimited):
+            raise
+        except Exception as e:
+            if attempt >= max_attempts:
+                logger.warning("Pre-scrape check: erro na tentativa %s/%s: %s", attempt, max_attempts, e)
+                return None, None
+            wait = retry_countdown(attempt - 1)
+            logger.warning("Pre-scrape check: erro na tentativa %s/%s: %s — nova tentativa em %.1fs",
+                           attempt, max_attempts, e, wait)
+            raise RetryPrecheck(host, wait, attempt + 1) from e
+
+        if r.status_code == 200:
+            return r, 200
+        if r.status_code == 403 and os.environ.get('SCRAPE_VERBOSE_LOGGING') == '1':
+            # log diagnóstico do bloqueio (opcional)
             try:
-                driver.quit()
+                resp_headers = dict(r.headers) if getattr(r, 'headers', None) is not None else None
+                body = getattr(r, 'text', '')
+                if isinstance(body, str):
+                    body = body[:1000].replace('\n', ' ').replace('\r', ' ')
+                logger.warning('Pre-scrape diagnostic: 403 detected (command). resp_headers=%s body_snip=%s', {k: resp_headers.get(k) for k in ['Server', 'X-Cache', 'Content-Type'] if resp_headers and k in resp_headers}, body)
             except Exception:
-                pass
+                logger.debug('Erro ao coletar dados de resposta para logging verboso (command)')
+        r.close()
+        if attempt >= max_attempts:
+            logger.warning("Pre-scrape check: status %s, tentativa %s/%s — desistindo", r.status_code, attempt, max_attempts)
+            return None, r.status_code
+        # 403 e outros 4xx/5xx: backoff exponencial + jitter até a próxima tentativa
+        wait = retry_countdown(attempt - 1)
+        logger.warning("Pre-scrape check: status %s, tentativa %s/%s — nova tentativa em %.1fs",
+                       r.status_code, attempt, max_attempts, wait)
+        raise RetryPrecheck(host, wait, attempt + 1, status=r.status_code)
+
+    def _retry_later(self, attempt, wait):
+        """Reagenda o comando na scrape_data_task (countdown); False se não há Celery/broker."""
+        from invest22.scraping.tasks import scrape_data_task
+        if not hasattr(scrape_data_task, 'apply_async'):
+            return False
+        try:
+            scrape_data_task.apply_async(kwargs={'attempt': attempt}, countdown=int(wait) + 1)
+        except Exception as e:
+            logger.warning("Broker indisponível para reagendar o pre-check: %s", e)
+            return False
+        self.stdout.write(self.style.WARNING(f"⚠️ Pre-check sem sucesso — tentativa {attempt} reagendada em {wait:.0f}s."))
+        return True
+
+    def _failover(self, url):
+        """Fundamentus indisponível: tenta as outras fontes de SCRAPE_SOURCES. True se publicou."""
+        sources = [s for s in configured_sources(url) if s.name != 'fundamentus']
+        if not sources:
+            return False
+        try:
+            fetched = fetch_first(sources, read_metadata(), wait=True)
+            published = publish_step(validate_step(filter_step(parse_step(fetched))))
+        except NotModified:
+            self.stdout.write("Nenhuma fonte alternativa com dados mais novos que os publicados.")
+            return False
+        except Exception as e:
+            self.stdout.write(self.style.WARNING(f"⚠️ Fontes alternativas falharam: {e}"))
+            return False
+        self.stdout.write(self.style.SUCCESS(
+            f"✔ Fundamentus indisponível — publicado pela fonte '{published['source']}': "
+            f"{published['rows_raw']} linhas, {published['rows_filtered']} filtradas, snapshot {published['snapshot_version']}"
+        ))
+        return True
+
+    def _replay_one(self, ref):
+        """Republica uma captura pelo mesmo caminho do scraping (staging → validação → publicação)."""
+        entry = find_capture(ref)
+        fetched = {
+            "source": entry.get("source", "fundamentus"),
+            "url": entry.get("url") or SOURCE_URL,
+            "capture": entry["sha256"],
+            "fetched_at": entry.get("fetched_at"),
+            "needs_browser": False,
+            "source_etag": None,
+            "source_last_modified": None,
+            "scraped_at": entry.get("fetched_at"),
+            "replayed_from": entry["sha256"],
+        }
+        try:
+            validated = validate_step(filter_step(parse_step(fetched)))
+        except ValidationFailed as e:
+            self.stdout.write(self.style.ERROR(f"✖ Replay de {entry['sha256'][:12]}: {e}. Dados publicados mantidos."))
+            return
+        published = publish_step(validated)
+        self.stdout.write(self.style.SUCCESS(
+            f"✔ Replay de {entry['sha256'][:12]}: {published['rows_raw']} linhas, "
+            f"{published['rows_filtered']} filtradas, snapshot {published['snapshot_version']}"
+        ))
+
+    def _replay_all(self, workers=None):
+        """Reconstrói o histórico diário a partir das capturas, em paralelo."""
+        # Uma captura por dia (a mais recente do dia vence)
+        per_day = {}
+        for entry in iter_index():
+            if not entry.get("fetched_at"):
+                continue
+            day = day_for(entry["fetched_at"])
+            if day not in per_day or entry["fetched_at"] >= per_day[day]["fetched_at"]:
+                per_day[day] = entry
+        if not per_day:
+            self.stdout.write(self.style.WARNING("⚠️ Nenhuma captura encontrada em media/captures/"))
+            return
+
+        started = time.perf_counter()
+        ok = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_replay_to_history, entry, day): day for day, entry in sorted(per_day.items())}
+            for future in as_completed(futures):
+                day = futures[future]
+                try:
+                    info = future.result()
+                    ok += 1
+                    self.stdout.write(f"  {day}: {info['rows_raw']} linhas, snapshot {info['snapshot_version']}")
+                except Exception as e:
+                    self.stdout.write(self.style.WARNING(f"⚠️ {day}: falha no replay: {e}"))
+        months = sync_series()
+        self.stdout.write(self.style.SUCCESS(
+            f"✔ Histórico reconstruído: {ok}/{len(per_day)} dias, {len(months)} partição(ões) mensais "
+            f"da série em {time.perf_counter() - started:.1f}s"
+        ))
+
+    def _load_table_with_browser(self, url):
+        """Carrega a página no Chrome headless e devolve o HTML da tabela `resultado`."""
+        return load_table_with_browser(url)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from structure.details import scrape_details
+
+
+class Command(BaseCommand):
+    help = 'Busca setor, segmento, nº de ações e último balanço (detalhes.php) dos Papéis selecionados'
+
+    def add_arguments(self, parser):
+        parser.add_argument('papeis', nargs='*', help='Papéis a buscar (padrão: lista final atual)')
+        parser.add_argument('--base-url', default=None, help='URL base do site (padrão: FUNDAMENTUS_BASE_URL)')
+        parser.add_argument('--no-cache', action='store_true', help='Ignora o cache por ticker')
+
+    def handle(self, *args, **options):
+        papeis = options['papeis'] or None
+        payload = scrape_details(papeis, base=options['base_url'], use_cache=not options['no_cache'])
+
+        ok, errors = payload['tickers'], payload['errors']
+        self.stdout.write(self.style.SUCCESS(
+            f"✔ detalhes.json salvo: {len(ok)} Papéis em {payload['elapsed_ms']:.0f} ms"
+        ))
+        for papel, erro in errors.items():
+            self.stdout.write(self.style.WARNING(f"⚠️ {papel}: {erro}"))
@@ -0,0 +1,224 @@
+# structure/market_calendar.py
+# Calendário de pregões da B3 e agenda de atualizações.
+#
+# Dias de pregão: segunda a sexta, exceto feriados (fixos + móveis calculados a
+# partir da Páscoa) e datas extras em MARKET_HOLIDAYS. Em cada pregão há
+# atualizações de SCRAPE_INTRADAY_MINUTES em SCRAPE_INTRADAY_MINUTES minutos
+# entre MARKET_OPEN e MARKET_CLOSE, mais uma após o fechamento.
+#
+# A mesma agenda define quando os dados ficam velhos (`is_stale`): um snapshot
+# vale até o próximo horário agendado (+ tolerância), então Celery Beat, a task
+# e a view seguem a mesma regra.
+import os
+from datetime import date, datetime, time as dtime, timedelta
+
+import pytz
+
+TZ_SP = pytz.timezone('America/Sao_Paulo')
+
+# Feriados fixos em que a B3 não abre (mês, dia)
+FIXED_HOLIDAYS = [
+    (1, 1),    # Confraternização Universal
+    (4, 21),   # Tiradentes
+    (5, 1),    # Dia do Trabalho
+    (9, 7),    # Independência
+    (10, 12),  # Nossa Senhora Aparecida
+    (11, 2),   # Finados
+    (11, 15),  # Proclamação da República
+    (11, 20),  # Consciência Negra
+    (12, 24),  # Véspera de Natal (sem pregão)
+    (12, 25),  # Natal
+    (12, 31),  # Último dia do ano (sem pregão)
+]
+
+# Feriados móveis, em dias a partir do domingo de Páscoa
+EASTER_OFFSETS = [
+    -48,  # Carnaval (segunda)
+    -47,  # Carnaval (terça)
+    -2,   # Sexta-feira Santa
+    60,   # Corpus Christi
+]
+
+
+def _parse_hhmm(value: str) -> dtime:
+    hours, _, minutes = value.strip().partition(':')
+    return dtime(int(hours), int(minutes or 0))
+
+
+def _settings():
+    return {
+        'open': _parse_hhmm(os.environ.get('MARKET_OPEN', '10:00')),
+        'close': _parse_hhmm(os.environ.get('MARKET_CLOSE', '18:00')),
+        'cadence': max(5, int(os.environ.get('SCRAPE_INTRADAY_MINUTES', '60'))),
+        'after_close': int(os.environ.get('SCRAPE_AFTER_CLOSE_MINUTES', '30')),
+        'grace': int(os.environ.get('SCRAPE_STALE_GRACE_MINUTES', '15')),
+    }
+
+
+def easter(year: int) -> date:
+    """Domingo de Páscoa (algoritmo de Meeus/Jones/Butcher)."""
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def _extra_holidays() -> set:
+    """Datas extras (AAAA-MM-DD, separadas por vírgula) em MARKET_HOLIDAYS."""
+    extra = set()
+    for item in os.environ.get('MARKET_HOLIDAYS', '').split(','):
+        item = item.strip()
+        if item:
+            try:
+                extra.add(date.fromisoformat(item))
+            except ValueError:
+                pass
+    return extra
+
+
+def holidays(year: int) -> set:
+    days = {date(year, month, day) for month, day in FIXED_HOLIDAYS}
+    sunday = easter(year)
+    days.update(sunday + timedelta(days=offset) for offset in EASTER_OFFSETS)
+    days.update(d for d in _extra_holidays() if d.year == year)
+    return days
+
+
+def is_trading_day(day: date) -> bool:
+    return day.weekday() < 5 and day not in holidays(day.year)
+
+
+def _localize(day: date, at: dtime) -> datetime:
+    return TZ_SP.localize(datetime.combine(day, at))
+
+
+def _to_sp(moment) -> datetime:
+    if isinstance(moment, str):
+        moment = datetime.fromisoformat(moment.replace('Z', '+00:00'))
+    if moment.tzinfo is None:
+        moment = pytz.utc.localize(moment)
+    return moment.astimezone(TZ_SP)
+
+
+def refresh_slots(day: date) -> list:
+    """Horários de atualização do dia (vazio se não houver pregão)."""
+    if not is_trading_day(day):
+        return []
+    cfg = _settings()
+    opening, closing = _localize(day, cfg['open']), _localize(day, cfg['close'])
+    slots = []
+    slot = opening
+    while slot < closing:
+        slots.append(slot)
+        slot += timedelta(minutes=cfg['cadence'])
+    slots.append(closing)
+    if cfg['after_close'] > 0:
+        slots.append(closing + timedelta(minutes=cfg['after_close']))
+    return slots
+
+
+def is_market_open(moment=None) -> bool:
+    moment = _to_sp(moment or datetime.now(pytz.utc))
+    if not is_trading_day(moment.date()):
+        return False
+    cfg = _settings()
+    return _localize(moment.date(), cfg['open']) <= moment < _localize(moment.date(), cfg['close'])
+
+
+def next_refresh(after=None, max_days: int = 31):
+    """Primeiro horário agendado estritamente depois de `after`."""
+    after = _to_sp(after or datetime.now(pytz.utc))
+    for offset in range(max_days):
+        for slot in refresh_slots(after.date() + timedelta(days=offset)):
+            if slot > after:
+                return slot
+    return None
+
+
+def last_refresh(at=None, max_days: int = 31):
+    """Último horário agendado até `at` (inclusive)."""
+    at = _to_sp(at or datetime.now(pytz.utc))
+    for offset in range(max_days):
+        for slot in reversed(refresh_slots(at.date() - timedelta(days=offset))):
+            if slot <= at:
+                return slot
+    return None
+
+
+def is_stale(last_scrape, at=None) -> bool:
+    """True se algum horário agendado passou (além da tolerância) depois de `last_scrape`."""
+    if not last_scrape:
+        return True
+    at = _to_sp(at or datetime.now(pytz.utc))
+    due = last_refresh(at - timedelta(minutes=_settings()['grace']))
+    return due is not None and _to_sp(last_scrape) < due
+
+
+def last_confirmed(meta: dict):
+    """Último momento em que os dados publicados foram confirmados atuais (None se nunca).
+
+    É o mais recente entre `last_scrape` e `last_checked` (origem respondeu 304).
+    """
+    if not isinstance(meta, dict):
+        return None
+    moments = [_to_sp(meta[k]) for k in ('last_scrape', 'last_checked') if meta.get(k)]
+    return max(moments) if moments else None
+
+
+def snapshot_ttl(last_scrape, at=None) -> int:
+    """Segundos que faltam para o snapshot de `last_scrape` ficar velho (0 se já está)."""
+    if not last_scrape:
+        return 0
+    at = _to_sp(at or datetime.now(pytz.utc))
+    upcoming = next_refresh(last_scrape)
+    if upcoming is None:
+        return 0
+    expires = upcoming + timedelta(minutes=_settings()['grace'])
+    return max(0, int((expires - at).total_seconds()))
+
+
+try:
+    from celery.schedules import BaseSchedule, schedstate
+except (ImportError, ModuleNotFoundError):
+    BaseSchedule = None
+
+if BaseSchedule is not None:
+    class MarketSchedule(BaseSchedule):
+        """Agenda do Celery Beat que dispara nos horários de `refresh_slots`."""
+
+        def remaining_estimate(self, last_run_at):
+            upcoming = next_refresh(last_run_at)
+            if upcoming is None:
+                return timedelta(days=1)
+            return upcoming - _to_sp(self.now())
+
+        def is_due(self, last_run_at):
+            current = self.now()
+            upcoming = next_refresh(last_run_at)
+            if upcoming is not None and _to_sp(current) >= upcoming:
+                following = next_refresh(current)
+                wait = (following - _to_sp(current)).total_seconds() if following else 86400
+                return schedstate(True, max(1.0, wait))
+            wait = (upcoming - _to_sp(current)).total_seconds() if upcoming else 86400
+            return schedstate(False, max(1.0, wait))
+
+        def __reduce__(self):
+            return (self.__class__, ())
+
+        def __repr__(self):
+            return '<MarketSchedule: pregões B3>'
+
+        def __eq__(self, other):
+            return isinstance(other, MarketSchedule)
+
+        def __hash__(self):
+            return hash(MarketSchedule)
+else:
+    MarketSchedule = None
@@ -0,0 +1,119 @@
+# structure/metrics.py
+# Indicadores derivados calculados a partir das colunas numéricas da tabela raw.
+#
+# Tudo é feito com operações de coluna sobre arrays float64 (sem laço por linha).
+# Os resultados entram no snapshot binário como colunas extras, então filtros e
+# API leem os valores prontos em vez de recalcular a cada requisição:
+#
+#   'Earnings Yield'   1 / (EV/EBIT)
+#   'Magic Formula'    rank(Earnings Yield desc) + rank(ROIC desc); menor é melhor
+#   'Graham'           sqrt(22.5 * LPA * VPA), com LPA = Cotação/P/L e VPA = Cotação/P/VP
+#   'pct:<coluna>'     percentil (0-100) do valor dentro da coluna
+#   'z:<coluna>'       z-score do valor dentro da coluna
+#
+# Valores ausentes (NaN/inf) ficam fora de ranks, percentis e médias e resultam em NaN.
+import numpy as np
+
+EARNINGS_YIELD = 'Earnings Yield'
+MAGIC_FORMULA = 'Magic Formula'
+GRAHAM = 'Graham'
+PERCENTILE_PREFIX = 'pct:'
+ZSCORE_PREFIX = 'z:'
+
+
+def _col(columns: dict, name: str, n_rows: int) -> np.ndarray:
+    if name in columns:
+        return np.asarray(columns[name], dtype=np.float64)
+    return np.full(n_rows, np.nan)
+
+
+def earnings_yield(ev_ebit) -> np.ndarray:
+    ev_ebit = np.asarray(ev_ebit, dtype=np.float64)
+    out = np.full(ev_ebit.shape, np.nan)
+    ok = np.isfinite(ev_ebit) & (ev_ebit != 0)
+    np.divide(1.0, ev_ebit, out=out, where=ok)
+    return out
+
+
+def graham_number(cotacao, pl, pvp) -> np.ndarray:
+    cotacao, pl, pvp = (np.asarray(a, dtype=np.float64) for a in (cotacao, pl, pvp))
+    out = np.full(cotacao.shape, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lpa = cotacao / pl
+        vpa = cotacao / pvp
+        product = 22.5 * lpa * vpa
+    # Só faz sentido com lucro e patrimônio positivos
+    ok = np.isfinite(product) & (lpa > 0) & (vpa > 0)
+    np.sqrt(product, out=out, where=ok)
+    return out
+
+
+def rank(values, ascending: bool = True) -> np.ndarray:
+    """Rank 1-based (empates recebem o menor rank, como `rank(method='min')`)."""
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(values.shape, np.nan)
+    idx = np.flatnonzero(np.isfinite(values))
+    if idx.size:
+        v = values[idx] if ascending else -values[idx]
+        sorted_v = np.sort(v, kind='stable')
+        out[idx] = np.searchsorted(sorted_v, v, side='left') + 1
+    return out
+
+
+def percentile(values) -> np.ndarray:
+    """Percentil (0-100) de cada valor; empates recebem o ponto médio."""
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(values.shape, np.nan)
+    idx = np.flatnonzero(np.isfinite(values))
+    if idx.size:
+        v = values[idx]
+        sorted_v = np.sort(v, kind='stable')
+        below = np.searchsorted(sorted_v, v, side='left')
+        upto = np.searchsorted(sorted_v, v, side='right')
+        out[idx] = (below + upto) / (2.0 * idx.size) * 100.0
+    return out
+
+
+def zscore(values) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(values.shape, np.nan)
+    finite = np.isfinite(values)
+    if finite.any():
+        v = values[finite]
+        std = v.std()
+        if std > 0:
+            out[finite] = (v - v.mean()) / std
+    return out
+
+
+def magic_formula_rank(ey, roic) -> np.ndarray:
+    """Rank combinado da Magic Formula (Greenblatt) sobre as linhas com EY e ROIC válidos."""
+    ey = np.asarray(ey, dtype=np.float64)
+    roic = np.asarray(roic, dtype=np.float64)
+    eligible = np.isfinite(ey) & np.isfinite(roic)
+    ey = np.where(eligible, ey, np.nan)
+    roic = np.where(eligible, roic, np.nan)
+    return rank(ey, ascending=False) + rank(roic, ascending=False)
+
+
+def derive_metrics(columns: dict) -> dict:
+    """Retorna as colunas derivadas (nome -> float64) para as colunas base em `columns`."""
+    if not columns:
+        return {}
+    n_rows = len(next(iter(columns.values())))
+
+    ey = earnings_yield(_col(columns, 'EV/EBIT', n_rows))
+    derived = {
+        EARNINGS_YIELD: ey,
+        MAGIC_FORMULA: magic_formula_rank(ey, _col(columns, 'ROIC', n_rows)),
+        GRAHAM: graham_number(_col(columns, 'Cotação', n_rows), _col(columns, 'P/L', n_rows), _col(columns, 'P/VP', n_rows)),
+    }
+    for name, values in list(columns.items()) + [(EARNINGS_YIELD, ey)]:
+        values = np.asarray(values, dtype=np.float64)
+        derived[PERCENTILE_PREFIX + name] = percentile(values)
+        derived[ZSCORE_PREFIX + name] = zscore(values)
+    return derived
+
+
+def is_derived(name: str) -> bool:
+    return name in (EARNINGS_YIELD, MAGIC_FORMULA, GRAHAM) or name.startswith((PERCENTILE_PREFIX, ZSCORE_PREFIX))
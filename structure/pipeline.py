@@ -0,0 +1,272 @@
+# structure/pipeline.py
+# Pipeline em streaming: HTML -> linhas -> (CSV raw em blocos + colunas numéricas + filtros)
+#
+# As linhas da tabela são emitidas por um gerador à medida que o HTML é lido.
+# Cada linha é gravada no CSV raw em blocos, convertida para float uma única vez
+# (colunas numéricas usadas pelo snapshot) e testada contra os filtros na hora.
+# Só os textos originais das candidatas aos filtros ficam em memória, então
+# acoes_filtradas.csv sai direto daqui, sem regravar e reler o acoes_raw.csv.
+import csv
+import logging
+import os
+import resource
+import time
+import tracemalloc
+from array import array
+from collections import deque
+from html.parser import HTMLParser
+
+import numpy as np
+from django.conf import settings
+
+from structure.filters import FINAL_COLUMNS, LIMIT, clean_numeric, passes_filters, top_k
+
+logger = logging.getLogger(__name__)
+
+RAW_FILENAME = 'acoes_raw.csv'
+FINAL_FILENAME = 'acoes_filtradas.csv'
+
+
+class _TableRowParser(HTMLParser):
+    """Extrai as linhas (`tr`) de uma tabela HTML de forma incremental.
+
+    Usa a tabela com `id=table_id`; se ela não existir, cai para a primeira
+    tabela do documento (mesma regra de antes com BeautifulSoup). O texto de
+    cada célula equivale a `get_text(strip=True)`.
+    """
+
+    def __init__(self, table_id='resultado', fallback=True):
+        super().__init__(convert_charrefs=True)
+        self.table_id = table_id
+        self.fallback = fallback
+        self.rows = deque()
+        self.found_target = False
+        self.found_any = False
+        self._mode = None          # 'target' | 'fallback' | None
+        self._depth = 0
+        self._fallback_done = False
+        self._fallback_rows = []
+        self._row = None
+        self._cell = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'table':
+            if self._mode is not None:
+                self._depth += 1
+                return
+            is_target = self.table_id is not None and dict(attrs).get('id') == self.table_id
+            if is_target and not self.found_target:
+                self._mode, self._depth = 'target', 1
+                self.found_target = self.found_any = True
+                self._fallback_rows = []
+            elif self.fallback and not self.found_target and not self._fallback_done:
+                self._mode, self._depth = 'fallback', 1
+                self.found_any = True
+            return
+        if self._mode is None:
+            return
+        if tag == 'tr':
+            self._end_row()
+            self._row = []
+        elif tag in ('td', 'th'):
+            self._end_cell()
+            if self._row is None:
+                self._row = []
+            self._cell = []
+
+    def handle_endtag(self, tag):
+        if self._mode is None:
+            return
+        if tag in ('td', 'th'):
+            self._end_cell()
+        elif tag == 'tr':
+            self._end_row()
+        elif tag == 'table':
+            self._depth -= 1
+            if self._depth == 0:
+                self._end_row()
+                if self._mode == 'fallback':
+                    self._fallback_done = True
+                self._mode = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            s = data.strip()
+            if s:
+                self._cell.append(s)
+
+    def _end_cell(self):
+        if self._cell is not None:
+            self._row.append(''.join(self._cell))
+            self._cell = None
+
+    def _end_row(self):
+        self._end_cell()
+        if self._row:
+            if self._mode == 'target':
+                self.rows.append(self._row)
+            else:
+                self._fallback_rows.append(self._row)
+        self._row = None
+
+    def finish(self):
+        self.close()
+        if not self.found_target:
+            self.rows.extend(self._fallback_rows)
+            self._fallback_rows = []
+
+
+def iter_table_rows(chunks, table_id='resultado', fallback=True):
+    """Gera as linhas (listas de strings) da tabela a partir de pedaços de HTML.
+
+    `chunks` pode ser uma string única ou um iterável de strings (ex.:
+    `response.iter_content(decode_unicode=True)`). Levanta ValueError se não
+    houver tabela no HTML. Com `fallback=False` só aceita a tabela `table_id`.
+    """
+    parser = _TableRowParser(table_id, fallback)
+    if isinstance(chunks, str):
+        chunks = (chunks,)
+    for chunk in chunks:
+        if not chunk:
+            continue
+        parser.feed(chunk)
+        while parser.rows:
+            yield parser.rows.popleft()
+    parser.finish()
+    while parser.rows:
+        yield parser.rows.popleft()
+    if not parser.found_any:
+        raise ValueError("Tabela não encontrada no HTML")
+
+
+def _normalize_cell(value):
+    # Mesmo critério do DataFrame anterior: None/'nan' viram string vazia
+    if value is None:
+        return ''
+    s = str(value)
+    return '' if s == 'nan' else s
+
+
+def write_final_csv(final_path, final_rows):
+    """Grava acoes_filtradas.csv (colunas FINAL_COLUMNS, texto original) de forma atômica."""
+    final_tmp = final_path + '.tmp'
+    with open(final_tmp, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(FINAL_COLUMNS)
+        writer.writerows(final_rows)
+    os.replace(final_tmp, final_path)
+
+
+def run_pipeline(rows, media_dir=None, chunk_rows=None, trace_memory=False, snapshot=True, filters=True):
+    """Consome `rows` (header + linhas) e grava raw, filtrado e snapshot.
+
+    Retorna um dict com header, lista_final, linhas filtradas (texto original),
+    contagens, versão do snapshot e as métricas `wall_ms` / `peak_kb`.
+    Com `filters=False` só grava raw e snapshot (a seleção fica para depois).
+    """
+    media_dir = media_dir or os.path.join(settings.BASE_DIR, 'media')
+    chunk_rows = chunk_rows or int(os.environ.get('SCRAPE_CSV_CHUNK_ROWS', '256'))
+    os.makedirs(media_dir, exist_ok=True)
+
+    started = time.perf_counter()
+    if trace_memory:
+        tracemalloc.start()
+
+    raw_path = os.path.join(media_dir, RAW_FILENAME)
+    final_path = os.path.join(media_dir, FINAL_FILENAME)
+    raw_tmp = raw_path + '.tmp'
+
+    rows = iter(rows)
+    try:
+        try:
+            header = [_normalize_cell(c) for c in next(rows)]
+        except StopIteration:
+            raise ValueError("Tabela sem linhas no HTML")
+
+        n_cols = len(header)
+        numeric_names = [c for c in header if c != 'Papel']
+        numeric_idx = [i for i, c in enumerate(header) if c != 'Papel']
+        numeric = {name: array('d') for name in numeric_names}
+        papel_idx = header.index('Papel') if 'Papel' in header else None
+        papeis = []
+
+        filters_ok = papel_idx is not None and all(c in header for c in FINAL_COLUMNS)
+        apply_filters = filters and filters_ok
+        if apply_filters:
+            liq_i, mrg_i, ev_i, pl_i = (header.index(c) for c in ('Liq.2meses', 'Mrg Ebit', 'EV/EBIT', 'P/L'))
+            final_idx = [header.index(c) for c in FINAL_COLUMNS]
+        candidates = []        # (ev_ebit, papel, [textos originais das colunas finais])
+
+        n_rows = 0
+        with open(raw_tmp, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(header)
+            buffer = []
+            for row in rows:
+                if len(row) > n_cols:
+                    raise ValueError(f"Linha com {len(row)} colunas, esperado {n_cols}")
+                row = [_normalize_cell(c) for c in row] + [''] * (n_cols - len(row))
+                buffer.append(row)
+                if len(buffer) >= chunk_rows:
+                    writer.writerows(buffer)
+                    buffer.clear()
+
+                parsed = {i: clean_numeric(row[i]) for i in numeric_idx}
+                for name, i in zip(numeric_names, numeric_idx):
+                    numeric[name].append(parsed[i])
+                if papel_idx is not None:
+                    papeis.append(row[papel_idx])
+                if apply_filters and passes_filters(parsed[liq_i], parsed[mrg_i], parsed[ev_i], parsed[pl_i]):
+                    candidates.append((parsed[ev_i], row[papel_idx], [row[i] for i in final_idx]))
+                n_rows += 1
+            if buffer:
+                writer.writerows(buffer)
+        os.replace(raw_tmp, raw_path)
+
+        # Top 22 entre as candidatas por seleção parcial (mesma ordem de apply_filters)
+        ev_values = np.fromiter((c[0] for c in candidates), dtype=np.float64, count=len(candidates))
+        top = [candidates[i] for i in top_k(ev_values, np.arange(len(candidates)), LIMIT)]
+        lista_final = [c[1] for c in top]
+        final_rows = [c[2] for c in top]
+
+        if apply_filters:
+            write_final_csv(final_path, final_rows)
+
+        snapshot_version = None
+        if snapshot and papel_idx is not None:
+            try:
+                from structure.snapshot import write_snapshot
+                columns = {name: np.frombuffer(numeric[name], dtype=np.float64) for name in numeric_names}
+                snapshot_version = write_snapshot(papeis, columns, lista_final, root=os.path.join(media_dir, 'snapshot'))
+            except Exception as e:
+                logger.warning("Falha ao gravar snapshot binário: %s", e)
+
+        peak_kb = None
+        if trace_memory:
+            peak_kb = tracemalloc.get_traced_memory()[1] // 1024
+        wall_ms = (time.perf_counter() - started) * 1000
+
+        return {
+            "header": header,
+            "rows_raw": n_rows,
+            "rows_filtered": len(final_rows),
+            "filters_ok": filters_ok,
+            "lista_final": lista_final,
+            "final_columns": list(FINAL_COLUMNS),
+            "final_rows": final_rows,
+            "raw_path": raw_path,
+            "final_path": final_path,
+            "snapshot_version": snapshot_version,
+            "wall_ms": round(wall_ms, 1),
+            "peak_kb": peak_kb,
+            "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+    except Exception:
+        try:
+            os.remove(raw_tmp)
+        except OSError:
+            pass
+        raise
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
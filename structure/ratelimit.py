@@ -0,0 +1,307 @@
+# structure/ratelimit.py
+# Controle de taxa e de concorrência para requisições ao site de origem.
+#
+# Toda requisição ao Fundamentus passa por `get_limiter()`: um token bucket por
+# host guardado no Redis (script Lua atômico, relógio do próprio Redis), então o
+# limite vale para todos os processos (web, workers Celery, comandos). Se o
+# Redis não estiver acessível, cai para um bucket local por processo.
+#
+# Teto garantido por host: em qualquer janela de T segundos saem no máximo
+# `burst + rate * T` requisições, somando todos os processos.
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis
+except Exception:
+    redis = None
+
+
+class TokenBucket:
+    """Token bucket simples e thread-safe (por processo).
+
+    `rate` tokens por segundo, até `capacity` acumulados.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now_ts):
+        elapsed = now_ts - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now_ts
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """Consome `tokens` se houver; senão retorna quantos segundos esperar."""
+        with self._lock:
+            now_ts = time.monotonic()
+            self._refill(now_ts)
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate if self.rate > 0 else float('inf')
+
+    def acquire(self, tokens: float = 1.0, timeout: float = None) -> bool:
+        """Bloqueia até conseguir `tokens` (ou até `timeout`). Retorna True se conseguiu."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0.0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class RateLimited(Exception):
+    """Sem token disponível agora; `wait` diz em quantos segundos tentar de novo."""
+
+    def __init__(self, host: str, wait: float):
+        super().__init__(f"Limite de requisições para {host}: aguardar {wait:.1f}s")
+        self.host = host
+        self.wait = wait
+
+
+# KEYS[1] = bucket (hash tokens/ts), KEYS[2] = bloqueio por Retry-After (ms epoch)
+# ARGV = rate (tokens/s), capacity, tokens pedidos (0 = só consulta)
+# Retorna quantos ms esperar (0 = token concedido)
+_BUCKET_LUA = """
+local t = redis.call('TIME')
+local now_ms = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local blocked = tonumber(redis.call('GET', KEYS[2]) or '0')
+if blocked > now_ms then
+    return blocked - now_ms
+end
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]) or capacity
+local ts = tonumber(data[2]) or now_ms
+tokens = math.min(capacity, tokens + math.max(0, now_ms - ts) / 1000.0 * rate)
+local needed = math.max(requested, 1)
+if tokens < needed then
+    return math.ceil((needed - tokens) / rate * 1000)
+end
+if requested > 0 then
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - requested), 'ts', tostring(now_ms))
+    redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 60000)
+end
+return 0
+"""
+
+
+def _parse_budgets(spec: str) -> dict:
+    """`host=rate:burst,host2=rate` -> {host: (rate, burst|None)}"""
+    budgets = {}
+    for item in (spec or '').split(','):
+        if '=' not in item:
+            continue
+        host, value = item.split('=', 1)
+        rate, _, burst = value.partition(':')
+        try:
+            budgets[host.strip()] = (float(rate), float(burst) if burst else None)
+        except ValueError:
+            logger.warning("Budget inválido em SCRAPE_HOST_BUDGETS: %s", item)
+    return budgets
+
+
+def parse_retry_after(value) -> float:
+    """Converte o header Retry-After (segundos ou data HTTP) em segundos."""
+    if not value:
+        return 0.0
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        dt = email.utils.parsedate_to_datetime(value)
+        return max(0.0, dt.timestamp() - time.time())
+    except Exception:
+        return 0.0
+
+
+class RateLimiter:
+    """Token bucket por host compartilhado via Redis, com fallback local."""
+
+    def __init__(self, redis_url: str = None, prefix: str = 'ratelimit'):
+        self.redis_url = redis_url or os.environ.get('RATE_LIMIT_REDIS_URL') or os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+        self.prefix = prefix
+        self.default_rate = float(os.environ.get('SCRAPE_HOST_RATE', '1'))
+        self.default_burst = float(os.environ.get('SCRAPE_HOST_BURST', '2'))
+        self.jitter = float(os.environ.get('SCRAPE_LIMITER_JITTER', '0.5'))
+        self.budgets = _parse_budgets(os.environ.get('SCRAPE_HOST_BUDGETS', ''))
+        self._lock = threading.Lock()
+        self._local = {}
+        self._local_blocked = {}
+        self._client = None
+        self._script = None
+        self._redis_retry_at = 0.0
+
+    def budget(self, host: str):
+        rate, burst = self.budgets.get(host, (self.default_rate, None))
+        return rate, burst if burst is not None else self.default_burst
+
+    def _redis(self):
+        if redis is None or time.monotonic() < self._redis_retry_at:
+            return None
+        if self._client is None:
+            try:
+                self._client = redis.Redis.from_url(self.redis_url, socket_connect_timeout=1, socket_timeout=1)
+                self._script = self._client.register_script(_BUCKET_LUA)
+            except Exception as e:
+                self._redis_down(e)
+                return None
+        return self._client
+
+    def _redis_down(self, error):
+        logger.warning("Rate limiter: Redis indisponível (%s) — usando bucket local por 30s", error)
+        self._client = None
+        self._redis_retry_at = time.monotonic() + 30
+
+    def _local_wait(self, host, tokens):
+        with self._lock:
+            if host not in self._local:
+                self._local[host] = TokenBucket(*self.budget(host))
+            bucket = self._local[host]
+            blocked = self._local_blocked.get(host, 0) - time.monotonic()
+        if blocked > 0:
+            return blocked
+        if tokens == 0:
+            with bucket._lock:
+                bucket._refill(time.monotonic())
+                return 0.0 if bucket._tokens >= 1 else (1 - bucket._tokens) / bucket.rate
+        return bucket.try_acquire(tokens)
+
+    def _wait(self, host: str, tokens: float) -> float:
+        client = self._redis()
+        if client is not None:
+            rate, burst = self.budget(host)
+            try:
+                ms = self._script(
+                    keys=[f'{self.prefix}:{host}:bucket', f'{self.prefix}:{host}:blocked'],
+                    args=[rate, burst, tokens],
+                )
+                return int(ms) / 1000.0
+            except Exception as e:
+                self._redis_down(e)
+        return self._local_wait(host, tokens)
+
+    def wait_time(self, url: str) -> float:
+        """Quanto esperar antes da próxima requisição ao host (sem consumir token)."""
+        return self._wait(urlparse(url).netloc, 0)
+
+    def reserve(self, url: str) -> float:
+        """Tenta consumir um token agora. Retorna 0 se concedido, ou a espera em segundos."""
+        return self._wait(urlparse(url).netloc, 1)
+
+    def check(self, url: str):
+        """Versão não bloqueante: consome um token ou levanta RateLimited."""
+        wait = self.reserve(url)
+        if wait > 0:
+            raise RateLimited(urlparse(url).netloc, wait)
+
+    def acquire(self, url: str, timeout: float = None) -> bool:
+        """Bloqueia (com jitter) até obter um token para o host da URL."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.reserve(url)
+            if wait == 0:
+                return True
+            # Jitter para que processos esperando o mesmo host não acordem juntos
+            wait += random.uniform(0, self.jitter)
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def block(self, url: str, seconds: float):
+        """Suspende o host por `seconds` para todos os processos (ex.: Retry-After)."""
+        if seconds <= 0:
+            return
+        host = urlparse(url).netloc
+        client = self._redis()
+        if client is not None:
+            try:
+                until_ms = int((time.time() + seconds) * 1000)
+                client.set(f'{self.prefix}:{host}:blocked', until_ms, px=int(seconds * 1000) + 1000)
+                return
+            except Exception as e:
+                self._redis_down(e)
+        with self._lock:
+            self._local_blocked[host] = time.monotonic() + seconds
+
+    def note_response(self, url: str, response):
+        """Registra Retry-After de respostas 429/503/403 para o host."""
+        status = getattr(response, 'status_code', None)
+        if status in (403, 429, 503):
+            headers = getattr(response, 'headers', None) or {}
+            retry_after = parse_retry_after(headers.get('Retry-After'))
+            if retry_after > 0:
+                logger.warning("Host %s pediu Retry-After=%.0fs (status %s)", urlparse(url).netloc, retry_after, status)
+                self.block(url, retry_after)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> RateLimiter:
+    """Limiter do processo (conexão Redis reaproveitada)."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter()
+    return _limiter
+
+
+class HostLimiter:
+    """Limite de concorrência por host (local) + token bucket compartilhado."""
+
+    def __init__(self, max_concurrency: int = None, limiter: RateLimiter = None):
+        self.max_concurrency = max_concurrency or int(os.environ.get('SCRAPE_HOST_CONCURRENCY', '2'))
+        self.limiter = limiter or get_limiter()
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def _for_host(self, host):
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.max_concurrency)
+            return self._semaphores[host]
+
+    def slot(self, url: str):
+        """Context manager: espera vaga de concorrência e um token para o host da URL."""
+        return _HostSlot(self._for_host(urlparse(url).netloc), self.limiter, url)
+
+
+class _HostSlot:
+    def __init__(self, semaphore, limiter, url):
+        self._semaphore = semaphore
+        self._limiter = limiter
+        self._url = url
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        try:
+            self._limiter.acquire(self._url)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        self._semaphore.release()
+        return False
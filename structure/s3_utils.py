@@ -1,18 +1,34 @@
 import os
+import base64
+import gzip
 import json
+import hashlib
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO, StringIO
 
 logger = logging.getLogger(__name__)
 
 try:
     import boto3
+    from boto3.s3.transfer import TransferConfig
     from botocore.exceptions import BotoCoreError, ClientError
 except Exception:
     boto3 = None
+    TransferConfig = None
     BotoCoreError = Exception
     ClientError = Exception
 
+CONTENT_TYPES = {
+    '.csv': 'text/csv; charset=utf-8',
+    '.json': 'application/json; charset=utf-8',
+}
+COMMIT_MARKER = 'metadata.json'
+# snapshot/<versão>/<arquivo>: a versão é o hash do conteúdo, o objeto nunca muda
+IMMUTABLE_PREFIX = 'snapshot/'
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+
 
 def _get_s3_client():
     if boto3 is None:
@@ -39,13 +55,131 @@ def upload_file(local_path: str, bucket: str, key: str) -> bool:
         return False
 
 
+def _read_body(obj) -> bytes:
+    content = obj['Body'].read()
+    # Objetos publicados por publish_files vão com Content-Encoding: gzip
+    if obj.get('ContentEncoding') == 'gzip':
+        content = gzip.decompress(content)
+    return content
+
+
+def _prepare(local_path: str, key: str, compress: bool) -> dict:
+    with open(local_path, 'rb') as f:
+        raw = f.read()
+    body = gzip.compress(raw, compresslevel=6, mtime=0) if compress else raw
+    md5 = hashlib.md5(body)
+    return {
+        'key': key,
+        'body': body,
+        'bytes': len(raw),
+        'sent_bytes': len(body),
+        'sha256': hashlib.sha256(raw).hexdigest(),
+        'md5': md5.hexdigest(),
+        'md5_b64': base64.b64encode(md5.digest()).decode('ascii'),
+    }
+
+
+def _remote_sha256(client, bucket: str, key: str):
+    try:
+        head = client.head_object(Bucket=bucket, Key=key)
+        return (head.get('Metadata') or {}).get('sha256')
+    except (BotoCoreError, ClientError):
+        return None
+
+
+def _immutable(key: str) -> bool:
+    """Chave endereçada pelo conteúdo (`snapshot/<versão>/<arquivo>`; `snapshot/CURRENT` não)."""
+    return key.startswith(IMMUTABLE_PREFIX) and key.count('/') >= 2
+
+
+def _put(client, bucket: str, item: dict, compress: bool, cache_control: str, force: bool) -> dict:
+    started = time.perf_counter()
+    result = {k: item[k] for k in ('key', 'bytes', 'sent_bytes', 'sha256')}
+    try:
+        # Sem HEAD nas chaves imutáveis: o PUT direto custa o mesmo que a consulta
+        if not force and not _immutable(item['key']) and _remote_sha256(client, bucket, item['key']) == item['sha256']:
+            result['status'] = 'skipped'
+        else:
+            extra = {
+                'ContentType': CONTENT_TYPES.get(os.path.splitext(item['key'])[1], 'application/octet-stream'),
+                'CacheControl': cache_control,
+                'Metadata': {'sha256': item['sha256'], 'md5': item['md5']},
+            }
+            if compress:
+                extra['ContentEncoding'] = 'gzip'
+            # PUT simples: o S3 confere o corpo recebido com o md5 (multipart não aceita ContentMD5)
+            if item['sent_bytes'] < MULTIPART_THRESHOLD:
+                extra['ContentMD5'] = item['md5_b64']
+            # upload_fileobj usa multipart acima do threshold do TransferConfig
+            config = TransferConfig(multipart_threshold=MULTIPART_THRESHOLD, max_concurrency=4)
+            client.upload_fileobj(BytesIO(item['body']), bucket, item['key'], ExtraArgs=extra, Config=config)
+            result['status'] = 'uploaded'
+    except (BotoCoreError, ClientError) as e:
+        logger.warning("Falha no upload de s3://%s/%s: %s", bucket, item['key'], e)
+        result['status'] = 'failed'
+        result['error'] = str(e)
+    result['ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+def publish_files(files: dict, bucket: str, max_workers: int = None, compress: bool = True,
+                  cache_control: str = None, force: bool = False) -> dict:
+    """Publica vários arquivos no S3 de uma vez.
+
+    `files` é um dict chave S3 -> caminho local. Os arquivos são enviados em
+    paralelo num pool pequeno, comprimidos com gzip (`Content-Encoding: gzip`)
+    e com `Cache-Control` e `ContentMD5`; objetos cujo sha256 (guardado nos
+    metadados do objeto) não mudou são pulados, exceto `snapshot/<versão>/`,
+    enviado sem HEAD por ser imutável. `metadata.json` vai por último, só se os
+    demais deram certo, e funciona como marcador de commit.
+
+    Retorna {'objects': [...], 'uploaded', 'skipped', 'failed', 'elapsed_ms'},
+    com status, tamanhos e tempo (ms) de cada objeto.
+    """
+    started = time.perf_counter()
+    if boto3 is None:
+        logger.warning("boto3 não disponível — pulando upload para S3")
+        return {'objects': [], 'uploaded': 0, 'skipped': 0, 'failed': len(files), 'elapsed_ms': 0.0}
+
+    max_workers = max_workers or int(os.environ.get('S3_UPLOAD_WORKERS', '4'))
+    cache_control = cache_control or os.environ.get('S3_CACHE_CONTROL', 'public, max-age=300')
+    client = _get_s3_client()
+
+    items = {key: _prepare(path, key, compress) for key, path in files.items() if os.path.exists(path)}
+    missing = [key for key in files if key not in items]
+    marker = items.pop(COMMIT_MARKER, None)
+
+    results = [{'key': key, 'status': 'failed', 'error': 'arquivo local ausente'} for key in missing]
+    if items:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+            results.extend(pool.map(lambda item: _put(client, bucket, item, compress, cache_control, force), items.values()))
+
+    if marker is not None:
+        if any(r['status'] == 'failed' for r in results):
+            results.append({'key': COMMIT_MARKER, 'status': 'failed', 'error': 'não enviado: upload anterior falhou'})
+        else:
+            # O metadata nunca deve ficar em cache: é ele que aponta para os dados novos
+            results.append(_put(client, bucket, marker, compress, 'no-cache', force))
+
+    summary = {
+        'objects': results,
+        'uploaded': sum(r['status'] == 'uploaded' for r in results),
+        'skipped': sum(r['status'] == 'skipped' for r in results),
+        'failed': sum(r['status'] == 'failed' for r in results),
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+    }
+    logger.info("Publicação S3 s3://%s/: %s enviados, %s sem alteração, %s falhas em %.0f ms",
+                bucket, summary['uploaded'], summary['skipped'], summary['failed'], summary['elapsed_ms'])
+    return summary
+
+
 def get_json(bucket: str, key: str):
     if boto3 is None:
         raise RuntimeError("boto3 não está instalado")
     try:
         client = _get_s3_client()
         obj = client.get_object(Bucket=bucket, Key=key)
-        content = obj['Body'].read()
+        content = _read_body(obj)
         return json.loads(content.decode('utf-8'))
     except Exception as e:
         logger.warning("Falha ao ler json do S3 s3://%s/%s: %s", bucket, key, e)
@@ -58,10 +192,32 @@ def get_csv_df(bucket: str, key: str):
     try:
         client = _get_s3_client()
         obj = client.get_object(Bucket=bucket, Key=key)
-        content = obj['Body'].read()
+        content = _read_body(obj)
         s = content.decode('utf-8-sig')
         return StringIO(s)
     except Exception as e:
         logger.warning("Falha ao ler csv do S3 s3://%s/%s: %s", bucket, key, e)
         raise
-*** End Patch
\ No newline at end of file
+
+
+def list_keys(bucket: str, prefix: str) -> list:
+    """Chaves do bucket sob `prefix`."""
+    if boto3 is None:
+        raise RuntimeError("boto3 não está instalado")
+    client = _get_s3_client()
+    keys = []
+    for page in client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        keys.extend(obj['Key'] for obj in page.get('Contents', []))
+    return keys
+
+
+def download_files(files: dict, bucket: str):
+    """Baixa vários objetos (chave S3 -> caminho local), já descomprimidos. Levanta em caso de erro."""
+    if boto3 is None:
+        raise RuntimeError("boto3 não está instalado")
+    client = _get_s3_client()
+    for key, path in files.items():
+        content = _read_body(client.get_object(Bucket=bucket, Key=key))
+        with open(path + '.tmp', 'wb') as f:
+            f.write(content)
+        os.replace(path + '.tmp', path)
@@ -0,0 +1,485 @@
+# structure/scrape_steps.py
+# Etapas do scraping agendado, separadas para rodar como tasks Celery encadeadas:
+#
+#   fetch   -> consulta as fontes (structure/sources.py) e grava a captura (media/captures/, por sha256)
+#   browser -> (só se o HTML não trouxer a tabela) carrega pelo Chrome e grava a captura
+#   parse   -> captura -> media/staging/<sha>/ (acoes_raw.csv + snapshot sem seleção)
+#   filter  -> snapshot do staging -> lista final, acoes_filtradas.csv e snapshot final
+#   validate-> checagens de qualidade (structure/validation.py); falha bloqueia a publicação
+#   publish -> copia o staging para media/, ativa o snapshot, grava metadata e histórico
+#              e enfileira os alertas da troca de versão (structure/alerts.py)
+#   upload  -> envia os arquivos publicados para o S3
+#
+# Cada etapa recebe e devolve um dict JSON-serializável que só referencia artefatos
+# endereçados pelo conteúdo, então qualquer uma pode ser repetida (retry) sem
+# refazer as anteriores: uma falha no S3 não exige novo scraping.
+import csv
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pytz
+from django.conf import settings
+from django.utils import timezone as dj_tz
+from django.utils.timezone import now
+
+from structure.alerts import queue_alerts
+from structure.captures import find_capture, read_capture, store_capture
+from structure.filters import FINAL_COLUMNS, select_from_snapshot
+from structure.history import archive_media, day_for
+from structure.timeseries import update_series
+from structure.pipeline import FINAL_FILENAME, RAW_FILENAME, iter_table_rows, run_pipeline, write_final_csv
+from structure.snapshot import activate_version, load_snapshot, read_current_version, snapshot_root, write_snapshot
+from structure.sources import SOURCE_URL, configured_sources, fetch_first, get_health
+from structure.validation import ValidationFailed, validate_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+class PublishError(Exception):
+    """Falha ao enviar os artefatos publicados para o S3."""
+
+
+def media_dir() -> str:
+    return os.path.join(settings.BASE_DIR, 'media')
+
+
+def metadata_path() -> str:
+    return os.path.join(media_dir(), 'metadata.json')
+
+
+def read_metadata():
+    try:
+        with open(metadata_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def write_metadata(metadata: dict):
+    path = metadata_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=4)
+    os.replace(path + '.tmp', path)
+
+
+# Campos do último scraping bem-sucedido: falhas nunca os sobrescrevem
+SUCCESS_FIELDS = ('last_scrape', 'last_scrape_local', 'rows_raw', 'rows_filtered', 'rows_by_source', 'snapshot_version')
+
+
+def record_failure(fields: dict):
+    """Grava uma falha no metadata mantendo `last_scrape` e o resto do último sucesso."""
+    existing = read_metadata()
+    metadata = dict(existing) if isinstance(existing, dict) else {}
+    metadata.update({k: v for k, v in fields.items() if k not in SUCCESS_FIELDS})
+    # Cada falha é uma nova tentativa: só mantém o horário que quem chama passou
+    metadata["last_attempt"] = fields.get("last_attempt") or now().isoformat()
+    write_metadata(metadata)
+    return metadata
+
+
+def record_checked():
+    """Origem respondeu 304: os dados publicados continuam atuais a partir de agora.
+
+    Grava só `last_checked` (status e campos do último sucesso ficam como estão); o
+    calendário usa o mais recente entre `last_scrape` e `last_checked` (market_calendar.last_confirmed).
+    """
+    existing = read_metadata()
+    if not isinstance(existing, dict) or existing.get('status') != 'success':
+        return existing
+    metadata = {**existing, "last_checked": now().isoformat()}
+    write_metadata(metadata)
+    return metadata
+
+
+def retry_countdown(retries: int) -> float:
+    """Mesmo backoff exponencial + jitter do pre-check (SCRAPE_HTTP_*)."""
+    base_backoff = float(os.environ.get("SCRAPE_HTTP_BACKOFF_BASE", "1.5"))
+    max_backoff = float(os.environ.get("SCRAPE_HTTP_MAX_BACKOFF", "60"))
+    jitter = float(os.environ.get("SCRAPE_HTTP_JITTER", "1.5"))
+    return min(max_backoff, base_backoff * (2 ** retries)) + random.uniform(0, jitter)
+
+
+def record_precheck_failure(url: str, last_status):
+    """Grava metadata 'forbidden'/'error' com backoff persistido via forbidden_count.
+
+    Retorna (estilo, mensagem) para quem chama exibir.
+    """
+    try:
+        existing = read_metadata()
+        existing_count = int(existing.get('forbidden_count', 0)) if isinstance(existing, dict) else 0
+        new_count = existing_count + 1
+
+        base_hours = int(os.environ.get("SCRAPE_BACKOFF_BASE_HOURS", "2"))
+        max_hours = int(os.environ.get("SCRAPE_BACKOFF_MAX_HOURS", "168"))
+        backoff_hours = min(base_hours * (2 ** (new_count - 1)), max_hours)
+        next_allowed = (now() + timedelta(hours=backoff_hours)).isoformat()
+
+        tz_sp = pytz.timezone('America/Sao_Paulo')
+        metadata = {
+            "last_attempt": now().isoformat(),
+            "last_attempt_local": now().astimezone(tz_sp).strftime("%d/%m/%Y %H:%M:%S %z"),
+            "next_allowed_attempt": next_allowed,
+            "next_allowed_attempt_local": (datetime.fromisoformat(next_allowed).astimezone(tz_sp).strftime("%d/%m/%Y %H:%M:%S %z")),
+            "status": "forbidden" if last_status == 403 else "error",
+            "http_status": last_status,
+            "forbidden_count": new_count,
+            "backoff_hours": backoff_hours,
+            "source_url": url
+        }
+
+        # Só grava se não houver um next_allowed_attempt futuro já presente
+        should_write = True
+        try:
+            if existing and existing.get('status') == 'forbidden' and existing.get('next_allowed_attempt'):
+                existing_next = datetime.fromisoformat(existing.get('next_allowed_attempt'))
+                if existing_next > now().astimezone(dj_tz.get_default_timezone()):
+                    should_write = False
+        except Exception:
+            should_write = True
+
+        if should_write:
+            record_failure(metadata)
+            return 'ERROR', f"Pre-check falhou (status={last_status}). metadata.json atualizado com status '{metadata['status']}' (backoff={backoff_hours}h)."
+
+        # Atualiza apenas forbidden_count se estiver em cooldown para aumentar backoff
+        try:
+            record_failure({"forbidden_count": new_count})
+            return 'WARNING', "Pre-check falhou, mas já existe cooldown ativo — incrementado forbidden_count."
+        except Exception:
+            return 'WARNING', "Pre-check falhou e não foi possível incrementar forbidden_count."
+    except Exception as e:
+        return 'ERROR', f"Falha ao calcular/gravar backoff metadata: {e}"
+
+
+def record_error(url: str, error):
+    """Grava status de erro no metadata (o último scraping bem-sucedido continua valendo)."""
+    try:
+        record_failure({
+            "last_attempt": now().isoformat(),
+            "source_url": url,
+            "status": "error",
+            "error": str(error)
+        })
+    except Exception as e:
+        logger.warning("Falha ao gravar metadata de erro: %s", e)
+
+
+# ------------------------------------------------------------------
+# Staging (um diretório por captura)
+# ------------------------------------------------------------------
+
+def staging_root() -> str:
+    return os.path.join(media_dir(), 'staging')
+
+
+def staging_dir(capture_sha: str) -> str:
+    return os.path.join(staging_root(), capture_sha[:16])
+
+
+def prune_staging(max_age_hours: float = 24):
+    """Remove diretórios de staging abandonados por cadeias que falharam."""
+    root = staging_root()
+    if not os.path.isdir(root):
+        return
+    limit = time.time() - max_age_hours * 3600
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if os.path.getmtime(path) < limit:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+
+def _copy_atomic(src: str, dst: str):
+    tmp = dst + '.tmp'
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+# ------------------------------------------------------------------
+# Etapas
+# ------------------------------------------------------------------
+
+def fetch_step(url: str = SOURCE_URL, wait: bool = False) -> dict:
+    """Consulta as fontes configuradas em paralelo e grava a captura da vencedora.
+
+    Levanta NotModified / RateLimited / SourceHTTPError (da fonte preferida) se nenhuma tiver dados novos.
+    """
+    prune_staging()
+    return fetch_first(configured_sources(url), read_metadata(), wait=wait)
+
+
+def browser_step(fetched: dict) -> dict:
+    """Carrega a tabela pelo Chrome e grava como nova captura."""
+    from structure.browser import load_table_with_browser
+
+    url = fetched["url"]
+    entry = store_capture(load_table_with_browser(url), url)
+    return {
+        "source": fetched.get("source", "fundamentus"),
+        "url": url,
+        "capture": entry["sha256"],
+        "fetched_at": entry["fetched_at"],
+        "needs_browser": False,
+        # Validadores HTTP não valem para o conteúdo renderizado pelo navegador
+        "source_etag": None,
+        "source_last_modified": None,
+    }
+
+
+def parse_step(fetched: dict) -> dict:
+    """Captura -> acoes_raw.csv + snapshot (sem seleção) no staging."""
+    html = read_capture(find_capture(fetched["capture"]))
+    staging = staging_dir(fetched["capture"])
+    result = run_pipeline(iter_table_rows(html, fallback=False), media_dir=staging,
+                          trace_memory=True, filters=False)
+    if not result["snapshot_version"]:
+        raise ValueError("Snapshot não gerado no parse (coluna Papel ausente?)")
+    return {
+        **fetched,
+        "staging": staging,
+        "header": result["header"],
+        "rows_raw": result["rows_raw"],
+        "pipeline": {"wall_ms": result["wall_ms"], "peak_kb": result["peak_kb"]},
+    }
+
+
+def filter_step(parsed: dict) -> dict:
+    """Snapshot do staging -> lista final, acoes_filtradas.csv e snapshot com a seleção."""
+    staging = parsed["staging"]
+    snap_root = os.path.join(staging, 'snapshot')
+    snap = load_snapshot(snap_root)
+    if snap is None:
+        raise ValueError(f"Snapshot do parse não encontrado em {snap_root}")
+    missing = [c for c in FINAL_COLUMNS if c not in parsed["header"]]
+    if missing:
+        raise ValueError(f"Colunas esperadas ausentes na tabela: {missing}")
+
+    rows = select_from_snapshot(snap)
+    lista_final = snap.papeis(rows)
+
+    # Texto original das colunas finais, lido do raw do staging
+    position = {int(r): pos for pos, r in enumerate(rows)}
+    final_rows = [None] * len(position)
+    with open(os.path.join(staging, RAW_FILENAME), 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        final_idx = [header.index(c) for c in FINAL_COLUMNS]
+        for i, row in enumerate(reader):
+            pos = position.get(i)
+            if pos is not None:
+                final_rows[pos] = [row[j] for j in final_idx]
+    write_final_csv(os.path.join(staging, FINAL_FILENAME), final_rows)
+
+    version = write_snapshot(snap.papeis(), {name: snap.column(name) for name in snap.columns},
+                             lista_final, root=snap_root)
+    return {
+        **parsed,
+        "lista_final": lista_final,
+        "rows_filtered": len(lista_final),
+        "snapshot_version": version,
+    }
+
+
+def stage_rows(rows, url: str, source: str = 'fundamentus', **validators) -> dict:
+    """Pipeline em streaming (linhas da página) num staging novo, no formato do filter_step.
+
+    Usado por quem já tem a resposta aberta (scrape_data, view): nada vai para
+    media/ antes de passar pelo validate_step.
+    """
+    prune_staging()
+    os.makedirs(staging_root(), exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='stream-', dir=staging_root())
+    try:
+        result = run_pipeline(rows, media_dir=staging, trace_memory=True)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return {
+        "source": source,
+        "url": url,
+        "capture": None,
+        "staging": staging,
+        "header": result["header"],
+        "rows_raw": result["rows_raw"],
+        "rows_filtered": result["rows_filtered"],
+        "lista_final": result["lista_final"],
+        "final_rows": result["final_rows"],
+        "snapshot_version": result["snapshot_version"],
+        "pipeline": {"wall_ms": result["wall_ms"], "peak_kb": result["peak_kb"]},
+        "source_etag": validators.get("source_etag"),
+        "source_last_modified": validators.get("source_last_modified"),
+    }
+
+
+def record_rejected(filtered: dict, report: dict):
+    """Guarda o relatório da validação que falhou sem tocar nos dados publicados."""
+    try:
+        metadata = read_metadata() or {}
+        metadata["validation"] = report
+        metadata["rejected"] = {
+            "at": now().isoformat(),
+            "source": filtered.get("source"),
+            "source_url": filtered.get("url"),
+            "capture": filtered.get("capture"),
+            "rows_raw": filtered.get("rows_raw"),
+        }
+        write_metadata(metadata)
+    except Exception as e:
+        logger.warning("Falha ao gravar relatório de validação: %s", e)
+
+
+def validate_step(filtered: dict) -> dict:
+    """Checa o snapshot do staging antes da publicação. Levanta ValidationFailed."""
+    version = filtered.get("snapshot_version")
+    snap = load_snapshot(os.path.join(filtered["staging"], 'snapshot'), version=version) if version else None
+    if snap is None:
+        report = {"ok": False, "errors": ["snapshot não gerado (coluna Papel ausente?)"], "warnings": []}
+    else:
+        try:
+            published = load_snapshot(snapshot_root())
+        except Exception:
+            published = None
+        report = validate_snapshot(snap, filtered.get("header"), read_metadata(), published,
+                                   source=filtered.get("source", "fundamentus"))
+    if not report["ok"]:
+        record_rejected(filtered, report)
+        shutil.rmtree(filtered["staging"], ignore_errors=True)
+        logger.error("Publicação bloqueada pela validação: %s", "; ".join(report["errors"]))
+        raise ValidationFailed(report)
+    for warning in report["warnings"]:
+        logger.warning("Validação: %s", warning)
+    return {**filtered, "validation": report}
+
+
+def publish_step(filtered: dict) -> dict:
+    """Copia o staging (já validado) para media/, ativa o snapshot e grava metadata + histórico."""
+    staging = filtered["staging"]
+    target = media_dir()
+    os.makedirs(target, exist_ok=True)
+    for name in (RAW_FILENAME, FINAL_FILENAME):
+        _copy_atomic(os.path.join(staging, name), os.path.join(target, name))
+
+    version = filtered["snapshot_version"]
+    snap_root = snapshot_root()
+    previous = read_current_version(snap_root)
+    dst = os.path.join(snap_root, version)
+    if not os.path.isdir(dst):
+        tmp = os.path.join(snap_root, f'.tmp-{version}-{os.getpid()}')
+        shutil.rmtree(tmp, ignore_errors=True)
+        shutil.copytree(os.path.join(staging, 'snapshot', version), tmp)
+        try:
+            os.replace(tmp, dst)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+    activate_version(version, snap_root)
+
+    # Replay de captura: os dados são do momento da captura, não de agora
+    scraped_at = datetime.fromisoformat(filtered["scraped_at"]) if filtered.get("scraped_at") else now()
+    tz_sp = pytz.timezone('America/Sao_Paulo')
+    source = filtered.get("source", "fundamentus")
+    # Referência da faixa de linhas da validação, por fonte
+    existing = read_metadata()
+    rows_by_source = existing.get("rows_by_source") if isinstance(existing, dict) else None
+    rows_by_source = {**(rows_by_source if isinstance(rows_by_source, dict) else {}), source: filtered["rows_raw"]}
+    write_metadata({
+        "last_scrape": scraped_at.isoformat(),
+        "last_scrape_local": scraped_at.astimezone(tz_sp).strftime("%d/%m/%Y %H:%M:%S %z"),
+        "rows_raw": filtered["rows_raw"],
+        "rows_filtered": filtered["rows_filtered"],
+        "rows_by_source": rows_by_source,
+        "source": source,
+        "source_url": filtered["url"],
+        "sources": get_health().summary(),
+        "snapshot_version": version,
+        "pipeline": filtered.get("pipeline"),
+        "capture": filtered.get("capture"),
+        "validation": filtered.get("validation"),
+        "source_etag": filtered.get("source_etag"),
+        "source_last_modified": filtered.get("source_last_modified"),
+        **({"replayed_from": filtered["replayed_from"]} if filtered.get("replayed_from") else {}),
+        "status": "success"
+    })
+
+    try:
+        day = day_for(scraped_at)
+        archive_media(day)
+        update_series(day)
+    except Exception as e:
+        logger.warning("Falha ao arquivar snapshot do dia: %s", e)
+
+    shutil.rmtree(staging, ignore_errors=True)
+    published = {
+        "source": filtered.get("source", "fundamentus"),
+        "url": filtered["url"],
+        "capture": filtered.get("capture"),
+        "snapshot_version": version,
+        "previous_version": previous,
+        "rows_raw": filtered["rows_raw"],
+        "rows_filtered": filtered["rows_filtered"],
+    }
+    try:
+        queue_alerts(published)
+    except Exception as e:
+        logger.warning("Falha ao enfileirar alertas: %s", e)
+    return published
+
+
+def upload_step(published: dict) -> dict:
+    """Envia os artefatos de media/ para o S3 (metadata.json por último).
+
+    Inclui `snapshot/<versão>/`: o serviço web tem outro disco e baixa a versão
+    anunciada do S3 (structure/snapshot_events.py). Depois do upload a versão é
+    anunciada de novo, agora que os listeners conseguem encontrá-la.
+    """
+    bucket = os.environ.get('AWS_S3_BUCKET')
+    if not bucket:
+        return {**published, "uploaded": False}
+    from structure.s3_utils import publish_files
+    from structure.snapshot_events import announce_version, snapshot_keys
+
+    target = media_dir()
+    version = published["snapshot_version"]
+    files = snapshot_keys(version, snapshot_root())
+    files.update({key: os.path.join(target, key) for key in (RAW_FILENAME, FINAL_FILENAME, 'metadata.json')})
+    summary = publish_files(files, bucket)
+    if summary['failed']:
+        failed = [obj['key'] for obj in summary['objects'] if obj['status'] == 'failed']
+        raise PublishError(f"Falha no upload para s3://{bucket}/: {failed}")
+    try:
+        announce_version(version)
+    except Exception as e:
+        logger.warning("Falha ao anunciar a versão %s após o upload: %s", version, e)
+    return {**published, "uploaded": True, "s3": {obj['key']: {'status': obj['status'], 'ms': obj.get('ms')} for obj in summary['objects']}}
+
+
+def run_steps(url: str = SOURCE_URL):
+    """Executa todas as etapas em sequência, no processo atual (sem Celery)."""
+    from structure.http_client import NotModified
+    from structure.sources import SourceUnavailable
+
+    try:
+        fetched = fetch_step(url, wait=True)
+    except NotModified:
+        logger.info("Página de origem sem alterações (HTTP 304) — nada a fazer.")
+        record_checked()
+        return None
+    except SourceUnavailable as e:
+        logger.info("Nenhuma fonte com dados novos (%s) — nada a fazer.", e)
+        return None
+    if fetched["needs_browser"]:
+        fetched = browser_step(fetched)
+    published = publish_step(validate_step(filter_step(parse_step(fetched))))
+    try:
+        return upload_step(published)
+    except PublishError as e:
+        logger.warning("%s", e)
+        return published
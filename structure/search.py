@@ -0,0 +1,158 @@
+# structure/search.py
+# Busca de Papéis no snapshot (tabela raw inteira, não só a lista final).
+#
+# O índice é montado uma vez por versão do snapshot, quando ele é aberto/aquecido:
+#
+#   prefixo  lista ordenada dos tickers normalizados + bisect (O(log n))
+#   fuzzy    trigramas ('  P', ' PE', 'PET', ...) -> linhas; a pontuação (Dice) sai de
+#            um np.bincount sobre as listas dos trigramas da consulta
+#
+# Os ranks de cada filtro e a posição entre as candidatas à lista também são
+# calculados na montagem (a partir do order.npy), então uma consulta só faz
+# bisect/bincount e monta alguns dicts: microssegundos, sem DataFrame.
+import bisect
+import re
+
+import numpy as np
+
+from structure.filters import FILTER_COLUMNS, passes_filters
+from structure.metrics import PERCENTILE_PREFIX, ZSCORE_PREFIX
+
+# Direção de cada filtro no rank (1 = melhor): liquidez e margem maiores, múltiplos menores
+FILTER_DIRECTIONS = {
+    'Liq.2meses': False,
+    'Mrg Ebit': False,
+    'EV/EBIT': True,
+    'P/L': True,
+}
+_CLEAN_RE = re.compile(r'[^A-Z0-9]')
+
+
+def normalize(text: str) -> str:
+    return _CLEAN_RE.sub('', str(text).upper())
+
+
+def trigrams(key: str) -> set:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TickerIndex:
+    """Índice de busca de uma versão do snapshot (somente leitura depois de montado)."""
+
+    def __init__(self, snap):
+        self.version = snap.version
+        self.snap = snap
+        papeis = snap.papeis()
+        self.papeis = papeis
+        keys = [normalize(p) for p in papeis]
+
+        order = sorted(range(len(keys)), key=lambda i: (keys[i], i))
+        self._sorted_keys = [keys[i] for i in order]
+        self._sorted_rows = order
+
+        grams = {}
+        self._gram_count = np.zeros(len(keys), dtype=np.int32)
+        for row, key in enumerate(keys):
+            key_grams = trigrams(key)
+            self._gram_count[row] = len(key_grams)
+            for gram in key_grams:
+                grams.setdefault(gram, []).append(row)
+        self._grams = {g: np.array(rows, dtype=np.int32) for g, rows in grams.items()}
+
+        self.indicators = [c for c in snap.columns if not c.startswith((PERCENTILE_PREFIX, ZSCORE_PREFIX))]
+        # Cópia (linhas x indicadores) fora do mmap: uma linha vira lista com um tolist()
+        self._values = np.ascontiguousarray(np.asarray(snap.numeric)[[snap.columns.index(c) for c in self.indicators]].T)
+        self._described = {}
+        n = snap.rows
+        self.ranks = {}
+        self.counts = {}
+        for name, ascending in FILTER_DIRECTIONS.items():
+            if not snap.has_column(name):
+                continue
+            values = np.asarray(snap.column(name))
+            rows = np.asarray(snap.sorted_rows(name))
+            # Múltiplos (EV/EBIT, P/L) só fazem sentido positivos: negativos ficam sem rank
+            rows = rows[np.isfinite(values[rows]) & (values[rows] > 0)] if ascending else rows[np.isfinite(values[rows])]
+            if not ascending:
+                rows = rows[::-1]
+            rank = np.zeros(n, dtype=np.int32)
+            rank[rows] = np.arange(1, len(rows) + 1, dtype=np.int32)
+            self.ranks[name] = rank
+            self.counts[name] = len(rows)
+
+        # Candidatas: passam em todos os filtros, na ordem da lista (EV/EBIT crescente)
+        self.passes = {}
+        self.candidate_rank = np.zeros(n, dtype=np.int32)
+        self.candidates = 0
+        if all(snap.has_column(c) for c in FILTER_COLUMNS):
+            liq, mrg, ev, pl = (np.asarray(snap.column(c)) for c in ('Liq.2meses', 'Mrg Ebit', 'EV/EBIT', 'P/L'))
+            with np.errstate(invalid='ignore'):
+                mask = np.asarray(passes_filters(liq, mrg, ev, pl), dtype=bool)
+                self.passes = {'Liq.2meses': liq >= 1_000_000, 'Mrg Ebit': mrg > 0, 'EV/EBIT': ev > 0, 'P/L': pl > 0}
+            candidates = snap.top_n('EV/EBIT', mask=mask)
+            self.candidate_rank[candidates] = np.arange(1, len(candidates) + 1, dtype=np.int32)
+            self.candidates = len(candidates)
+        self.list_position = np.zeros(n, dtype=np.int32)
+        selected = np.asarray(snap.selected, dtype=np.int64)
+        self.list_position[selected] = np.arange(1, len(selected) + 1, dtype=np.int32)
+
+    def prefix(self, query: str, limit: int = 10) -> list:
+        """Linhas cujo ticker começa com `query` (exato primeiro, depois em ordem alfabética)."""
+        key = normalize(query)
+        if not key:
+            return []
+        lo = bisect.bisect_left(self._sorted_keys, key)
+        hi = bisect.bisect_right(self._sorted_keys, key + '\x7f', lo)
+        return self._sorted_rows[lo:min(hi, lo + limit)]
+
+    def fuzzy(self, query: str, limit: int = 10, min_score: float = 0.3) -> list:
+        """(linha, score) dos tickers mais parecidos com `query` por trigramas (coeficiente de Dice)."""
+        key = normalize(query)
+        if not key:
+            return []
+        query_grams = trigrams(key)
+        lists = [self._grams[g] for g in query_grams if g in self._grams]
+        if not lists:
+            return []
+        shared = np.bincount(np.concatenate(lists), minlength=len(self.papeis))
+        score = 2.0 * shared / (len(query_grams) + self._gram_count)
+        hits = np.flatnonzero(score >= min_score)
+        if len(hits) > limit:
+            hits = hits[np.argpartition(-score[hits], limit - 1)[:limit]]
+        hits = hits[np.lexsort((hits, -score[hits]))]
+        return [(int(r), round(float(score[r]), 3)) for r in hits]
+
+    def search(self, query: str, limit: int = 10, mode: str = 'auto') -> list:
+        """Resultados prontos para JSON; `mode` = 'prefixo', 'fuzzy' ou 'auto' (prefixo, completado pelo fuzzy)."""
+        found = []
+        if mode in ('auto', 'prefixo'):
+            found = [(row, 1.0, 'prefixo') for row in self.prefix(query, limit)]
+        if mode == 'fuzzy' or (mode == 'auto' and len(found) < limit):
+            seen = {row for row, _, _ in found}
+            for row, score in self.fuzzy(query, limit):
+                if row not in seen and len(found) < limit:
+                    found.append((row, score, 'fuzzy'))
+        return [self.describe(row, score, match) for row, score, match in found]
+
+    def describe(self, row: int, score: float = None, match: str = None) -> dict:
+        base = self._described.get(row)
+        if base is None:
+            # Parte fixa do resultado, memoizada por linha (o índice não muda na versão)
+            position = int(self.list_position[row])
+            candidate = int(self.candidate_rank[row])
+            base = {
+                "papel": self.papeis[row],
+                "indicadores": {name: (v if v == v and abs(v) != float('inf') else None)
+                                for name, v in zip(self.indicators, self._values[row].tolist())},
+                "ranks": {
+                    name: {"rank": int(rank[row]) or None, "de": self.counts[name]}
+                    for name, rank in self.ranks.items()
+                },
+                "filtros": {name: bool(mask[row]) for name, mask in self.passes.items()},
+                "candidata": {"rank": candidate or None, "de": self.candidates},
+                "na_lista": position > 0,
+                "posicao_lista": position or None,
+            }
+            self._described[row] = base
+        return {"papel": base["papel"], "match": match, "score": score, **base}
@@ -0,0 +1,420 @@
+# structure/snapshot.py
+# Snapshot binário colunar da tabela raw, compartilhável entre workers via mmap.
+#
+# Layout em disco (um diretório por versão, endereçado pelo conteúdo):
+#   media/snapshot/<versao>/numeric.npy        float64 (n_colunas, n_linhas), colunas contíguas
+#   media/snapshot/<versao>/papel_offsets.npy  int64 (n_linhas + 1), offsets em papel.bin
+#   media/snapshot/<versao>/papel.bin          bytes UTF-8 concatenados dos Papéis
+#   media/snapshot/<versao>/selected.npy       int32, índices das linhas da lista final (em ordem)
+#   media/snapshot/<versao>/order.npy          int32 (n_colunas, n_linhas), argsort estável de cada coluna (NaN no fim)
+#   media/snapshot/<versao>/manifest.json      colunas, linhas, versão, data de criação
+#   media/snapshot/<versao>/table.html         (opcional) tabela da página já renderizada (bake_snapshot)
+#   media/snapshot/CURRENT                     nome da versão ativa (gravado por último)
+#
+# Além das colunas da tabela, `numeric.npy` traz os indicadores derivados de
+# `structure/metrics.py` (Earnings Yield, Magic Formula, Graham, pct:/z:),
+# listados em `manifest["derived"]`.
+#
+# Os workers abrem os arquivos com np.load(mmap_mode='r') / mmap, então todas as
+# páginas ficam no page cache do SO e são compartilhadas entre processos.
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.utils.timezone import now
+
+from structure.filters import clean_numeric
+from structure.metrics import PERCENTILE_PREFIX, ZSCORE_PREFIX, derive_metrics, is_derived
+
+logger = logging.getLogger(__name__)
+
+NUMERIC_FILE = 'numeric.npy'
+PAPEL_OFFSETS_FILE = 'papel_offsets.npy'
+PAPEL_BYTES_FILE = 'papel.bin'
+SELECTED_FILE = 'selected.npy'
+ORDER_FILE = 'order.npy'
+MANIFEST_FILE = 'manifest.json'
+FRAGMENT_FILE = 'table.html'
+CURRENT_FILE = 'CURRENT'
+
+
+def snapshot_root() -> str:
+    return os.path.join(settings.BASE_DIR, 'media', 'snapshot')
+
+
+def _compute_version(numeric: np.ndarray, papel_bytes: bytes, selected: np.ndarray, columns) -> str:
+    h = hashlib.sha256()
+    h.update(json.dumps(list(columns), ensure_ascii=False).encode('utf-8'))
+    h.update(numeric.tobytes())
+    h.update(papel_bytes)
+    h.update(selected.tobytes())
+    return h.hexdigest()[:16]
+
+
+def write_snapshot(papeis, columns: dict, lista_final=None, root: str = None, keep: int = None,
+                   derived: bool = True) -> str:
+    """Grava um snapshot binário e aponta `CURRENT` para ele. Retorna a versão.
+
+    `papeis` é a sequência de tickers (coluna `Papel`) e `columns` um dict
+    nome -> array float64 com o mesmo número de linhas. `lista_final` é a
+    lista ordenada de Papéis selecionados pelos filtros. Com `derived=True`
+    os indicadores de `structure.metrics` são calculados e gravados junto.
+    """
+    root = root or snapshot_root()
+    keep = keep if keep is not None else int(os.environ.get('SNAPSHOT_KEEP_VERSIONS', '3'))
+    os.makedirs(root, exist_ok=True)
+
+    columns = {name: values for name, values in columns.items() if not is_derived(name)}
+    derived_names = []
+    if derived:
+        extra = derive_metrics(columns)
+        derived_names = list(extra.keys())
+        columns.update(extra)
+
+    names = list(columns.keys())
+    n_rows = len(papeis)
+    numeric = np.empty((len(names), n_rows), dtype=np.float64)
+    for i, name in enumerate(names):
+        col = np.asarray(columns[name], dtype=np.float64)
+        if col.shape != (n_rows,):
+            raise ValueError(f"Coluna {name!r} com {col.shape[0]} linhas, esperado {n_rows}")
+        numeric[i] = col
+
+    encoded = [str(p).encode('utf-8') for p in papeis]
+    offsets = np.zeros(n_rows + 1, dtype=np.int64)
+    if encoded:
+        offsets[1:] = np.cumsum([len(b) for b in encoded])
+    papel_bytes = b''.join(encoded)
+
+    row_of = {str(p): i for i, p in enumerate(papeis)}
+    selected = np.array([row_of[p] for p in (lista_final or []) if p in row_of], dtype=np.int32)
+
+    version = _compute_version(numeric, papel_bytes, selected, names)
+    final_dir = os.path.join(root, version)
+
+    # Conteúdo endereçado: se a versão já existe não há nada para regravar
+    if not os.path.isdir(final_dir):
+        tmp_dir = os.path.join(root, f'.tmp-{version}-{os.getpid()}')
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        np.save(os.path.join(tmp_dir, NUMERIC_FILE), numeric)
+        np.save(os.path.join(tmp_dir, PAPEL_OFFSETS_FILE), offsets)
+        np.save(os.path.join(tmp_dir, SELECTED_FILE), selected)
+        # Índice de ordenação por coluna: consultas "top N por X" viram só uma máscara
+        np.save(os.path.join(tmp_dir, ORDER_FILE), np.argsort(numeric, axis=1, kind='stable').astype(np.int32))
+        with open(os.path.join(tmp_dir, PAPEL_BYTES_FILE), 'wb') as f:
+            f.write(papel_bytes)
+        manifest = {
+            "version": version,
+            "created_at": now().isoformat(),
+            "rows": n_rows,
+            "columns": names,
+            "derived": derived_names,
+            "selected": len(selected),
+        }
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=4)
+        try:
+            os.replace(tmp_dir, final_dir)
+        except OSError:
+            # Outro processo publicou a mesma versão ao mesmo tempo
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    activate_version(version, root, keep)
+    return version
+
+
+def activate_version(version: str, root: str = None, keep: int = None, announce: bool = True):
+    """Aponta `CURRENT` para `version` (já gravada em `root`) e limpa versões antigas.
+
+    Com `announce=False` os outros processos não são avisados (boot, sem rede).
+    """
+    root = root or snapshot_root()
+    keep = keep if keep is not None else int(os.environ.get('SNAPSHOT_KEEP_VERSIONS', '3'))
+    current_path = os.path.join(root, CURRENT_FILE)
+    with open(current_path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(current_path + '.tmp', current_path)
+
+    _prune_versions(root, version, keep)
+
+    # Só o snapshot servido pelo site é anunciado (staging/histórico não)
+    if announce and os.path.abspath(root) == os.path.abspath(snapshot_root()):
+        try:
+            from structure.snapshot_events import announce_version
+            announce_version(version)
+        except Exception as e:
+            logger.warning("Falha ao anunciar nova versão do snapshot: %s", e)
+
+
+def write_snapshot_from_df(df_raw, lista_final=None, root: str = None) -> str:
+    """Converte um DataFrame raw (strings no formato BR) e grava o snapshot."""
+    columns = {
+        col: df_raw[col].map(clean_numeric).to_numpy(dtype=np.float64)
+        for col in df_raw.columns if col != 'Papel'
+    }
+    return write_snapshot(df_raw['Papel'].astype(str).tolist(), columns, lista_final, root=root)
+
+
+def _prune_versions(root: str, current: str, keep: int):
+    """Remove versões antigas mantendo as `keep` mais recentes (e sempre a atual).
+
+    Workers que ainda têm os arquivos antigos mapeados continuam lendo normalmente:
+    o SO só libera as páginas quando o último mapeamento é fechado.
+    """
+    try:
+        entries = []
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if name.startswith('.') or name == CURRENT_FILE or not os.path.isdir(path):
+                continue
+            entries.append((os.path.getmtime(path), name))
+        entries.sort(reverse=True)
+        for _, name in entries[max(keep, 1):]:
+            if name != current:
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    except Exception as e:
+        logger.warning("Falha ao limpar versões antigas do snapshot: %s", e)
+
+
+def read_current_version(root: str = None):
+    root = root or snapshot_root()
+    try:
+        with open(os.path.join(root, CURRENT_FILE), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _ties_in_row_order(rows: np.ndarray, values) -> np.ndarray:
+    """Desfaz a inversão dos empates em `rows` (ordem decrescente vinda de order.npy[::-1]).
+
+    Empates ficam na ordem das linhas, como em filters.top_k. O(n), sem nova ordenação.
+    """
+    if len(rows) < 2:
+        return rows
+    vals = np.asarray(values)[rows]
+    change = np.empty(len(rows), dtype=bool)
+    change[0] = True
+    change[1:] = vals[1:] != vals[:-1]
+    if change.all():
+        return rows
+    group = np.cumsum(change) - 1
+    starts = np.flatnonzero(change)
+    ends = np.append(starts[1:], len(rows))
+    out = np.empty_like(rows)
+    out[starts[group] + ends[group] - 1 - np.arange(len(rows))] = rows
+    return out
+
+
+class Snapshot:
+    """Visão somente-leitura de um snapshot, sem cópia dos dados."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.version = self.manifest['version']
+        self.columns = list(self.manifest['columns'])
+        self.derived = list(self.manifest.get('derived', []))
+        self.rows = int(self.manifest['rows'])
+        self._col_index = {name: i for i, name in enumerate(self.columns)}
+
+        self.numeric = np.load(os.path.join(path, NUMERIC_FILE), mmap_mode='r')
+        self.papel_offsets = np.load(os.path.join(path, PAPEL_OFFSETS_FILE), mmap_mode='r')
+        self.selected = np.load(os.path.join(path, SELECTED_FILE), mmap_mode='r')
+        order_path = os.path.join(path, ORDER_FILE)
+        if os.path.exists(order_path):
+            self.order = np.load(order_path, mmap_mode='r')
+        else:
+            # Snapshot antigo, anterior ao order.npy
+            self.order = np.argsort(self.numeric, axis=1, kind='stable').astype(np.int32)
+        self._row_index = None
+        self._search_index = None
+        self._fragment = None
+
+        self._papel_buf = b''
+        papel_path = os.path.join(path, PAPEL_BYTES_FILE)
+        if os.path.getsize(papel_path) > 0:
+            with open(papel_path, 'rb') as f:
+                self._papel_buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def column(self, name: str) -> np.ndarray:
+        """Retorna a coluna numérica como view do arquivo mapeado (zero-copy)."""
+        return self.numeric[self._col_index[name]]
+
+    def has_column(self, name: str) -> bool:
+        return name in self._col_index
+
+    def sorted_rows(self, name: str) -> np.ndarray:
+        """Linhas em ordem crescente da coluna `name` (NaN no fim), sem ordenar de novo."""
+        return self.order[self._col_index[name]]
+
+    def top_n(self, by: str, n: int = None, mask=None, ascending: bool = True) -> np.ndarray:
+        """Linhas do top `n` por `by` entre as que passam em `mask` (O(n), sem sort)."""
+        rows = self.sorted_rows(by)
+        values = self.column(by)
+        rows = rows[np.isfinite(values[rows])]
+        if not ascending:
+            rows = _ties_in_row_order(rows[::-1], values)
+        if mask is not None:
+            rows = rows[np.asarray(mask, dtype=bool)[rows]]
+        return np.asarray(rows[:n] if n is not None else rows, dtype=np.int64)
+
+    @property
+    def row_index(self) -> dict:
+        """Papel -> linha (montado uma vez por versão e processo)."""
+        if self._row_index is None:
+            self._row_index = {self.papel(i): i for i in range(self.rows)}
+        return self._row_index
+
+    @property
+    def search_index(self):
+        """Índice de busca de Papéis (structure/search.py), montado uma vez por versão e processo."""
+        if self._search_index is None:
+            from structure.search import TickerIndex
+            self._search_index = TickerIndex(self)
+        return self._search_index
+
+    @property
+    def fragment(self):
+        """Tabela da página pré-renderizada (table.html), se o snapshot tiver uma; senão None."""
+        if self._fragment is None:
+            try:
+                with open(os.path.join(self.path, FRAGMENT_FILE), 'r', encoding='utf-8') as f:
+                    self._fragment = f.read()
+            except FileNotFoundError:
+                self._fragment = ''
+        return self._fragment or None
+
+    def row_of(self, papel: str):
+        return self.row_index.get(papel)
+
+    def warm(self):
+        """Lê todas as páginas mapeadas e monta os índices antes do snapshot entrar em uso."""
+        for arr in (self.numeric, self.order, self.papel_offsets, self.selected):
+            if arr.size:
+                np.asarray(arr).max()
+        if len(self._papel_buf):
+            self._papel_buf[::4096]
+        self.row_index
+        self.search_index
+        self.fragment
+        return self
+
+    def papel(self, row: int) -> str:
+        start, end = int(self.papel_offsets[row]), int(self.papel_offsets[row + 1])
+        return self._papel_buf[start:end].decode('utf-8')
+
+    def papeis(self, rows=None) -> list:
+        rows = range(self.rows) if rows is None else rows
+        return [self.papel(int(r)) for r in rows]
+
+    def frame(self, columns, rows=None):
+        """Monta um DataFrame pequeno com `Papel` + colunas pedidas (floats).
+
+        Só as linhas pedidas são copiadas; útil para renderizar a lista final.
+        """
+        import pandas as pd
+
+        rows = np.asarray(self.selected if rows is None else rows, dtype=np.int64)
+        data = {'Papel': self.papeis(rows)}
+        for name in columns:
+            if name == 'Papel':
+                continue
+            data[name] = np.asarray(self.column(name)[rows]) if name in self._col_index else np.full(len(rows), np.nan)
+        return pd.DataFrame(data)
+
+
+    def columnar(self, columns=None, decimals: int = 4) -> dict:
+        """Snapshot inteiro em formato colunar para o navegador (JSON compacto).
+
+        Uma lista por coluna em vez de um objeto por linha; NaN vira null.
+        Percentis e z-scores ficam de fora (o cliente não usa e dobrariam o payload).
+        """
+        if columns is None:
+            columns = [c for c in self.columns if not c.startswith((PERCENTILE_PREFIX, ZSCORE_PREFIX))]
+        values = []
+        for name in columns:
+            col = np.round(np.asarray(self.column(name), dtype=np.float64), decimals)
+            values.append([v if np.isfinite(v) else None for v in col.tolist()])
+        return {
+            'version': self.version,
+            'columns': list(columns),
+            'papel': self.papeis(),
+            'values': values,
+            'selected': [int(r) for r in self.selected],
+        }
+
+
+def load_snapshot(root: str = None, version: str = None):
+    """Abre o snapshot `version` (ou o atual). Retorna None se não existir."""
+    root = root or snapshot_root()
+    version = version or read_current_version(root)
+    if not version:
+        return None
+    path = os.path.join(root, version)
+    if not os.path.isdir(path):
+        return None
+    return Snapshot(path)
+
+
+_cache_lock = threading.Lock()
+# (chave, snapshot) do processo: trocado numa única atribuição, então uma
+# requisição sempre vê um snapshot inteiro (o antigo ou o novo)
+_current = (None, None)
+# Raízes mantidas em dia pelo listener Redis (structure/snapshot_events.py):
+# enquanto ele estiver conectado, get_snapshot não precisa consultar o disco
+_pushed_roots = set()
+
+
+def _current_key(root: str):
+    try:
+        st = os.stat(os.path.join(root, CURRENT_FILE))
+    except FileNotFoundError:
+        return None
+    return (root, st.st_mtime_ns, st.st_size)
+
+
+def get_snapshot(root: str = None):
+    """Snapshot atual do processo, reaberto apenas quando `CURRENT` muda."""
+    global _current
+    root = root or snapshot_root()
+    key, snap = _current
+    if snap is not None and root in _pushed_roots and key[0] == root:
+        return snap
+    key = _current_key(root)
+    if key is None:
+        return None
+    cached_key, snap = _current
+    if cached_key == key and snap is not None:
+        return snap
+    with _cache_lock:
+        if _current[0] != key:
+            try:
+                _current = (key, load_snapshot(root))
+            except Exception as e:
+                logger.warning("Falha ao abrir snapshot binário: %s", e)
+                return None
+        return _current[1]
+
+
+def swap_snapshot(snap, root: str = None):
+    """Instala um snapshot já aberto (e aquecido) como o atual do processo."""
+    global _current
+    root = root or snapshot_root()
+    with _cache_lock:
+        _current = (_current_key(root) or (root, 0, 0), snap)
+
+
+def set_pushed(root: str, active: bool):
+    if active:
+        _pushed_roots.add(root)
+    else:
+        _pushed_roots.discard(root)
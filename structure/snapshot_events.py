@@ -0,0 +1,207 @@
+# structure/snapshot_events.py
+# Propagação de novas versões do snapshot entre processos via Redis pub/sub.
+#
+# Quem publica um snapshot (activate_version) grava a versão em `snapshot:version`,
+# incrementa `snapshot:seq` e publica {"version", "seq"} no canal
+# `snapshot:invalidate`. Cada processo web roda um listener (thread daemon) que
+# abre e aquece a versão nova e só então troca o snapshot do processo, então
+# nenhuma requisição paga a abertura a frio. Sem Redis, get_snapshot continua
+# detectando mudanças pelo `CURRENT` no disco.
+#
+# O web e os workers do Celery não compartilham disco: o upload_step envia
+# `snapshot/<versão>/` para o S3 (antes do metadata.json) e anuncia de novo; o
+# listener que não encontra a versão anunciada baixa do S3 e ativa localmente.
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis
+except Exception:
+    redis = None
+
+CHANNEL = 'snapshot:invalidate'
+VERSION_KEY = 'snapshot:version'
+SEQ_KEY = 'snapshot:seq'
+# Prefixo das versões no bucket (upload_step)
+S3_PREFIX = 'snapshot'
+
+
+def _redis_url() -> str:
+    return os.environ.get('SNAPSHOT_REDIS_URL') or os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+
+def announce_version(version: str, client=None):
+    """Grava a versão atual e avisa todos os processos. Retorna o número de sequência."""
+    if redis is None and client is None:
+        return None
+    client = client or redis.Redis.from_url(_redis_url(), socket_connect_timeout=1, socket_timeout=1)
+    pipe = client.pipeline()
+    pipe.set(VERSION_KEY, version)
+    pipe.incr(SEQ_KEY)
+    seq = pipe.execute()[1]
+    client.publish(CHANNEL, json.dumps({"version": version, "seq": seq}))
+    return seq
+
+
+def snapshot_keys(version: str, root: str) -> dict:
+    """Chaves S3 (`snapshot/<versão>/<arquivo>`) -> caminhos locais da versão em `root`."""
+    path = os.path.join(root, version)
+    return {f'{S3_PREFIX}/{version}/{name}': os.path.join(path, name)
+            for name in sorted(os.listdir(path)) if not name.endswith('.tmp')}
+
+
+def download_version(version: str, root: str) -> bool:
+    """Baixa `snapshot/<versão>/` do S3 para `root` (troca atômica do diretório).
+
+    Retorna False se não houver bucket ou a versão ainda não estiver no S3 (o
+    publicador anuncia de novo depois do upload).
+    """
+    from structure.snapshot import MANIFEST_FILE
+    bucket = os.environ.get('AWS_S3_BUCKET')
+    if not bucket:
+        return False
+    from structure.s3_utils import download_files, list_keys
+
+    prefix = f'{S3_PREFIX}/{version}/'
+    keys = list_keys(bucket, prefix)
+    if prefix + MANIFEST_FILE not in keys:
+        return False
+    os.makedirs(root, exist_ok=True)
+    tmp = os.path.join(root, f'.tmp-{version}-{os.getpid()}')
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    try:
+        download_files({key: os.path.join(tmp, key[len(prefix):]) for key in keys}, bucket)
+        os.replace(tmp, os.path.join(root, version))
+    except OSError:
+        # Outro processo baixou a mesma versão ao mesmo tempo
+        shutil.rmtree(tmp, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return os.path.isdir(os.path.join(root, version))
+
+
+def _notify_updates(version: str, seq=None):
+    """Acorda as conexões SSE deste processo (structure.updates)."""
+    try:
+        from structure.updates import broadcaster
+        broadcaster.publish(version, seq)
+    except Exception as e:
+        logger.warning("Falha ao avisar conexões SSE: %s", e)
+
+
+class SnapshotListener(threading.Thread):
+    """Thread que aplica as versões anunciadas no snapshot do processo."""
+
+    def __init__(self, root: str = None, redis_url: str = None):
+        super().__init__(name='snapshot-listener', daemon=True)
+        from structure.snapshot import snapshot_root
+        self.root = root or snapshot_root()
+        self.redis_url = redis_url or _redis_url()
+        self.connected = False
+        self.seq = None
+        self._stopping = threading.Event()
+        self._pubsub = None
+
+    def apply(self, version: str, seq=None):
+        from structure.snapshot import activate_version, get_snapshot, load_snapshot, swap_snapshot
+        if not version:
+            return False
+        if isinstance(version, bytes):
+            version = version.decode('utf-8')
+        current = get_snapshot(self.root)
+        if current is not None and current.version == version:
+            self.seq = seq if seq is not None else self.seq
+            _notify_updates(version, self.seq)
+            return False
+        started = time.perf_counter()
+        snap = load_snapshot(self.root, version)
+        if snap is None:
+            # Publicado por um worker com outro disco: a versão vem do S3
+            try:
+                if download_version(version, self.root):
+                    activate_version(version, self.root, announce=False)
+                    snap = load_snapshot(self.root, version)
+            except Exception as e:
+                logger.warning("Falha ao baixar o snapshot %s do S3: %s", version, e)
+        if snap is None:
+            logger.warning("Snapshot %s anunciado mas não encontrado em %s nem no S3", version, self.root)
+            return False
+        swap_snapshot(snap.warm(), self.root)
+        self.seq = seq if seq is not None else self.seq
+        _notify_updates(version, self.seq)
+        logger.info("Snapshot trocado para %s (aquecido em %.1f ms)", version, (time.perf_counter() - started) * 1000)
+        return True
+
+    def _handle(self, message):
+        try:
+            payload = json.loads(message['data'])
+            self.apply(payload.get('version'), payload.get('seq'))
+        except Exception as e:
+            logger.warning("Mensagem de snapshot inválida (%s): %s", e, message.get('data'))
+
+    def run(self):
+        from structure.snapshot import set_pushed
+        backoff = 1.0
+        while not self._stopping.is_set():
+            try:
+                client = redis.Redis.from_url(self.redis_url, socket_connect_timeout=2, health_check_interval=30)
+                self._pubsub = client.pubsub(ignore_subscribe_messages=True)
+                self._pubsub.subscribe(CHANNEL)
+                # Mensagens perdidas enquanto estava desconectado: reconcilia pela chave
+                self.apply(client.get(VERSION_KEY), int(client.get(SEQ_KEY) or 0))
+                self.connected = True
+                set_pushed(self.root, True)
+                backoff = 1.0
+                for message in self._pubsub.listen():
+                    if self._stopping.is_set():
+                        break
+                    if message.get('type') == 'message':
+                        self._handle(message)
+            except Exception as e:
+                if not self._stopping.is_set():
+                    logger.warning("Listener de snapshot desconectado do Redis (%s) — nova tentativa em %.0fs", e, backoff)
+            finally:
+                self.connected = False
+                set_pushed(self.root, False)
+            self._stopping.wait(backoff)
+            backoff = min(backoff * 2, 60.0)
+
+    def stop(self):
+        self._stopping.set()
+        try:
+            if self._pubsub is not None:
+                self._pubsub.close()
+        except Exception:
+            pass
+
+
+_listener = None
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def start_listener(root: str = None):
+    """Inicia o listener deste processo (idempotente; refeito após fork)."""
+    global _listener, _listener_pid
+    if redis is None or os.environ.get('SNAPSHOT_LISTENER', '1') == '0':
+        return None
+    if _listener is not None and _listener_pid == os.getpid():
+        return _listener
+    with _listener_lock:
+        if _listener is None or _listener_pid != os.getpid():
+            _listener = SnapshotListener(root)
+            _listener_pid = os.getpid()
+            _listener.start()
+    return _listener
+
+
+def get_listener():
+    return _listener if _listener_pid == os.getpid() else None
@@ -0,0 +1,466 @@
+# structure/sources.py
+# Fontes da tabela de fundamentos.
+#
+# Cada fonte entrega o mesmo resultado da etapa `fetch` (uma captura HTML com a
+# tabela `resultado` no esquema de colunas do Fundamentus), então parse, filtros e
+# publicação não sabem de onde os dados vieram:
+#
+#   fundamentus -> GET condicional do resultado.php (SOURCE_URL / FUNDAMENTUS_URL)
+#   csv         -> o CSV mais novo deixado em SOURCE_CSV_DIR (padrão media/drop/),
+#                  com os nomes de coluna normalizados para os do Fundamentus
+#
+# `fetch_first` consulta primeiro as fontes locais e depois as de rede saudáveis, em
+# paralelo, e fica com a primeira que responder com dados novos. A saúde de cada
+# fonte (taxa de sucesso e latência médias, falhas seguidas, cooldown) fica em
+# media/sources_health.json: depois de SOURCE_FAILURES_BEFORE_COOLDOWN falhas
+# seguidas (ou um 403) a fonte sai da disputa por SOURCE_COOLDOWN_SECONDS,
+# dobrando a cada nova falha.
+import csv
+import html
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from django.conf import settings
+from django.utils.timezone import now
+
+from structure.captures import store_capture
+from structure.filters import FINAL_COLUMNS
+from structure.http_client import NotModified, fetch, validators_from_metadata, validators_from_response
+from structure.ratelimit import RateLimited
+
+logger = logging.getLogger(__name__)
+
+# FUNDAMENTUS_URL aponta o scraping para outro servidor (ex.: o stand-in local de testes de carga)
+SOURCE_URL = os.environ.get("FUNDAMENTUS_URL", "https://www.fundamentus.com.br/resultado.php")
+_TABLE_RE = re.compile(r'<table[^>]*\bid\s*=\s*["\']?resultado\b', re.IGNORECASE)
+
+# Cabeçalho do resultado.php: esquema comum a todas as fontes
+FUNDAMENTUS_COLUMNS = [
+    'Papel', 'Cotação', 'P/L', 'P/VP', 'PSR', 'Div.Yield', 'P/Ativo', 'P/Cap.Giro', 'P/EBIT',
+    'P/Ativ Circ.Liq', 'EV/EBIT', 'EV/EBITDA', 'Mrg Ebit', 'Mrg. Líq.', 'Liq. Corr.', 'ROIC', 'ROE',
+    'Liq.2meses', 'Patrim. Líq', 'Dív.Brut/ Patrim.', 'Cresc. Rec.5a',
+]
+PERCENT_COLUMNS = {'Div.Yield', 'Mrg Ebit', 'Mrg. Líq.', 'ROIC', 'ROE', 'Cresc. Rec.5a'}
+
+
+def _column_key(name: str) -> str:
+    """'Mrg. Líq.' -> 'mrgliq' (sem acentos, pontuação nem espaços)."""
+    text = unicodedata.normalize('NFKD', str(name)).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^a-z0-9]', '', text.lower())
+
+
+COLUMN_ALIASES = {_column_key(c): c for c in FUNDAMENTUS_COLUMNS}
+COLUMN_ALIASES.update({
+    'ticker': 'Papel', 'acao': 'Papel', 'codigo': 'Papel',
+    'preco': 'Cotação', 'cotacao': 'Cotação',
+    'dy': 'Div.Yield', 'dividendyield': 'Div.Yield',
+    'margemebit': 'Mrg Ebit', 'margemliquida': 'Mrg. Líq.',
+    'liquidez2meses': 'Liq.2meses', 'liquidezmediadiaria': 'Liq.2meses',
+    'liquidezcorrente': 'Liq. Corr.',
+    'patrimonioliquido': 'Patrim. Líq',
+    'divbrutpatrim': 'Dív.Brut/ Patrim.',
+    'crescrec5a': 'Cresc. Rec.5a',
+})
+
+
+class SourceHTTPError(Exception):
+    """A origem respondeu com status diferente de 200."""
+
+    def __init__(self, url: str, status: int):
+        super().__init__(f"{url} respondeu HTTP {status}")
+        self.url = url
+        self.status = status
+
+
+class SourceUnavailable(Exception):
+    """A fonte não tem dados a oferecer agora (ex.: nenhum CSV novo). Não conta como falha."""
+
+
+# ------------------------------------------------------------------
+# Fontes
+# ------------------------------------------------------------------
+
+class Source:
+    """Interface das fontes: `fetch` grava a captura e devolve o dict da etapa fetch."""
+
+    name = ''
+    # Fontes locais (sem rede) são consultadas antes da disputa em paralelo
+    local = False
+
+    def __init__(self, url: str):
+        self.url = url
+
+    def fetch(self, meta: dict = None, wait: bool = False) -> dict:
+        raise NotImplementedError
+
+    def _result(self, entry: dict, **extra) -> dict:
+        return {
+            "source": self.name,
+            "url": self.url,
+            "capture": entry["sha256"],
+            "fetched_at": entry["fetched_at"],
+            "needs_browser": False,
+            "source_etag": None,
+            "source_last_modified": None,
+            **extra,
+        }
+
+
+class FundamentusSource(Source):
+    """resultado.php pelo cliente HTTP compartilhado (GET condicional + rate limiter)."""
+
+    name = 'fundamentus'
+
+    def __init__(self, url: str = None):
+        super().__init__(url or SOURCE_URL)
+
+    def fetch(self, meta: dict = None, wait: bool = False) -> dict:
+        # ETag/Last-Modified só valem se o último scraping publicado veio daqui
+        validators = validators_from_metadata(meta) if _published_source(meta) == self.name else {}
+        r = fetch(self.url, validators=validators, wait=wait)
+        if r.status_code != 200:
+            raise SourceHTTPError(self.url, r.status_code)
+        if r.encoding is None:
+            r.encoding = r.apparent_encoding
+        page = r.text
+        entry = store_capture(page, self.url)
+        return self._result(entry, needs_browser=_TABLE_RE.search(page) is None, **validators_from_response(r))
+
+
+class CsvDropSource(Source):
+    """Último CSV deixado num diretório (exportação de outro provedor, planilha, etc.).
+
+    Aceita separador ',' ou ';' e números no formato BR ('1.234,56') ou EN
+    ('1,234.56'), decidido por coluna, nas mesmas unidades da tabela do Fundamentus (percentuais em %).
+    Só entra na disputa um arquivo mais novo que o último scraping publicado e com
+    menos de SOURCE_CSV_MAX_AGE_HOURS horas.
+    """
+
+    name = 'csv'
+    local = True
+
+    def __init__(self, directory: str = None, max_age_hours: float = None):
+        self.directory = directory or os.environ.get('SOURCE_CSV_DIR') or os.path.join(settings.BASE_DIR, 'media', 'drop')
+        self.max_age_hours = max_age_hours if max_age_hours is not None else float(os.environ.get('SOURCE_CSV_MAX_AGE_HOURS', '24'))
+        super().__init__(f"file://{os.path.abspath(self.directory)}")
+
+    def latest_file(self):
+        try:
+            names = [n for n in os.listdir(self.directory) if n.lower().endswith('.csv')]
+        except OSError:
+            return None
+        paths = [os.path.join(self.directory, n) for n in names]
+        return max(paths, key=os.path.getmtime) if paths else None
+
+    def fetch(self, meta: dict = None, wait: bool = False) -> dict:
+        path = self.latest_file()
+        if path is None:
+            raise SourceUnavailable(f"Nenhum CSV em {self.directory}")
+        mtime = os.path.getmtime(path)
+        if time.time() - mtime > self.max_age_hours * 3600:
+            raise SourceUnavailable(f"{os.path.basename(path)} tem mais de {self.max_age_hours:g}h")
+        published = _published_at(meta)
+        if published is not None and mtime <= published:
+            # Nada mais novo que o que já está publicado
+            raise NotModified(None)
+
+        header, rows = normalize_csv(path)
+        url = f"file://{os.path.abspath(path)}"
+        entry = store_capture(rows_to_html(header, rows), url)
+        stat = os.stat(path)
+        return {**self._result(entry), "url": url, "source_etag": f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'}
+
+
+_NUMBER_RE = re.compile(r'^[+-]?[\d.,]+%?$')
+
+
+def _decimal_vote(value: str):
+    """Separador decimal que o valor deixa claro (',' ou '.'), ou None se ambíguo.
+
+    '1.234,56' e '1,234.56' -> o último; '1.234.567' -> o outro; '4,5' / '4.50' -> o próprio.
+    '1.234' e '1,234' (3 dígitos depois) não decidem nada.
+    """
+    digits = value.strip().lstrip('+-').rstrip('%')
+    if '.' in digits and ',' in digits:
+        return '.' if digits.rindex('.') > digits.rindex(',') else ','
+    for sep, other in (('.', ','), (',', '.')):
+        if sep in digits:
+            if digits.count(sep) > 1:
+                return other
+            return sep if len(digits.rsplit(sep, 1)[1]) != 3 else None
+    return None
+
+
+def decimal_separators(columns: list, rows: list, default: str) -> dict:
+    """Separador decimal de cada coluna numérica: pelos valores da coluna, senão do arquivo, senão `default`."""
+    votes = {c: {',': 0, '.': 0} for c in columns}
+    for row in rows:
+        for column, value in zip(columns, row):
+            if column == 'Papel' or not _NUMBER_RE.match((value or '').strip()):
+                continue
+            vote = _decimal_vote(value)
+            if vote:
+                votes[column][vote] += 1
+    total = {sep: sum(v[sep] for v in votes.values()) for sep in (',', '.')}
+    file_sep = default if total[','] == total['.'] else max(total, key=total.get)
+    return {c: file_sep if v[','] == v['.'] else max(v, key=v.get) for c, v in votes.items()}
+
+
+def _normalize_value(column: str, value: str, decimal: str = ',') -> str:
+    """Valor do CSV -> formato do resultado.php ('1234,56', percentuais com '%')."""
+    value = (value or '').strip()
+    if column == 'Papel' or not _NUMBER_RE.match(value):
+        return value
+    thousands = '.' if decimal == ',' else ','
+    value = value.replace(thousands, '').replace(decimal, ',')
+    if column in PERCENT_COLUMNS and not value.endswith('%'):
+        value += '%'
+    return value
+
+
+def normalize_csv(path: str):
+    """CSV de outro provedor -> (FUNDAMENTUS_COLUMNS, linhas no mesmo esquema). Levanta ValueError."""
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        sample = f.read(4096)
+        f.seek(0)
+        delimiter = ';' if sample.count(';') > sample.count(',') else ','
+        reader = csv.reader(f, delimiter=delimiter)
+        try:
+            raw_header = next(reader)
+        except StopIteration:
+            raise ValueError(f"CSV vazio: {path}")
+        mapping = {}
+        for i, name in enumerate(raw_header):
+            column = COLUMN_ALIASES.get(_column_key(name))
+            if column and column not in mapping:
+                mapping[column] = i
+        missing = [c for c in FINAL_COLUMNS if c not in mapping]
+        if missing:
+            raise ValueError(f"Colunas obrigatórias ausentes no CSV {os.path.basename(path)}: {missing}")
+        rows = []
+        for row in reader:
+            if not row or not any(cell.strip() for cell in row):
+                continue
+            rows.append([
+                row[mapping[c]] if c in mapping and mapping[c] < len(row) else ''
+                for c in FUNDAMENTUS_COLUMNS
+            ])
+    # Separador decimal decidido por coluna ('1.234' é milhar numa coluna BR e decimal numa EN);
+    # sem nenhum valor decisivo, ';' indica planilha BR e ',' exportação EN
+    decimals = decimal_separators(FUNDAMENTUS_COLUMNS, rows, ',' if delimiter == ';' else '.')
+    rows = [[_normalize_value(c, v, decimals[c]) for c, v in zip(FUNDAMENTUS_COLUMNS, row)] for row in rows]
+    return list(FUNDAMENTUS_COLUMNS), rows
+
+
+def rows_to_html(header, rows) -> str:
+    """Tabela `resultado` mínima, lida pelo mesmo parser das capturas do site."""
+    parts = ['<html><body><table id="resultado"><thead><tr>']
+    parts.extend(f'<th>{html.escape(c)}</th>' for c in header)
+    parts.append('</tr></thead><tbody>\n')
+    for row in rows:
+        parts.append('<tr>' + ''.join(f'<td>{html.escape(v)}</td>' for v in row) + '</tr>\n')
+    parts.append('</tbody></table></body></html>\n')
+    return ''.join(parts)
+
+
+def _published_source(meta) -> str:
+    if not isinstance(meta, dict):
+        return None
+    return meta.get('source') or 'fundamentus'
+
+
+def _published_at(meta):
+    """last_scrape (epoch) do último scraping publicado com sucesso."""
+    if not isinstance(meta, dict) or meta.get('status') != 'success' or not meta.get('last_scrape'):
+        return None
+    try:
+        return datetime.fromisoformat(meta['last_scrape']).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+SOURCE_CLASSES = {cls.name: cls for cls in (FundamentusSource, CsvDropSource)}
+
+
+def configured_sources(url: str = None) -> list:
+    """Fontes de SCRAPE_SOURCES (padrão 'fundamentus,csv'), na ordem de preferência."""
+    sources = []
+    for name in os.environ.get('SCRAPE_SOURCES', 'fundamentus,csv').split(','):
+        name = name.strip()
+        if not name:
+            continue
+        cls = SOURCE_CLASSES.get(name)
+        if cls is None:
+            logger.warning("Fonte desconhecida em SCRAPE_SOURCES: %s", name)
+            continue
+        sources.append(cls(url) if cls is FundamentusSource else cls())
+    return sources or [FundamentusSource(url)]
+
+
+# ------------------------------------------------------------------
+# Saúde das fontes
+# ------------------------------------------------------------------
+
+class SourceHealth:
+    """Placar por fonte, persistido em JSON (leitura-modificação-escrita atômica)."""
+
+    ALPHA = 0.3
+
+    def __init__(self, path: str = None):
+        self.path = path or os.path.join(settings.BASE_DIR, 'media', 'sources_health.json')
+        self.failures_before_cooldown = int(os.environ.get('SOURCE_FAILURES_BEFORE_COOLDOWN', '2'))
+        self.cooldown_seconds = float(os.environ.get('SOURCE_COOLDOWN_SECONDS', '300'))
+        self.max_cooldown_seconds = float(os.environ.get('SOURCE_COOLDOWN_MAX_SECONDS', '21600'))
+        self._lock = threading.Lock()
+
+    def load(self) -> dict:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, data: dict):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        os.replace(tmp, self.path)
+
+    def available(self, name: str, data: dict = None) -> bool:
+        entry = (data if data is not None else self.load()).get(name) or {}
+        return float(entry.get('cooldown_until') or 0) <= time.time()
+
+    def record(self, name: str, ok: bool, elapsed_ms: float = None, status=None, error: str = None):
+        with self._lock:
+            data = self.load()
+            entry = data.get(name) or {'score': 1.0, 'latency_ms': None, 'failures': 0}
+            entry['score'] = round((1 - self.ALPHA) * float(entry.get('score', 1.0)) + self.ALPHA * (1.0 if ok else 0.0), 4)
+            if elapsed_ms is not None:
+                previous = entry.get('latency_ms')
+                entry['latency_ms'] = round(elapsed_ms if previous is None else (1 - self.ALPHA) * previous + self.ALPHA * elapsed_ms, 1)
+            entry['last_checked'] = now().isoformat()
+            if ok:
+                entry['failures'] = 0
+                entry['cooldown_until'] = None
+                entry['last_ok'] = entry['last_checked']
+            else:
+                entry['failures'] = int(entry.get('failures', 0)) + 1
+                entry['last_error'] = error or (f"HTTP {status}" if status else None)
+                if status == 403 or entry['failures'] >= self.failures_before_cooldown:
+                    extra = max(0, entry['failures'] - self.failures_before_cooldown)
+                    cooldown = min(self.max_cooldown_seconds, self.cooldown_seconds * (2 ** extra))
+                    entry['cooldown_until'] = time.time() + cooldown
+                    logger.warning("Fonte %s fora da disputa por %.0fs (%s falha(s) seguidas)", name, cooldown, entry['failures'])
+            data[name] = entry
+            try:
+                self._save(data)
+            except OSError as e:
+                logger.warning("Falha ao gravar saúde das fontes: %s", e)
+
+    def summary(self) -> dict:
+        """Resumo para o metadata.json: score, latência e se está disponível."""
+        data = self.load()
+        return {
+            name: {
+                'score': entry.get('score'),
+                'latency_ms': entry.get('latency_ms'),
+                'failures': entry.get('failures', 0),
+                'available': self.available(name, data),
+            }
+            for name, entry in sorted(data.items())
+        }
+
+
+_health = None
+
+
+def get_health() -> SourceHealth:
+    global _health
+    if _health is None:
+        _health = SourceHealth()
+    return _health
+
+
+# ------------------------------------------------------------------
+# Disputa entre as fontes
+# ------------------------------------------------------------------
+
+def _timed_fetch(source: Source, meta, wait, health: SourceHealth) -> dict:
+    started = time.perf_counter()
+    try:
+        result = source.fetch(meta, wait=wait)
+    except NotModified:
+        health.record(source.name, True, (time.perf_counter() - started) * 1000)
+        raise
+    except (SourceUnavailable, RateLimited):
+        # Sem dados ou sem token: não diz nada sobre a saúde da fonte
+        raise
+    except Exception as e:
+        health.record(source.name, False, (time.perf_counter() - started) * 1000,
+                      status=getattr(e, 'status', None), error=str(e)[:200])
+        raise
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    health.record(source.name, True, elapsed_ms)
+    return {**result, "source_ms": round(elapsed_ms, 1)}
+
+
+def fetch_first(sources: list, meta: dict = None, wait: bool = False, health: SourceHealth = None) -> dict:
+    """Devolve o resultado da primeira fonte disponível com dados novos.
+
+    Fontes locais (CSV) são consultadas antes, em ordem: se uma delas tiver dados, a
+    rede nem é usada (nenhum token do rate limiter gasto). As demais disputam em
+    paralelo. Fontes em cooldown ficam de fora (se todas estiverem, todas são
+    tentadas). Sem vencedora: NotModified se nenhuma teve erro de verdade; senão o
+    erro da fonte mais preferida (ordem de `sources`), para quem chama aplicar retry/backoff.
+    """
+    health = health or get_health()
+    data = health.load()
+    candidates = [s for s in sources if health.available(s.name, data)] or list(sources)
+
+    errors = {}
+    for source in [s for s in candidates if s.local]:
+        try:
+            return _won(source, _timed_fetch(source, meta, wait, health))
+        except Exception as e:
+            errors[source.name] = e
+
+    network = [s for s in candidates if not s.local]
+    if len(network) == 1:
+        try:
+            return _won(network[0], _timed_fetch(network[0], meta, wait, health))
+        except Exception as e:
+            errors[network[0].name] = e
+    elif network:
+        pool = ThreadPoolExecutor(max_workers=len(network), thread_name_prefix='source')
+        try:
+            futures = {pool.submit(_timed_fetch, s, meta, wait, health): s for s in network}
+            for future in as_completed(futures):
+                source = futures[future]
+                try:
+                    return _won(source, future.result())
+                except Exception as e:
+                    errors[source.name] = e
+        finally:
+            # As perdedoras terminam em segundo plano (a saúde delas é registrada mesmo assim)
+            pool.shutdown(wait=False)
+
+    ordered = [errors[s.name] for s in candidates if s.name in errors]
+    real = [e for e in ordered if not isinstance(e, (NotModified, SourceUnavailable))]
+    if real:
+        raise real[0]
+    not_modified = [e for e in ordered if isinstance(e, NotModified)]
+    raise not_modified[0] if not_modified else ordered[0]
+
+
+def _won(source: Source, result: dict) -> dict:
+    logger.info("Fonte %s venceu em %.0f ms", source.name, result["source_ms"])
+    return result
@@ -1,3 +1,1314 @@
-from django.test import TestCase
+import os
+import tempfile
 
-# Create your tests here.
+import pandas as pd
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from structure.filters import clean_numeric
+from structure.formatting import format_br, format_display_frame, parse_br, snapshot_table_html, table_html
+from structure.snapshot import load_snapshot, write_snapshot_from_df
+from structure.validation import validate_snapshot
+
+MEDIA_DIR = os.path.join(settings.BASE_DIR, 'media')
+
+
+def _legacy_en_to_br(num, decimals=2, thousands=True):
+    """Formatador célula a célula anterior ao structure/formatting.py (referência)."""
+    try:
+        if pd.isna(num):
+            return ''
+        n = float(num)
+    except Exception:
+        return str(num)
+
+    if thousands and abs(n) >= 1000:
+        fmt = f"{{:,.{decimals}f}}" if decimals > 0 else "{:,.0f}"
+        s = fmt.format(n)
+        s = s.replace(',', 'X').replace('.', ',').replace('X', '.')
+        if decimals == 0:
+            s = s.split(',')[0]
+        return s
+    else:
+        fmt = f"{{:.{decimals}f}}"
+        s = fmt.format(n).replace('.', ',')
+        return s
+
+
+def _legacy_cell(x, decimals, thousands):
+    return _legacy_en_to_br(clean_numeric(x), decimals, thousands) if pd.notna(clean_numeric(x)) else (x if pd.notna(x) else '')
+
+
+def _legacy_format_display_df(df):
+    df2 = df.copy()
+    if 'Liq.2meses' in df2.columns:
+        df2['Liq.2meses'] = df2['Liq.2meses'].apply(lambda x: _legacy_cell(x, 0, True))
+    for col in ['Mrg Ebit', 'EV/EBIT', 'P/L']:
+        if col in df2.columns:
+            df2[col] = df2[col].apply(lambda x: _legacy_cell(x, 2, False))
+    return df2
+
+
+def _to_html(df):
+    return df.to_html(classes="table table-striped", index=False, border=0)
+
+
+class FakeS3:
+    """Cliente S3 em memória, só com as chamadas usadas por structure/s3_utils.py."""
+
+    def __init__(self):
+        self.objects = {}
+        self.puts = []
+        self.heads = []
+
+    def head_object(self, Bucket, Key):
+        from botocore.exceptions import ClientError
+        self.heads.append(Key)
+        if Key not in self.objects:
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        return {'Metadata': self.objects[Key].get('Metadata', {})}
+
+    def upload_fileobj(self, fileobj, Bucket, Key, ExtraArgs=None, Config=None):
+        self.puts.append(Key)
+        self.objects[Key] = {'Body': fileobj.read(), **(ExtraArgs or {})}
+
+    def get_object(self, Bucket, Key):
+        from io import BytesIO
+        obj = self.objects[Key]
+        return {'Body': BytesIO(obj['Body']), 'ContentEncoding': obj.get('ContentEncoding')}
+
+    def get_paginator(self, name):
+        objects = self.objects
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                yield {'Contents': [{'Key': key} for key in sorted(objects) if key.startswith(Prefix)]}
+
+        return Paginator()
+
+
+class FormattingParityTests(SimpleTestCase):
+
+    def setUp(self):
+        self.final = pd.read_csv(os.path.join(MEDIA_DIR, 'acoes_filtradas.csv'), encoding='utf-8-sig', dtype=str)
+        self.raw = pd.read_csv(os.path.join(MEDIA_DIR, 'acoes_raw.csv'), encoding='utf-8-sig', dtype=str)
+
+    def test_final_csv_matches_legacy(self):
+        expected = _legacy_format_display_df(self.final)
+        actual = format_display_frame(self.final)
+        pd.testing.assert_frame_equal(actual, expected)
+        self.assertEqual(_to_html(actual), _to_html(expected))
+
+    def test_direct_html_matches_to_html(self):
+        expected = _to_html(_legacy_format_display_df(self.final))
+        formatted = format_display_frame(self.final)
+        cells = [formatted[c].to_numpy(dtype=object) for c in formatted.columns]
+        self.assertEqual(table_html(list(formatted.columns), cells), expected)
+
+    def test_raw_columns_match_legacy(self):
+        for col in self.raw.columns[1:]:
+            raw = self.raw[col]
+            values = parse_br(raw)
+            for decimals, thousands in ((0, True), (2, True), (2, False)):
+                expected = [_legacy_cell(x, decimals, thousands) for x in raw]
+                actual = format_br(values, decimals, thousands, fallback=raw.to_numpy(dtype=object))
+                self.assertEqual(list(actual), expected, (col, decimals, thousands))
+
+    def test_snapshot_html_matches_legacy(self):
+        from structure.filters import apply_filters
+        with tempfile.TemporaryDirectory() as root:
+            write_snapshot_from_df(self.raw, apply_filters(self.raw), root=root)
+            snap = load_snapshot(root)
+            df_snap = snap.frame(['Papel', 'Liq.2meses', 'Mrg Ebit', 'EV/EBIT', 'P/L'])
+            self.assertEqual(snapshot_table_html(snap), _to_html(_legacy_format_display_df(df_snap)))
+
+
+class ValidationTests(SimpleTestCase):
+
+    def setUp(self):
+        from structure.filters import apply_filters
+        self.apply_filters = apply_filters
+        self.raw = pd.read_csv(os.path.join(MEDIA_DIR, 'acoes_raw.csv'), encoding='utf-8-sig', dtype=str)
+        self.previous = {'status': 'success', 'rows_raw': len(self.raw)}
+
+    def _report(self, df, root):
+        write_snapshot_from_df(df, self.apply_filters(df), root=root)
+        return validate_snapshot(load_snapshot(root), list(df.columns), self.previous)
+
+    def test_current_table_passes(self):
+        with tempfile.TemporaryDirectory() as root:
+            report = self._report(self.raw, root)
+        self.assertTrue(report['ok'], report['errors'])
+        self.assertGreater(report['zeroed_rows']['count'], 0)
+
+    def test_partial_page_and_empty_column_are_blocked(self):
+        with tempfile.TemporaryDirectory() as root:
+            report = self._report(self.raw.iloc[:300], os.path.join(root, 'parcial'))
+            self.assertFalse(report['ok'])
+            self.assertTrue(any('linhas contra' in e for e in report['errors']))
+
+            broken = self.raw.copy()
+            broken['EV/EBIT'] = ''
+            report = self._report(broken, os.path.join(root, 'vazia'))
+            self.assertFalse(report['ok'])
+            self.assertTrue(any(e.startswith('EV/EBIT') for e in report['errors']))
+
+    def test_row_range_survives_failures_and_compares_the_same_source(self):
+        from structure.validation import previous_rows
+
+        full = len(self.raw)
+        with tempfile.TemporaryDirectory() as root:
+            write_snapshot_from_df(self.raw.iloc[:300], self.apply_filters(self.raw.iloc[:300]),
+                                   root=os.path.join(root, 'parcial'))
+            partial = load_snapshot(os.path.join(root, 'parcial'))
+            write_snapshot_from_df(self.raw, self.apply_filters(self.raw), root=os.path.join(root, 'cheia'))
+            complete = load_snapshot(os.path.join(root, 'cheia'))
+            header = list(self.raw.columns)
+
+            # Depois de um 403 o metadata guarda as linhas do último sucesso
+            forbidden = {'status': 'forbidden', 'rows_raw': full, 'source': 'fundamentus'}
+            report = validate_snapshot(partial, header, forbidden, source='fundamentus')
+            self.assertFalse(report['ok'])
+            self.assertEqual(report['previous_rows'], full)
+
+            # Publicação pequena do CSV não vira referência para a página completa
+            after_csv = {'status': 'success', 'rows_raw': 300, 'source': 'csv',
+                         'rows_by_source': {'fundamentus': full, 'csv': 300}}
+            self.assertTrue(validate_snapshot(complete, header, after_csv, source='fundamentus')['ok'])
+            self.assertFalse(validate_snapshot(complete, header, after_csv, source='csv')['ok'])
+
+        # Metadata antigo (sem rows_by_source) só vale para a fonte que o gravou
+        legacy = {'status': 'success', 'rows_raw': 300, 'source': 'csv'}
+        self.assertIsNone(previous_rows(legacy, 'fundamentus'))
+        self.assertEqual(previous_rows(legacy, 'csv'), 300)
+        self.assertEqual(previous_rows({'status': 'error', 'rows_raw': '997'}), 997)
+
+
+class TickerSearchTests(SimpleTestCase):
+
+    def test_prefix_fuzzy_and_list_position(self):
+        from structure.filters import apply_filters
+        raw = pd.read_csv(os.path.join(MEDIA_DIR, 'acoes_raw.csv'), encoding='utf-8-sig', dtype=str)
+        lista = apply_filters(raw)
+        with tempfile.TemporaryDirectory() as root:
+            write_snapshot_from_df(raw, lista, root=root)
+            index = load_snapshot(root).search_index
+            first = lista[0]
+
+            prefix = index.search(first[:4].lower(), limit=5, mode='prefixo')
+            self.assertIn(first, [r['papel'] for r in prefix])
+            self.assertTrue(all(r['papel'].startswith(first[:4]) for r in prefix))
+
+            typo = first[0] + first[2:]
+            fuzzy = index.search(typo, limit=5, mode='fuzzy')
+            self.assertIn(first, [r['papel'] for r in fuzzy])
+
+            hit = index.search(first, limit=1)[0]
+            self.assertEqual(hit['papel'], first)
+            self.assertTrue(hit['na_lista'])
+            self.assertEqual(hit['posicao_lista'], 1)
+            self.assertEqual(hit['candidata']['rank'], 1)
+            self.assertTrue(all(hit['filtros'].values()))
+
+
+class TickerHistoryTests(SimpleTestCase):
+
+    def test_partitions_downsampling_and_list_events(self):
+        from structure.snapshot import write_snapshot
+        from structure.timeseries import SeriesStore, sync_series
+
+        days = ['2025-01-30', '2025-01-31', '2025-02-03', '2025-02-04']
+        with tempfile.TemporaryDirectory() as root:
+            for i, day in enumerate(days):
+                # AAAA3 entra na lista no segundo dia e sai no último
+                lista = ['AAAA3'] if i in (1, 2) else []
+                write_snapshot(['AAAA3', 'BBBB4'], {'EV/EBIT': [float(i + 1), 9.0], 'P/L': [5.0, float('nan')]},
+                               lista, root=os.path.join(root, day, 'snapshot'))
+            self.assertEqual(sync_series(root), ['2025-01', '2025-02'])
+            self.assertEqual(sync_series(root), [])
+
+            store = SeriesStore(root)
+            daily = store.history('AAAA3', fields=['EV/EBIT'])
+            self.assertEqual(daily['datas'], days)
+            self.assertEqual(daily['valores']['EV/EBIT'], [1.0, 2.0, 3.0, 4.0])
+            self.assertEqual([e['evento'] for e in daily['eventos']], ['entrou', 'saiu'])
+            self.assertEqual(daily['eventos'][0]['data'], '2025-01-31')
+
+            monthly = store.history('AAAA3', start='2025-01-31', fields=['EV/EBIT', 'P/L'], freq='mensal')
+            self.assertEqual(monthly['datas'], ['2025-01-31', '2025-02-04'])
+            self.assertEqual(monthly['valores']['EV/EBIT'], [2.0, 4.0])
+            self.assertEqual(monthly['dias_na_lista'], [1, 1])
+            self.assertEqual(store.history('BBBB4', fields=['P/L'], freq='semanal')['valores']['P/L'], [None, None])
+            self.assertFalse(store.history('ZZZZ3')['encontrado'])
+
+
+class AlertTests(SimpleTestCase):
+
+    def test_list_changes_and_threshold_crossings_from_snapshot_diff(self):
+        from structure.alerts import RuleSet, evaluate
+        from structure.snapshot import write_snapshot
+
+        rules = RuleSet([
+            {"id": "lista", "tipo": "lista"},
+            {"id": "ev-baixo", "tipo": "limite", "campo": "EV/EBIT", "op": "<", "valor": 3},
+            {"id": "ev-alto", "tipo": "limite", "campo": "EV/EBIT", "op": ">", "valor": 10, "papeis": ["BBBB4"]},
+        ])
+        papeis = ['AAAA3', 'BBBB4', 'CCCC3']
+        with tempfile.TemporaryDirectory() as root:
+            old = write_snapshot(papeis, {'EV/EBIT': [4.0, 9.0, 2.0]}, ['AAAA3', 'CCCC3'], root=root)
+            # AAAA3 cruza 3 para baixo, BBBB4 cruza 10 para cima, CCCC3 já estava abaixo de 3
+            new = write_snapshot(papeis, {'EV/EBIT': [2.5, 12.0, 1.0]}, ['CCCC3', 'BBBB4'], root=root)
+            alerts = evaluate(load_snapshot(root, old), load_snapshot(root, new), rules)
+
+        found = sorted((a['regra'], a['tipo'], a['papel']) for a in alerts)
+        self.assertEqual(found, [
+            ('ev-alto', 'limite', 'BBBB4'),
+            ('ev-baixo', 'limite', 'AAAA3'),
+            ('lista', 'entrou', 'BBBB4'),
+            ('lista', 'saiu', 'AAAA3'),
+        ])
+
+
+class DegradationTests(SimpleTestCase):
+
+    def test_failures_keep_last_good_scrape_and_stale_table_is_served(self):
+        import shutil
+        from django.test import override_settings
+        from structure.degradation import serve_table
+        from structure.scrape_steps import (read_metadata, record_error, record_failure, record_precheck_failure,
+                                            write_metadata)
+
+        with tempfile.TemporaryDirectory() as base, override_settings(BASE_DIR=base), \
+                self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            os.makedirs(os.path.join(base, 'media'))
+            shutil.copy(os.path.join(MEDIA_DIR, 'acoes_filtradas.csv'), os.path.join(base, 'media'))
+            write_metadata({"last_scrape": "2025-01-02T13:00:00+00:00", "status": "success", "rows_filtered": 22})
+
+            record_error('http://fonte', 'boom')
+            record_precheck_failure('http://fonte', 403)
+            meta = read_metadata()
+            self.assertEqual(meta['status'], 'forbidden')
+            self.assertEqual(meta['last_scrape'], "2025-01-02T13:00:00+00:00")
+            self.assertEqual(meta['rows_filtered'], 22)
+
+            served = serve_table(meta, refresh=False)
+            self.assertEqual(served['tier'], 'csv')
+            self.assertTrue(served['stale'])
+            self.assertIn('02/01/2025', served['aviso'])
+            self.assertIn('pausa', served['aviso'])
+            self.assertIn('servidos do CSV local', served['aviso'])
+            self.assertNotIn('EMERGENCIA', served['tabela_html'])
+
+            # Cada falha atualiza last_attempt (e respeita o valor passado por quem chama)
+            write_metadata({**meta, "last_attempt": "2025-01-03T13:00:00+00:00"})
+            self.assertNotEqual(record_failure({"status": "error"})['last_attempt'], "2025-01-03T13:00:00+00:00")
+            explicit = record_failure({"status": "error", "last_attempt": "2025-01-04T13:00:00+00:00"})
+            self.assertEqual(explicit['last_attempt'], "2025-01-04T13:00:00+00:00")
+            self.assertEqual(explicit['last_scrape'], "2025-01-02T13:00:00+00:00")
+
+    def test_refresh_goes_through_the_broker_and_runs_steps_inline_without_it(self):
+        import threading
+        from unittest import mock
+        from django.test import override_settings
+        from kombu.exceptions import OperationalError
+        from invest22.scraping.tasks import scheduled_scrape
+        from structure import degradation
+        from structure.captures import store_capture
+        from structure.scrape_steps import read_metadata, write_metadata
+        from structure.snapshot import read_current_version
+
+        def refresh():
+            degradation._last_refresh[0] = 0.0
+            running = set(threading.enumerate())
+            self.assertTrue(degradation.request_refresh())
+            for thread in set(threading.enumerate()) - running:
+                if thread.name == 'degrade-refresh':
+                    thread.join(30)
+            # Uma vez por intervalo
+            self.assertFalse(degradation.request_refresh())
+
+        with mock.patch.object(scheduled_scrape, 'delay') as delay, \
+                mock.patch('structure.scrape_steps.run_steps') as run_steps:
+            refresh()
+        delay.assert_called_once_with()
+        run_steps.assert_not_called()
+
+        # Sem broker: as etapas rodam no processo, sem passar pela cadeia do Celery
+        raw = pd.read_csv(os.path.join(MEDIA_DIR, 'acoes_raw.csv'), encoding='utf-8-sig', dtype=str)
+        with tempfile.TemporaryDirectory() as base, override_settings(BASE_DIR=base), \
+                self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}), \
+                mock.patch.dict(os.environ, {'AWS_S3_BUCKET': ''}):
+            os.makedirs(os.path.join(base, 'media'))
+            write_metadata({"last_scrape": "2025-01-02T13:00:00+00:00", "status": "success", "rows_raw": len(raw)})
+            entry = store_capture(raw.to_html(index=False, table_id='resultado'), 'http://fonte')
+            fetched = {"source": "fundamentus", "url": 'http://fonte', "capture": entry["sha256"],
+                       "fetched_at": entry["fetched_at"], "needs_browser": False,
+                       "source_etag": None, "source_last_modified": None}
+            with mock.patch.object(scheduled_scrape, 'delay', side_effect=OperationalError('Connection refused')), \
+                    mock.patch('invest22.scraping.tasks.start_scrape_pipeline') as pipeline, \
+                    mock.patch('structure.scrape_steps.fetch_first', return_value=fetched):
+                refresh()
+            pipeline.assert_not_called()
+            meta = read_metadata()
+            self.assertEqual(meta['status'], 'success')
+            self.assertNotEqual(meta['last_scrape'], "2025-01-02T13:00:00+00:00")
+            self.assertEqual(meta['snapshot_version'], read_current_version(os.path.join(base, 'media', 'snapshot')))
+
+
+class BakedSnapshotTests(SimpleTestCase):
+
+    def test_baked_snapshot_serves_first_request_from_empty_media(self):
+        import shutil
+        import time
+        from django.core.management import call_command
+        from django.test import Client, override_settings
+        from structure.baked import install_baked
+        from structure.scrape_steps import write_metadata
+
+        raw = pd.read_csv(os.path.join(MEDIA_DIR, 'acoes_raw.csv'), encoding='utf-8-sig', dtype=str)
+        final = pd.read_csv(os.path.join(MEDIA_DIR, 'acoes_filtradas.csv'), encoding='utf-8-sig', dtype=str)
+        with tempfile.TemporaryDirectory() as base, override_settings(BASE_DIR=base), \
+                self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            media = os.path.join(base, 'media')
+            os.makedirs(media)
+            version = write_snapshot_from_df(raw, final['Papel'].tolist(), root=os.path.join(media, 'snapshot'))
+            write_metadata({"last_scrape": "2025-01-02T13:00:00+00:00", "status": "success"})
+            baked = os.path.join(base, 'baked')
+            call_command('bake_snapshot', source='local', output=baked, stdout=open(os.devnull, 'w'))
+            self.assertTrue(os.path.exists(os.path.join(baked, 'snapshot', version, 'table.html')))
+
+            # Boot com o disco vazio: instala, aquece e responde sem rede
+            shutil.rmtree(media)
+            started = time.perf_counter()
+            result = install_baked(baked)
+            response = Client(HTTP_HOST='localhost').get('/')
+            elapsed = time.perf_counter() - started
+            self.assertTrue(result['installed'])
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(final['Papel'].iloc[0], response.content.decode())
+            self.assertIn('02/01/2025', response.content.decode())
+            self.assertLess(elapsed, 5.0)
+
+            # Disco já com dados iguais ou mais novos: não é sobrescrito
+            self.assertFalse(install_baked(baked)['installed'])
+
+
+class PreloadTests(SimpleTestCase):
+
+    def test_master_warms_snapshot_and_worker_drops_inherited_state(self):
+        import gc
+        import runpy
+        import threading
+        from unittest import mock
+        from django.apps import apps
+        from django.test import override_settings
+        from structure import http_client
+        from structure.preload import reset_after_fork, warm_master
+
+        raw = pd.read_csv(os.path.join(MEDIA_DIR, 'acoes_raw.csv'), encoding='utf-8-sig', dtype=str)
+        with tempfile.TemporaryDirectory() as base, override_settings(BASE_DIR=base), \
+                mock.patch.dict(os.environ, {'GUNICORN_PRELOAD': '1'}):
+            version = write_snapshot_from_df(raw, raw['Papel'].head(5).tolist(),
+                                             root=os.path.join(base, 'media', 'snapshot'))
+            conf = runpy.run_path(os.path.join(os.path.dirname(MEDIA_DIR), 'gunicorn.conf.py'))
+            self.assertEqual(os.environ.get('BOOT_THREADS_AFTER_FORK'), '1')
+
+            # Master: a app carregada não deixa threads vivas para o fork
+            before = set(threading.enumerate())
+            apps.get_app_config('structure').ready()
+            try:
+                result = warm_master()
+            finally:
+                gc.unfreeze()
+            alive = [t for t in threading.enumerate() if t is not threading.main_thread() and t not in before]
+            self.assertEqual(alive, [])
+            self.assertFalse({'boot-cache', 'boot-csv'} & set(result['threads']))
+            self.assertEqual(result['version'], version)
+            self.assertGreater(result['frozen'], 0)
+
+            # Só o primeiro worker inicia as threads de boot
+            with mock.patch('structure.apps.start_boot_threads') as start:
+                conf['post_fork'](mock.Mock(), mock.Mock(age=1))
+                conf['post_fork'](mock.Mock(), mock.Mock(age=2))
+            start.assert_called_once_with()
+
+            session = http_client.get_session()
+            reset_after_fork()
+            self.assertIsNot(http_client.get_session(), session)
+
+
+class SnapshotS3SyncTests(SimpleTestCase):
+
+    def test_web_listener_downloads_version_uploaded_by_worker(self):
+        import shutil
+        from unittest import mock
+        from django.test import override_settings
+        from structure.scrape_steps import upload_step, write_metadata
+        from structure.snapshot import read_current_version
+        from structure.snapshot_events import SnapshotListener
+
+        raw = pd.read_csv(os.path.join(MEDIA_DIR, 'acoes_raw.csv'), encoding='utf-8-sig', dtype=str)
+        fake = FakeS3()
+        with tempfile.TemporaryDirectory() as worker, tempfile.TemporaryDirectory() as web, \
+                mock.patch.dict(os.environ, {'AWS_S3_BUCKET': 'bucket'}), \
+                mock.patch('structure.s3_utils._get_s3_client', return_value=fake), \
+                mock.patch('structure.snapshot_events.announce_version') as announce:
+            with override_settings(BASE_DIR=worker):
+                media = os.path.join(worker, 'media')
+                version = write_snapshot_from_df(raw, raw['Papel'].head(5).tolist(),
+                                                 root=os.path.join(media, 'snapshot'))
+                for name in ('acoes_raw.csv', 'acoes_filtradas.csv'):
+                    shutil.copy(os.path.join(MEDIA_DIR, name), media)
+                write_metadata({"last_scrape": "2025-01-02T13:00:00+00:00", "snapshot_version": version})
+                result = upload_step({"snapshot_version": version})
+            self.assertTrue(result['uploaded'])
+            self.assertIn(f'snapshot/{version}/numeric.npy', fake.objects)
+            self.assertEqual(fake.puts[-1], 'metadata.json')
+            announce.assert_called_with(version)
+
+            with override_settings(BASE_DIR=web):
+                root = os.path.join(web, 'media', 'snapshot')
+                self.assertTrue(SnapshotListener(root).apply(version))
+                self.assertEqual(read_current_version(root), version)
+                self.assertEqual(load_snapshot(root).papeis(), raw['Papel'].tolist())
+
+
+class UpdatesStreamTests(SimpleTestCase):
+
+    def test_requests_do_not_retain_futures_or_loops(self):
+        import asyncio
+        from django.test import Client
+        from structure.updates import broadcaster
+        from structure.views import _update_events
+
+        client = Client(HTTP_HOST='localhost')
+        for _ in range(50):
+            response = client.get('/atualizacoes/')
+            self.assertEqual(response.status_code, 200)
+            b''.join(response.streaming_content)
+        self.assertEqual(broadcaster._futures, {})
+        self.assertEqual(broadcaster._waiters, {})
+
+        async def stream_then_disconnect():
+            events = _update_events(None, streaming=True)
+            await events.__anext__()
+            waiting = asyncio.ensure_future(events.__anext__())
+            await asyncio.sleep(0.05)
+            self.assertEqual(len(broadcaster._waiters), 1)
+            waiting.cancel()
+            try:
+                await waiting
+            except asyncio.CancelledError:
+                pass
+            await events.aclose()
+
+        asyncio.run(stream_then_disconnect())
+        self.assertEqual(broadcaster._futures, {})
+        self.assertEqual(broadcaster._waiters, {})
+
+
+class ReplayTests(SimpleTestCase):
+
+    def test_replay_goes_through_validation_and_publication(self):
+        from django.core.management import call_command
+        from django.test import override_settings
+        from structure.captures import store_capture
+        from structure.history import history_dir
+        from structure.scrape_steps import read_metadata, write_metadata
+
+        raw = pd.read_csv(os.path.join(MEDIA_DIR, 'acoes_raw.csv'), encoding='utf-8-sig', dtype=str)
+        with tempfile.TemporaryDirectory() as base, override_settings(BASE_DIR=base), \
+                self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            os.makedirs(os.path.join(base, 'media'))
+            write_metadata({"last_scrape": "2025-01-02T13:00:00+00:00", "status": "success"})
+            out = open(os.devnull, 'w')
+
+            # Captura ruim (poucas linhas): barrada pela validação, nada publicado
+            bad = store_capture(raw.head(3).to_html(index=False, table_id='resultado'), 'http://fonte',
+                                fetched_at='2025-01-03T13:00:00+00:00')
+            call_command('scrape_data', replay=bad['sha256'][:12], stdout=out)
+            self.assertEqual(read_metadata()['last_scrape'], "2025-01-02T13:00:00+00:00")
+            self.assertFalse(os.path.exists(os.path.join(base, 'media', 'snapshot', 'CURRENT')))
+
+            good = store_capture(raw.to_html(index=False, table_id='resultado'), 'http://fonte',
+                                 fetched_at='2025-01-06T13:00:00+00:00')
+            call_command('scrape_data', replay=good['sha256'][:12], stdout=out)
+            meta = read_metadata()
+            self.assertEqual(meta['status'], 'success')
+            self.assertEqual(meta['replayed_from'], good['sha256'])
+            self.assertEqual(meta['rows_by_source'], {'fundamentus': meta['rows_raw']})
+            self.assertEqual(meta['last_scrape'], '2025-01-06T13:00:00+00:00')
+            self.assertEqual(meta['validation']['errors'], [])
+            self.assertTrue(os.path.isdir(history_dir('2025-01-06')))
+
+
+class SelectionParityTests(SimpleTestCase):
+
+    def test_snapshot_selection_matches_apply_filters_with_ties_nan_and_negatives(self):
+        import numpy as np
+        from structure.filters import apply_filters, select_from_snapshot, top_k
+
+        rows = []
+        for i in range(60):
+            ev = ['3,50', '3,50', '-2,00', '', '0,00', '7,25', '3,50', 'N/A', '1.234,00', '12,00'][i % 10]
+            liq = '2.000.000,00' if i % 7 else '900.000,00'
+            mrg = '-5,0%' if i % 11 == 0 else '12,5%'
+            pl = ['4,00', '-1,00', '', '8,00'][i % 4] if i % 5 else '6,00'
+            rows.append({'Papel': f'PAP{i:02d}3', 'Liq.2meses': liq, 'Mrg Ebit': mrg, 'EV/EBIT': ev, 'P/L': pl})
+        df = pd.DataFrame(rows)
+
+        with tempfile.TemporaryDirectory() as root:
+            write_snapshot_from_df(df, root=root)
+            snap = load_snapshot(root)
+            self.assertEqual(snap.papeis(select_from_snapshot(snap)), apply_filters(df))
+            self.assertEqual(snap.papeis(select_from_snapshot(snap, limit=5)), apply_filters(df)[:5])
+
+            # Decrescente: empates na ordem das linhas nos dois caminhos
+            ev = snap.column('EV/EBIT')
+            for n in (None, 3, 10):
+                expected = top_k(ev, np.arange(snap.rows), n, ascending=False)
+                self.assertEqual(snap.top_n('EV/EBIT', n, ascending=False).tolist(), expected.tolist())
+
+
+class _Clock:
+    """Relógio controlado para structure.ratelimit (monotonic/time/sleep)."""
+
+    def __init__(self, start=1000.0):
+        self.now = start
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class _FakeBucketRedis:
+    """Redis em memória para o RateLimiter; o script reproduz o _BUCKET_LUA em Python."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.data = {}
+
+    def set(self, key, value, px=None):
+        self.data[key] = value
+
+    def register_script(self, source):
+        import math
+
+        def script(keys, args):
+            now_ms = int(self.clock.now * 1000)
+            blocked = int(self.data.get(keys[1], 0))
+            if blocked > now_ms:
+                return blocked - now_ms
+            rate, capacity, requested = (float(a) for a in args)
+            tokens, ts = self.data.get(keys[0], (capacity, now_ms))
+            tokens = min(capacity, tokens + max(0, now_ms - ts) / 1000.0 * rate)
+            needed = max(requested, 1)
+            if tokens < needed:
+                return math.ceil((needed - tokens) / rate * 1000)
+            if requested > 0:
+                self.data[keys[0]] = (tokens - requested, now_ms)
+            return 0
+
+        return script
+
+
+class RateLimiterTests(SimpleTestCase):
+    URL = 'https://www.fundamentus.com.br/resultado.php'
+
+    def test_token_bucket_refills_over_time(self):
+        from unittest import mock
+        from structure.ratelimit import TokenBucket
+
+        clock = _Clock()
+        with mock.patch('structure.ratelimit.time', clock):
+            bucket = TokenBucket(rate=2, capacity=2)
+            self.assertEqual(bucket.try_acquire(), 0.0)
+            self.assertEqual(bucket.try_acquire(), 0.0)
+            self.assertAlmostEqual(bucket.try_acquire(), 0.5)
+            clock.now += 0.5
+            self.assertEqual(bucket.try_acquire(), 0.0)
+            clock.now += 60
+            self.assertEqual(bucket.try_acquire(2), 0.0)
+            self.assertAlmostEqual(bucket.try_acquire(), 0.5)
+
+    def _limiter_scenario(self, limiter, clock):
+        from unittest import mock
+        from structure.ratelimit import RateLimited
+
+        limiter.check(self.URL)
+        limiter.check(self.URL)
+        with self.assertRaises(RateLimited) as ctx:
+            limiter.check(self.URL)
+        self.assertEqual(ctx.exception.host, 'www.fundamentus.com.br')
+        self.assertAlmostEqual(ctx.exception.wait, 1.0, places=2)
+        clock.now += 1.0
+        limiter.check(self.URL)
+
+        # Retry-After bloqueia o host mesmo com tokens disponíveis
+        clock.now += 10
+        response = mock.Mock(status_code=429, headers={'Retry-After': '30'})
+        limiter.note_response(self.URL, response)
+        self.assertAlmostEqual(limiter.wait_time(self.URL), 30.0, places=2)
+        with self.assertRaises(RateLimited) as ctx:
+            limiter.check(self.URL)
+        self.assertAlmostEqual(ctx.exception.wait, 30.0, places=2)
+        clock.now += 30.5
+        limiter.check(self.URL)
+
+    def test_local_limiter_blocks_on_retry_after_and_raises_when_empty(self):
+        from unittest import mock
+        from structure.ratelimit import RateLimiter
+
+        clock = _Clock()
+        with mock.patch('structure.ratelimit.time', clock), mock.patch('structure.ratelimit.redis', None), \
+                mock.patch.dict(os.environ, {'SCRAPE_HOST_RATE': '1', 'SCRAPE_HOST_BURST': '2'}):
+            self._limiter_scenario(RateLimiter(), clock)
+
+    def test_shared_limiter_uses_redis_bucket_and_block_key(self):
+        from unittest import mock
+        from structure.ratelimit import RateLimiter
+
+        clock = _Clock()
+        fake = _FakeBucketRedis(clock)
+        fake_module = mock.Mock()
+        fake_module.Redis.from_url.return_value = fake
+        with mock.patch('structure.ratelimit.time', clock), mock.patch('structure.ratelimit.redis', fake_module), \
+                mock.patch.dict(os.environ, {'SCRAPE_HOST_RATE': '1', 'SCRAPE_HOST_BURST': '2'}):
+            self._limiter_scenario(RateLimiter(), clock)
+        self.assertIn('ratelimit:www.fundamentus.com.br:blocked', fake.data)
+
+    def test_fetch_task_retries_after_the_rate_limit_wait(self):
+        from unittest import mock
+        from invest22.scraping.tasks import fetch_source_task
+        from structure.ratelimit import RateLimited
+
+        with mock.patch('structure.scrape_steps.fetch_step', side_effect=RateLimited('host', 4.0)), \
+                mock.patch.object(fetch_source_task, 'retry', side_effect=RuntimeError('retry')) as retry:
+            with self.assertRaises(RuntimeError):
+                fetch_source_task.run(self.URL)
+        self.assertEqual(retry.call_args.kwargs['countdown'], 5.0)
+
+    def test_scrape_data_precheck_retries_through_the_task_without_sleeping(self):
+        from io import StringIO
+        from unittest import mock
+        from django.core.management import call_command
+        from django.test import override_settings
+        from invest22.scraping.tasks import scrape_data_task
+        from structure.management.commands.scrape_data import RetryPrecheck
+        from structure.scrape_steps import read_metadata
+
+        env = {'SCRAPE_HTTP_MAX_ATTEMPTS': '2', 'SCRAPE_HTTP_BACKOFF_BASE': '3', 'SCRAPE_HTTP_JITTER': '0',
+               'SCRAPE_SOURCES': 'fundamentus'}
+        with tempfile.TemporaryDirectory() as base, override_settings(BASE_DIR=base), \
+                mock.patch.dict(os.environ, env), \
+                mock.patch('time.sleep', side_effect=AssertionError('sleep no pre-check')), \
+                mock.patch('structure.management.commands.scrape_data.fetch',
+                           return_value=mock.Mock(status_code=503)) as fetch:
+            os.makedirs(os.path.join(base, 'media'))
+            with self.assertRaises(RetryPrecheck) as ctx:
+                call_command('scrape_data', attempt=1, stdout=StringIO())
+            self.assertEqual((ctx.exception.attempt, ctx.exception.status, ctx.exception.wait), (2, 503, 3.0))
+            self.assertFalse(fetch.call_args.kwargs['wait'])
+
+            with mock.patch.object(scrape_data_task, 'retry', side_effect=RuntimeError('retry')) as retry:
+                with self.assertRaises(RuntimeError):
+                    scrape_data_task.run(attempt=1)
+            self.assertEqual(retry.call_args.kwargs['countdown'], 4)
+            self.assertEqual(retry.call_args.kwargs['kwargs'], {'attempt': 2})
+
+            # Última tentativa: sem novo agendamento, grava a falha
+            call_command('scrape_data', attempt=2, stdout=StringIO())
+            self.assertEqual(read_metadata()['status'], 'error')
+        self.assertEqual(fetch.call_count, 3)
+
+
+class NotModifiedTests(SimpleTestCase):
+
+    def test_conditional_fetch_raises_not_modified(self):
+        from unittest import mock
+        from structure.http_client import NotModified, fetch
+
+        session = mock.Mock()
+        session.get.return_value = mock.Mock(status_code=304, headers={})
+        with mock.patch('structure.http_client.get_session', return_value=session), \
+                mock.patch('structure.http_client.get_limiter', return_value=mock.Mock()):
+            with self.assertRaises(NotModified):
+                fetch('http://fonte/resultado.php', validators={'etag': '"abc"', 'last_modified': 'Thu, 02 Jan 2025 13:00:00 GMT'})
+        headers = session.get.call_args.kwargs['headers']
+        self.assertEqual(headers['If-None-Match'], '"abc"')
+        self.assertEqual(headers['If-Modified-Since'], 'Thu, 02 Jan 2025 13:00:00 GMT')
+
+    def test_304_records_last_checked_and_keeps_data_fresh(self):
+        import shutil
+        from unittest import mock
+        from django.test import override_settings
+        from invest22.scraping.tasks import scheduled_scrape
+        from structure.degradation import serve_table
+        from structure.http_client import NotModified
+        from structure.market_calendar import is_stale
+        from structure.scrape_steps import read_metadata, run_steps, write_metadata
+
+        with tempfile.TemporaryDirectory() as base, override_settings(BASE_DIR=base), \
+                self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            os.makedirs(os.path.join(base, 'media'))
+            shutil.copy(os.path.join(MEDIA_DIR, 'acoes_filtradas.csv'), os.path.join(base, 'media'))
+            write_metadata({"last_scrape": "2025-01-02T13:00:00+00:00", "status": "success", "etag": '"abc"'})
+            self.assertTrue(is_stale("2025-01-02T13:00:00+00:00"))
+
+            with mock.patch('structure.scrape_steps.fetch_step', side_effect=NotModified(mock.Mock())):
+                self.assertIsNone(run_steps('http://fonte'))
+            meta = read_metadata()
+            self.assertEqual(meta['status'], 'success')
+            self.assertEqual(meta['last_scrape'], "2025-01-02T13:00:00+00:00")
+            self.assertIn('last_checked', meta)
+
+            served = serve_table(meta, refresh=False)
+            self.assertFalse(served['stale'])
+            self.assertEqual(served['data_atual'][:10], '02/01/2025')
+            self.assertEqual(scheduled_scrape.run(), 'Dados ainda válidos')
+
+
+class MarketCalendarTests(SimpleTestCase):
+    ENV = ('MARKET_OPEN', 'MARKET_CLOSE', 'MARKET_HOLIDAYS', 'SCRAPE_INTRADAY_MINUTES',
+           'SCRAPE_AFTER_CLOSE_MINUTES', 'SCRAPE_STALE_GRACE_MINUTES')
+
+    def setUp(self):
+        from unittest import mock
+        patcher = mock.patch.dict(os.environ)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for key in self.ENV:
+            os.environ.pop(key, None)
+
+    @staticmethod
+    def _sp(*args):
+        from structure.market_calendar import TZ_SP
+        from datetime import datetime
+        return TZ_SP.localize(datetime(*args))
+
+    def test_fixed_and_easter_holidays(self):
+        from datetime import date
+        from structure.market_calendar import easter, holidays, is_trading_day
+
+        self.assertEqual(easter(2025), date(2025, 4, 20))
+        days = holidays(2025)
+        # Carnaval, Sexta-feira Santa e Corpus Christi a partir da Páscoa; fixos por (mês, dia)
+        for day in (date(2025, 3, 3), date(2025, 3, 4), date(2025, 4, 18), date(2025, 6, 19),
+                    date(2025, 1, 1), date(2025, 4, 21), date(2025, 11, 20), date(2025, 12, 24)):
+            self.assertIn(day, days)
+            self.assertFalse(is_trading_day(day))
+        self.assertTrue(is_trading_day(date(2025, 3, 5)))   # Quarta de Cinzas
+        self.assertTrue(is_trading_day(date(2025, 4, 17)))
+        self.assertFalse(is_trading_day(date(2025, 3, 8)))  # sábado
+
+        self.assertTrue(is_trading_day(date(2025, 7, 9)))
+        os.environ['MARKET_HOLIDAYS'] = '2025-07-09, invalida'
+        self.assertFalse(is_trading_day(date(2025, 7, 9)))
+        self.assertNotIn(date(2025, 7, 9), holidays(2026))
+
+    def test_refresh_slots_are_sao_paulo_times_without_dst(self):
+        from datetime import date, timedelta
+        import pytz
+        from structure.market_calendar import refresh_slots
+
+        for day in (date(2025, 1, 15), date(2025, 7, 15)):
+            slots = refresh_slots(day)
+            self.assertEqual([s.strftime('%H:%M') for s in slots],
+                             [f'{h:02d}:00' for h in range(10, 19)] + ['18:30'])
+            self.assertTrue(all(s.utcoffset() == timedelta(hours=-3) for s in slots))
+            self.assertEqual(slots[0].astimezone(pytz.utc).hour, 13)
+        self.assertEqual(refresh_slots(date(2025, 3, 4)), [])
+
+        os.environ.update(SCRAPE_INTRADAY_MINUTES='120', SCRAPE_AFTER_CLOSE_MINUTES='0')
+        self.assertEqual([s.strftime('%H:%M') for s in refresh_slots(date(2025, 1, 15))],
+                         ['10:00', '12:00', '14:00', '16:00', '18:00'])
+
+    def test_is_stale_rolls_over_weekends_and_holidays(self):
+        from structure.market_calendar import is_stale
+
+        # Sexta após o fechamento: vale o fim de semana inteiro, vence na segunda 10:00 (+15 min)
+        friday = self._sp(2025, 1, 3, 18, 45)
+        self.assertFalse(is_stale(friday, at=self._sp(2025, 1, 5, 23, 0)))
+        self.assertFalse(is_stale(friday, at=self._sp(2025, 1, 6, 10, 10)))
+        self.assertTrue(is_stale(friday, at=self._sp(2025, 1, 6, 10, 20)))
+
+        # Quinta antes da Sexta-feira Santa e de Tiradentes (segunda): vence só na terça
+        thursday = self._sp(2025, 4, 17, 18, 45)
+        self.assertFalse(is_stale(thursday, at=self._sp(2025, 4, 21, 12, 0)))
+        self.assertTrue(is_stale(thursday, at=self._sp(2025, 4, 22, 10, 20)))
+
+        # Carnaval: de sexta até a Quarta de Cinzas
+        self.assertFalse(is_stale(self._sp(2025, 2, 28, 19, 0), at=self._sp(2025, 3, 4, 12, 0)))
+        self.assertTrue(is_stale(self._sp(2025, 2, 28, 19, 0), at=self._sp(2025, 3, 5, 10, 20)))
+
+        # Durante o pregão: vale até o próximo horário da hora cheia
+        self.assertFalse(is_stale('2025-01-06T14:05:00+00:00', at=self._sp(2025, 1, 6, 12, 10)))
+        self.assertTrue(is_stale('2025-01-06T14:05:00+00:00', at=self._sp(2025, 1, 6, 12, 20)))
+        self.assertTrue(is_stale(None))
+
+
+class PublishFilesTests(SimpleTestCase):
+
+    def test_unchanged_objects_are_skipped_and_metadata_goes_last(self):
+        import json
+        from unittest import mock
+        from botocore.exceptions import ClientError
+        from structure import s3_utils
+
+        s3 = FakeS3()
+        with tempfile.TemporaryDirectory() as tmp, mock.patch('structure.s3_utils._get_s3_client', return_value=s3):
+            files = {}
+            for key, content in (('acoes_raw.csv', 'Papel;P/L\nPETR4;5,1\n'), ('acoes_filtradas.csv', 'Papel\nPETR4\n'),
+                                 ('metadata.json', json.dumps({"status": "success"}))):
+                files[key] = os.path.join(tmp, key)
+                with open(files[key], 'w', encoding='utf-8') as f:
+                    f.write(content)
+
+            first = s3_utils.publish_files(files, 'bucket')
+            self.assertEqual((first['uploaded'], first['skipped'], first['failed']), (3, 0, 0))
+            self.assertEqual(s3.puts[-1], 'metadata.json')
+            self.assertEqual(s3.objects['metadata.json']['CacheControl'], 'no-cache')
+            # Gravado com gzip, lido de volta descomprimido
+            self.assertEqual(s3.objects['acoes_raw.csv']['Body'][:2], b'\x1f\x8b')
+            self.assertEqual(s3.objects['acoes_raw.csv']['ContentEncoding'], 'gzip')
+            self.assertEqual(s3_utils.get_csv_df('bucket', 'acoes_raw.csv').read(), 'Papel;P/L\nPETR4;5,1\n')
+            self.assertEqual(s3_utils.get_json('bucket', 'metadata.json'), {"status": "success"})
+
+            # Mesmo sha256 no HEAD: nada é reenviado
+            second = s3_utils.publish_files(files, 'bucket')
+            self.assertEqual((second['uploaded'], second['skipped']), (0, 3))
+            self.assertEqual(len(s3.puts), 3)
+
+            with open(files['acoes_filtradas.csv'], 'w', encoding='utf-8') as f:
+                f.write('Papel\nVALE3\n')
+            third = s3_utils.publish_files(files, 'bucket')
+            self.assertEqual(s3.puts[3:], ['acoes_filtradas.csv'])
+            self.assertEqual(third['skipped'], 2)
+
+            # Falha num dado: o marcador não é enviado
+            with open(files['acoes_raw.csv'], 'w', encoding='utf-8') as f:
+                f.write('Papel;P/L\nVALE3;4,0\n')
+            with open(files['metadata.json'], 'w', encoding='utf-8') as f:
+                f.write(json.dumps({"status": "success", "rows_raw": 1}))
+            error = ClientError({'Error': {'Code': '500', 'Message': 'boom'}}, 'PutObject')
+            with mock.patch.object(s3, 'upload_fileobj', side_effect=error):
+                failed = s3_utils.publish_files(files, 'bucket')
+            self.assertEqual(failed['failed'], 2)
+            self.assertEqual(s3_utils.get_json('bucket', 'metadata.json'), {"status": "success"})
+
+    def test_snapshot_versions_skip_the_head_and_puts_carry_content_md5(self):
+        import base64
+        import hashlib
+        from unittest import mock
+        from structure import s3_utils
+
+        s3 = FakeS3()
+        with tempfile.TemporaryDirectory() as tmp, mock.patch('structure.s3_utils._get_s3_client', return_value=s3):
+            files = {}
+            for key in ('snapshot/abc123/numeric.npy', 'snapshot/CURRENT', 'acoes_raw.csv'):
+                files[key] = os.path.join(tmp, key.replace('/', '_'))
+                with open(files[key], 'w', encoding='utf-8') as f:
+                    f.write(key)
+
+            summary = s3_utils.publish_files(files, 'bucket')
+            self.assertEqual(summary['uploaded'], 3)
+            self.assertEqual(sorted(s3.heads), ['acoes_raw.csv', 'snapshot/CURRENT'])
+            for key, obj in s3.objects.items():
+                self.assertEqual(obj['ContentMD5'], base64.b64encode(hashlib.md5(obj['Body']).digest()).decode())
+
+        # Objetos sem Content-Encoding (uploads antigos) são lidos como estão
+        self.assertEqual(s3_utils._read_body({'Body': mock.Mock(read=lambda: b'abc')}), b'abc')
+
+
+class CaptureTests(SimpleTestCase):
+    HTML = '<table id="resultado"><tr><td>PETR4</td><td>5,10</td><td>Ação ordinária</td></tr></table>'
+
+    def _round_trip(self, root, codec):
+        from structure.captures import capture_stream, find_capture, read_capture, store_capture
+
+        entry = store_capture(self.HTML, 'http://fonte', fetched_at='2025-01-02T13:00:00+00:00', root=root)
+        self.assertEqual(entry['codec'], codec)
+        self.assertTrue(entry['path'].endswith(f'.html.{codec}'))
+        found = find_capture(entry['sha256'][:8], root=root)
+        self.assertEqual(found['fetched_at'], '2025-01-02T13:00:00+00:00')
+        self.assertEqual(read_capture(found, root=root), self.HTML)
+        # Pelo caminho do arquivo, sem passar pelo índice
+        self.assertEqual(read_capture(find_capture(os.path.join(root, entry['path'])), root=root), self.HTML)
+
+        # Em streaming: mesmo conteúdo, mesmo endereço
+        chunks = [self.HTML[:20].encode('utf-8'), self.HTML[20:].encode('utf-8')]
+        self.assertEqual(b''.join(capture_stream(iter(chunks), 'http://fonte', root=root)), self.HTML.encode('utf-8'))
+        self.assertEqual(find_capture(entry['sha256'][:8], root=root)['sha256'], entry['sha256'])
+
+        with self.assertRaises(LookupError):
+            find_capture('zzzz', root=root)
+
+    def test_gzip_round_trip(self):
+        from unittest import mock
+        with tempfile.TemporaryDirectory() as root, mock.patch('structure.captures.zstandard', None):
+            self._round_trip(root, 'gz')
+
+    def test_zstd_round_trip(self):
+        from structure import captures
+        if captures.zstandard is None:
+            self.skipTest("zstandard não instalado")
+        with tempfile.TemporaryDirectory() as root:
+            self._round_trip(root, 'zst')
+
+
+class _FakeSource:
+    """Fonte de teste: devolve `result` ou levanta `error` depois de `delay` segundos."""
+
+    def __init__(self, name, error=None, delay=0.0, local=False):
+        self.name, self.error, self.delay, self.local = name, error, delay, local
+        self.calls = 0
+
+    def fetch(self, meta=None, wait=False):
+        import time
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return {"source": self.name, "url": f"http://{self.name}", "capture": self.name}
+
+
+class SourcesTests(SimpleTestCase):
+    EN_CSV = ('ticker,cotacao,pl,ev_ebit,margem_ebit,liquidez_2meses,dy\n'
+              'PETR4,38.5,"1,234.56",4.2,0.31,"1,234,567",12.5\n'
+              'VALE3,61.02,5.10,-3.5,0.2,"987,654",8\n')
+    BR_CSV = ('Papel;Cotação;P/L;EV/EBIT;Mrg Ebit;Liq.2meses\n'
+              'PETR4;38,50;1.234;4,2;31,0%;1.234.567,00\n'
+              'VALE3;61,02;5,1;-3,5;20%;987.654\n')
+
+    def setUp(self):
+        from unittest import mock
+        patcher = mock.patch.dict(os.environ, {'SOURCE_FAILURES_BEFORE_COOLDOWN': '2', 'SOURCE_COOLDOWN_SECONDS': '100',
+                                               'SOURCE_COOLDOWN_MAX_SECONDS': '300'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+
+    def _health(self):
+        from structure.sources import SourceHealth
+        # Um placar novo por chamada
+        self.healths = getattr(self, 'healths', 0) + 1
+        return SourceHealth(path=os.path.join(self.tmp, f'sources_health_{self.healths}.json'))
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def test_fetch_first_winner_and_local_drop_before_network(self):
+        from structure.sources import fetch_first
+
+        slow, fast = _FakeSource('a', delay=0.3), _FakeSource('b')
+        self.assertEqual(fetch_first([slow, fast], health=self._health())['source'], 'b')
+
+        # CSV local com dados: a rede não é consultada
+        network, drop = _FakeSource('fundamentus'), _FakeSource('csv', local=True)
+        result = fetch_first([network, drop], health=self._health())
+        self.assertEqual(result['source'], 'csv')
+        self.assertGreaterEqual(result['source_ms'], 0)
+        self.assertEqual(network.calls, 0)
+
+    def test_fetch_first_error_priority_and_not_modified(self):
+        from structure.http_client import NotModified
+        from structure.sources import SourceHTTPError, SourceUnavailable, fetch_first
+
+        def outcome(*errors):
+            sources = [_FakeSource(f's{i}', error=e, local=isinstance(e, SourceUnavailable))
+                       for i, e in enumerate(errors)]
+            with self.assertRaises(Exception) as raised:
+                fetch_first(sources, health=self._health())
+            return raised.exception
+
+        forbidden = SourceHTTPError('http://s0', 403)
+        self.assertIs(outcome(forbidden, RuntimeError('boom')), forbidden)
+        boom = RuntimeError('boom')
+        self.assertIs(outcome(NotModified(None), boom), boom)
+        not_modified = NotModified(None)
+        self.assertIs(outcome(not_modified, SourceUnavailable('sem CSV')), not_modified)
+        self.assertIsInstance(outcome(SourceUnavailable('sem CSV')), SourceUnavailable)
+
+        # Um 304 conta como resposta saudável
+        health = self._health()
+        with self.assertRaises(NotModified):
+            fetch_first([_FakeSource('fundamentus', error=NotModified(None))], health=health)
+        self.assertEqual(health.load()['fundamentus']['failures'], 0)
+
+    def test_source_health_cooldown_and_backoff(self):
+        import time
+        from structure.sources import SourceHTTPError, fetch_first
+
+        health = self._health()
+        health.record('a', False, 10.0, error='boom')
+        self.assertTrue(health.available('a'))
+        health.record('a', False, 10.0, error='boom')
+        self.assertFalse(health.available('a'))
+        self.assertAlmostEqual(health.load()['a']['cooldown_until'] - time.time(), 100, delta=5)
+        health.record('a', False, 10.0, error='boom')
+        self.assertAlmostEqual(health.load()['a']['cooldown_until'] - time.time(), 200, delta=5)
+        for _ in range(3):
+            health.record('a', False, 10.0, error='boom')
+        self.assertAlmostEqual(health.load()['a']['cooldown_until'] - time.time(), 300, delta=5)
+
+        # Fonte em cooldown fica fora da disputa (a menos que todas estejam)
+        cooled, healthy = _FakeSource('a'), _FakeSource('b')
+        self.assertEqual(fetch_first([cooled, healthy], health=health)['source'], 'b')
+        self.assertEqual(cooled.calls, 0)
+        self.assertEqual(fetch_first([cooled], health=health)['source'], 'a')
+        self.assertTrue(health.available('a'))
+        self.assertEqual(health.load()['a']['failures'], 0)
+
+        # 403: cooldown já na primeira falha
+        with self.assertRaises(SourceHTTPError):
+            fetch_first([_FakeSource('c', error=SourceHTTPError('http://c', 403))], health=health)
+        self.assertFalse(health.available('c'))
+        self.assertEqual(health.summary()['c']['available'], False)
+
+    def test_normalize_csv_detects_decimal_separator_per_column(self):
+        from structure.filters import clean_numeric
+        from structure.sources import FUNDAMENTUS_COLUMNS, _normalize_value, normalize_csv
+
+        header, rows = normalize_csv(self._write('en.csv', self.EN_CSV))
+        self.assertEqual(header, FUNDAMENTUS_COLUMNS)
+        petr, vale = (dict(zip(header, row)) for row in rows)
+        self.assertEqual(petr['P/L'], '1234,56')
+        self.assertEqual(clean_numeric(petr['P/L']), 1234.56)
+        self.assertEqual(petr['Liq.2meses'], '1234567')
+        self.assertEqual(vale['Liq.2meses'], '987654')
+        self.assertEqual(vale['EV/EBIT'], '-3,5')
+        self.assertEqual(petr['Div.Yield'], '12,5%')
+        self.assertEqual(vale['Div.Yield'], '8%')
+        self.assertEqual(petr['ROE'], '')
+
+        header, rows = normalize_csv(self._write('br.csv', self.BR_CSV))
+        petr, vale = (dict(zip(header, row)) for row in rows)
+        self.assertEqual(clean_numeric(petr['P/L']), 1234.0)
+        self.assertEqual(clean_numeric(vale['P/L']), 5.1)
+        self.assertEqual(clean_numeric(petr['Liq.2meses']), 1234567.0)
+        self.assertEqual(clean_numeric(vale['Liq.2meses']), 987654.0)
+        self.assertEqual(petr['Mrg Ebit'], '31,0%')
+
+        # Coluna sem valor decisivo: vale o resto do arquivo
+        header, rows = normalize_csv(self._write('amb.csv', 'ticker,pl,ev_ebit,margem_ebit,liquidez_2meses\n'
+                                                             'PETR4,"1,234",4.25,0.3,"2,000"\n'))
+        row = dict(zip(header, rows[0]))
+        self.assertEqual((row['P/L'], row['Liq.2meses'], row['EV/EBIT']), ('1234', '2000', '4,25'))
+
+        self.assertEqual(_normalize_value('Papel', ' PETR4 '), 'PETR4')
+        self.assertEqual(_normalize_value('P/L', 'N/A'), 'N/A')
+        with self.assertRaises(ValueError):
+            normalize_csv(self._write('incompleto.csv', 'ticker,pl\nPETR4,5\n'))
+
+    def test_csv_drop_source(self):
+        import time
+        from django.test import override_settings
+        from structure.captures import find_capture, read_capture
+        from structure.http_client import NotModified
+        from structure.sources import CsvDropSource, SourceUnavailable
+
+        drop = os.path.join(self.tmp, 'drop')
+        os.makedirs(drop)
+        with override_settings(BASE_DIR=self.tmp):
+            source = CsvDropSource(directory=drop)
+            self.assertTrue(source.local)
+            with self.assertRaises(SourceUnavailable):
+                source.fetch({})
+
+            path = os.path.join(drop, 'export.csv')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(self.BR_CSV)
+            result = source.fetch({'status': 'success', 'last_scrape': '2025-01-02T13:00:00+00:00'})
+            self.assertEqual(result['source'], 'csv')
+            self.assertTrue(result['url'].endswith('export.csv'))
+            self.assertTrue(result['source_etag'])
+            html = read_capture(find_capture(result['capture']))
+            self.assertIn('<td>1234567,00</td>', html)
+
+            # Nada mais novo que o publicado
+            with self.assertRaises(NotModified):
+                source.fetch({'status': 'success', 'last_scrape': '2999-01-01T00:00:00+00:00'})
+
+            old = time.time() - 3 * 24 * 3600
+            os.utime(path, (old, old))
+            with self.assertRaises(SourceUnavailable):
+                source.fetch({})
+
+
+DETAIL_PAGE = """<html><body><table class="w728">
+<tr><td class="label w15"><span class="help tips" title="Setor">?</span><span class="txt">Setor</span></td>
+<td class="data w35"><span class="txt"><a href="resultado.php?setor=24">Petróleo, Gás e Biocombustíveis</a></span></td>
+<td class="label w15"><span class="help tips" title="Subsetor">?</span><span class="txt">Subsetor</span></td>
+<td class="data"><span class="txt"><a href="resultado.php?segmento=53">Exploração, Refino e Distribuição</a></span></td></tr>
+<tr><td class="label"><span class="txt">Nro. Ações</span></td><td class="data"><span class="txt">13.044.496.930</span></td>
+<td class="label"><span class="txt">Últ balanço processado</span></td><td class="data"><span class="txt">30/09/2025</span></td></tr>
+</table></body></html>"""
+
+
+class DetailsTests(SimpleTestCase):
+
+    def test_parse_detail_page(self):
+        from structure.details import detail_url, parse_detail_page
+
+        self.assertEqual(parse_detail_page(DETAIL_PAGE), {
+            'setor': 'Petróleo, Gás e Biocombustíveis',
+            'segmento': 'Exploração, Refino e Distribuição',
+            'nro_acoes': 13044496930,
+            'ultimo_balanco': '2025-09-30',
+        })
+        with self.assertRaises(ValueError):
+            parse_detail_page('<html><body><table><tr><td>nada</td></tr></table></body></html>')
+        self.assertEqual(detail_url('BRK&B', 'http://stand-in/'), 'http://stand-in/detalhes.php?papel=BRK%26B')
+
+    def test_fetch_many_against_standin_with_retry_after_and_cache(self):
+        import threading
+        import time
+        from http.server import ThreadingHTTPServer
+        from unittest import mock
+        from structure.details import DetailFetcher
+        from structure.management.commands.fundamentus_standin import StandinState, _make_handler
+        from structure.ratelimit import HostLimiter, RateLimiter
+
+        class Scripted(StandinState):
+            """Status das primeiras respostas fixados em `script`; depois, 200."""
+
+            def __init__(self, script, **kwargs):
+                super().__init__(**kwargs)
+                self.script = list(script)
+
+            def draw(self):
+                with self._lock:
+                    return (self.script.pop(0) if self.script else 200), 0.0
+
+        def serve(state):
+            server = ThreadingHTTPServer(('127.0.0.1', 0), _make_handler(state))
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.addCleanup(server.server_close)
+            self.addCleanup(server.shutdown)
+            return f'http://127.0.0.1:{server.server_port}'
+
+        pages = [(DETAIL_PAGE.encode('utf-8'), '"detalhe"')]
+        env = {'SCRAPE_HTTP_MAX_ATTEMPTS': '3', 'SCRAPE_HTTP_BACKOFF_BASE': '0.01', 'SCRAPE_HTTP_JITTER': '0',
+               'SCRAPE_HOST_RATE': '100', 'SCRAPE_HOST_BURST': '10', 'SCRAPE_LIMITER_JITTER': '0'}
+        with mock.patch.dict(os.environ, env), mock.patch('structure.ratelimit.redis', None), \
+                self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                                  'LOCATION': 'detalhes-tests'}}):
+            # Um 429 com Retry-After: a mesma página é pedida de novo depois da espera
+            state = Scripted([429], pages=pages, latency_ms=0, jitter_ms=0, p403=0, p429=0, p5xx=0, retry_after=1)
+            base = serve(state)
+            fetcher = DetailFetcher(base=base, max_workers=1, limiter=HostLimiter(limiter=RateLimiter()))
+            started = time.monotonic()
+            results, errors = fetcher.fetch_many(['PETR4', 'VALE3', 'PETR4'])
+            self.assertGreaterEqual(time.monotonic() - started, 1.0)
+            self.assertEqual(errors, {})
+            self.assertEqual(sorted(results), ['PETR4', 'VALE3'])
+            self.assertEqual(results['PETR4']['nro_acoes'], 13044496930)
+            self.assertEqual(state.stats()['by_status'], {'200': 2, '429': 1})
+
+            # Cache por ticker: nenhuma requisição nova
+            again, _ = fetcher.fetch_many(['PETR4', 'VALE3'])
+            self.assertEqual(again['VALE3']['setor'], 'Petróleo, Gás e Biocombustíveis')
+            self.assertEqual(state.stats()['requests'], 3)
+
+            # 403 em todas as tentativas: vira erro do Papel, sem derrubar os demais
+            state = Scripted([403, 403, 403], pages=pages, latency_ms=0, jitter_ms=0, p403=0, p429=0, p5xx=0,
+                             retry_after=None)
+            fetcher = DetailFetcher(base=serve(state), max_workers=1, use_cache=False,
+                                    limiter=HostLimiter(limiter=RateLimiter()))
+            results, errors = fetcher.fetch_many(['ITUB4', 'BBAS3'])
+            self.assertEqual(list(errors), ['ITUB4'])
+            self.assertIn('403', errors['ITUB4'])
+            self.assertEqual(list(results), ['BBAS3'])
+
+            # SCRAPE_HTTP_MAX_ATTEMPTS=0 ainda faz uma tentativa
+            with mock.patch.dict(os.environ, {'SCRAPE_HTTP_MAX_ATTEMPTS': '0'}):
+                fetcher = DetailFetcher(base=serve(Scripted([], pages=pages, latency_ms=0, jitter_ms=0, p403=0,
+                                                            p429=0, p5xx=0, retry_after=None)),
+                                        use_cache=False, limiter=HostLimiter(limiter=RateLimiter()))
+                self.assertEqual(fetcher.retry['max_attempts'], 1)
+                self.assertEqual(fetcher.fetch_one('WEGE3')['papel'], 'WEGE3')
+
+
+class MetricsParityTests(SimpleTestCase):
+    """Indicadores derivados (structure/metrics.py) contra o equivalente em pandas."""
+
+    def setUp(self):
+        import numpy as np
+        raw = pd.read_csv(os.path.join(MEDIA_DIR, 'acoes_raw.csv'), encoding='utf-8-sig', dtype=str)
+        self.columns = {c: raw[c].map(clean_numeric).to_numpy(dtype=np.float64)
+                        for c in ('Cotação', 'P/L', 'P/VP', 'EV/EBIT', 'ROIC')}
+        # Empates, NaN, zero e negativos garantidos além da tabela real
+        extra = {'Cotação': [10, 10, np.nan, 5, 20, 8], 'P/L': [5, -5, 4, 0, 5, np.inf],
+                 'P/VP': [1, 1, 1, -2, 2, 1], 'EV/EBIT': [4, 4, -8, 0, np.nan, 4], 'ROIC': [15, 15, 20, np.nan, 15, -3]}
+        self.columns = {c: np.concatenate([v, np.asarray(extra[c], dtype=np.float64)]) for c, v in self.columns.items()}
+
+    def assertSeriesEqual(self, actual, expected):
+        import numpy as np
+        np.testing.assert_allclose(actual, np.asarray(expected, dtype=np.float64), rtol=1e-12, equal_nan=True)
+
+    def test_earnings_yield_and_graham(self):
+        import numpy as np
+        from structure.metrics import earnings_yield, graham_number
+
+        ev = pd.Series(self.columns['EV/EBIT'])
+        expected = (1 / ev).where(np.isfinite(ev) & (ev != 0))
+        self.assertSeriesEqual(earnings_yield(ev), expected)
+        self.assertEqual(earnings_yield([-8.0])[0], -0.125)
+
+        cot, pl, pvp = (pd.Series(self.columns[c]) for c in ('Cotação', 'P/L', 'P/VP'))
+        lpa, vpa = cot / pl, cot / pvp
+        with np.errstate(invalid='ignore'):
+            expected = np.sqrt(22.5 * lpa * vpa).where((lpa > 0) & (vpa > 0) & np.isfinite(lpa * vpa))
+        self.assertSeriesEqual(graham_number(cot, pl, pvp), expected)
+        # P/L ou P/VP negativos (prejuízo, patrimônio negativo) não têm número de Graham
+        self.assertTrue(np.isnan(graham_number([10.0, 10.0], [-5.0, 5.0], [1.0, -1.0])).all())
+
+    def test_rank_percentile_and_zscore_match_pandas(self):
+        import numpy as np
+        from structure.metrics import percentile, rank, zscore
+
+        for name, values in self.columns.items():
+            values = np.where(np.isinf(values), np.nan, values)
+            s = pd.Series(values)
+            with self.subTest(column=name):
+                self.assertSeriesEqual(rank(values), s.rank(method='min'))
+                self.assertSeriesEqual(rank(values, ascending=False), s.rank(method='min', ascending=False))
+                n = s.notna().sum()
+                self.assertSeriesEqual(percentile(values), (s.rank(method='average') - 0.5) / n * 100)
+                self.assertSeriesEqual(zscore(values), (s - s.mean()) / s.std(ddof=0))
+
+                # O percentil 50 fica entre os valores vizinhos da mediana do pandas
+                pct = percentile(values)
+                median = s.quantile(0.5)
+                self.assertTrue((s[pct < 50] <= median).all() and (s[pct > 50] >= median).all())
+
+        # inf fica de fora como NaN
+        self.assertTrue(np.isnan(rank([1.0, np.inf, 2.0])[1]))
+        self.assertTrue(np.isnan(zscore([3.0, 3.0, 3.0])).all())
+
+    def test_magic_formula_rank_matches_pandas(self):
+        import numpy as np
+        from structure.metrics import earnings_yield, magic_formula_rank
+
+        ey = earnings_yield(self.columns['EV/EBIT'])
+        roic = self.columns['ROIC']
+        df = pd.DataFrame({'ey': ey, 'roic': roic})
+        eligible = df.dropna()
+        expected = (eligible['ey'].rank(method='min', ascending=False)
+                    + eligible['roic'].rank(method='min', ascending=False)).reindex(df.index)
+        self.assertSeriesEqual(magic_formula_rank(ey, roic), expected)
+
+        # EY negativo (EV/EBIT < 0) fica no fim do rank de EY; empate recebe o menor rank
+        mf = magic_formula_rank([0.25, 0.25, -0.125, np.nan], [15.0, 15.0, 20.0, 30.0])
+        self.assertSeriesEqual(mf, [1 + 2, 1 + 2, 3 + 1, np.nan])
@@ -0,0 +1,405 @@
+# structure/timeseries.py
+# Séries históricas por Papel a partir do arquivo diário (media/history/<AAAA-MM-DD>/).
+#
+# Abrir um snapshot por dia a cada consulta cresceria com o arquivo. Por isso os dias
+# são consolidados em partições mensais, colunares e orientadas por Papel:
+#
+#   media/history/_series/<AAAA-MM>/manifest.json   dias, Papéis, colunas -> arquivo, versões de origem
+#   media/history/_series/<AAAA-MM>/c<NNN>.npy      float64 (n_papeis, n_dias) de uma coluna
+#   media/history/_series/<AAAA-MM>/posicao.npy     int16 (n_papeis, n_dias), posição na lista (0 = fora)
+#   media/history/_series/STAMP                     reescrito a cada partição gravada (invalida caches)
+#
+# Uma consulta só abre as partições dos meses do intervalo (predicado empurrado para
+# o nome do diretório), só os arquivos das colunas pedidas (poda de colunas) e lê uma
+# linha contígua de cada um via mmap. O custo depende do intervalo pedido, não do
+# tamanho do arquivo; partições abertas e respostas ficam em cache no processo.
+import bisect
+import json
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from datetime import date
+
+import numpy as np
+
+from structure.filters import clean_numeric
+from structure.history import history_dir, history_root, list_days
+from structure.metrics import PERCENTILE_PREFIX, ZSCORE_PREFIX
+
+logger = logging.getLogger(__name__)
+
+SERIES_DIR = '_series'
+STAMP_FILE = 'STAMP'
+POSITION_FILE = 'posicao.npy'
+MANIFEST_FILE = 'manifest.json'
+DEFAULT_FIELDS = ['EV/EBIT', 'P/L', 'Liq.2meses']
+FREQUENCIES = ('diaria', 'semanal', 'mensal')
+
+
+def series_root(root: str = None) -> str:
+    return os.path.join(root or history_root(), SERIES_DIR)
+
+
+def month_of(day: str) -> str:
+    return day[:7]
+
+
+def _day_table(day: str, root: str = None):
+    """(papeis, colunas, lista final, versão) de um dia arquivado; None se não houver dados."""
+    from structure.snapshot import load_snapshot
+
+    base = history_dir(day, root)
+    snap = load_snapshot(os.path.join(base, 'snapshot'))
+    if snap is not None:
+        names = [c for c in snap.columns if not c.startswith((PERCENTILE_PREFIX, ZSCORE_PREFIX))]
+        columns = {name: np.asarray(snap.column(name), dtype=np.float64) for name in names}
+        return snap.papeis(), columns, snap.papeis(snap.selected), snap.version
+
+    # Dias arquivados antes do snapshot binário: só os CSVs
+    raw_path = os.path.join(base, 'acoes_raw.csv')
+    if not os.path.exists(raw_path):
+        return None
+    import pandas as pd
+    df = pd.read_csv(raw_path, encoding='utf-8-sig', dtype=str)
+    columns = {c: df[c].map(clean_numeric).to_numpy(dtype=np.float64) for c in df.columns if c != 'Papel'}
+    selected = []
+    final_path = os.path.join(base, 'acoes_filtradas.csv')
+    if os.path.exists(final_path):
+        selected = pd.read_csv(final_path, encoding='utf-8-sig', dtype=str)['Papel'].astype(str).tolist()
+    return df['Papel'].astype(str).tolist(), columns, selected, _day_source(day, root)
+
+
+def _day_source(day: str, root: str = None):
+    """Identificador do conteúdo arquivado no dia: versão do snapshot ou mtime/tamanho do CSV."""
+    from structure.snapshot import read_current_version
+
+    base = history_dir(day, root)
+    version = read_current_version(os.path.join(base, 'snapshot'))
+    if version:
+        return version
+    try:
+        st = os.stat(os.path.join(base, 'acoes_raw.csv'))
+    except FileNotFoundError:
+        return None
+    return f"csv-{st.st_mtime_ns}-{st.st_size}"
+
+
+def build_partition(month: str, root: str = None):
+    """Consolida os dias arquivados de `month` (AAAA-MM) numa partição. Retorna o diretório."""
+    days = [d for d in list_days(root) if month_of(d) == month]
+    tables = []
+    for day in days:
+        try:
+            table = _day_table(day, root)
+        except Exception as e:
+            logger.warning("Histórico de %s ilegível, fora da série: %s", day, e)
+            continue
+        if table is not None:
+            tables.append((day, table))
+
+    target = os.path.join(series_root(root), month)
+    if not tables:
+        shutil.rmtree(target, ignore_errors=True)
+        return None
+
+    papeis, row_of, names = [], {}, []
+    for _, (day_papeis, columns, _, _) in tables:
+        for papel in day_papeis:
+            if papel not in row_of:
+                row_of[papel] = len(papeis)
+                papeis.append(papel)
+        names.extend(c for c in columns if c not in names)
+    col_of = {name: i for i, name in enumerate(names)}
+
+    n_papeis, n_days = len(papeis), len(tables)
+    values = np.full((len(names), n_papeis, n_days), np.nan)
+    position = np.zeros((n_papeis, n_days), dtype=np.int16)
+    for j, (_, (day_papeis, columns, selected, _)) in enumerate(tables):
+        rows = np.fromiter((row_of[p] for p in day_papeis), dtype=np.int64, count=len(day_papeis))
+        for name, col in columns.items():
+            # Papel repetido no dia (ex.: MRSA3B): a última linha vence
+            values[col_of[name], rows, j] = col
+        for pos, papel in enumerate(selected, start=1):
+            position[row_of[papel], j] = pos
+
+    tmp = target + f'.tmp-{os.getpid()}'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    files = {}
+    for name, i in col_of.items():
+        files[name] = f'c{i:03d}.npy'
+        np.save(os.path.join(tmp, files[name]), np.ascontiguousarray(values[i]))
+    np.save(os.path.join(tmp, POSITION_FILE), position)
+    manifest = {
+        "month": month,
+        "days": [day for day, _ in tables],
+        "papeis": papeis,
+        "columns": files,
+        "sources": {day: table[3] for day, table in tables},
+    }
+    with open(os.path.join(tmp, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+    old = None
+    if os.path.exists(target):
+        old = target + f'.old-{os.getpid()}'
+        os.replace(target, old)
+    os.replace(tmp, target)
+    if old:
+        shutil.rmtree(old, ignore_errors=True)
+    _touch_stamp(root)
+    return target
+
+
+def _touch_stamp(root: str = None):
+    path = os.path.join(series_root(root), STAMP_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(str(os.getpid()))
+    os.replace(path + '.tmp', path)
+
+
+def update_series(day: str, root: str = None):
+    """Refaz a partição do mês de `day` (chamado depois de `archive_media`)."""
+    return build_partition(month_of(day), root)
+
+
+def sync_series(root: str = None) -> list:
+    """Refaz as partições que não batem com o arquivo diário (dias ou versões novas)."""
+    days = list_days(root)
+    months = sorted({month_of(d) for d in days})
+    rebuilt = []
+    for month in months:
+        manifest = _read_manifest(os.path.join(series_root(root), month))
+        sources = {d: _day_source(d, root) for d in days if month_of(d) == month}
+        sources = {d: v for d, v in sources.items() if v}
+        if manifest is not None and manifest.get("sources") == sources:
+            continue
+        build_partition(month, root)
+        rebuilt.append(month)
+    return rebuilt
+
+
+def _read_manifest(path: str):
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class Partition:
+    """Um mês da série, somente leitura; colunas abertas sob demanda via mmap."""
+
+    def __init__(self, path: str):
+        self.path = path
+        manifest = _read_manifest(path)
+        if manifest is None:
+            raise FileNotFoundError(os.path.join(path, MANIFEST_FILE))
+        self.month = manifest["month"]
+        self.days = list(manifest["days"])
+        self.files = dict(manifest["columns"])
+        self.row_index = {p: i for i, p in enumerate(manifest["papeis"])}
+        self._arrays = {}
+        self._lock = threading.Lock()
+
+    def _array(self, filename: str):
+        arr = self._arrays.get(filename)
+        if arr is None:
+            with self._lock:
+                arr = self._arrays.get(filename)
+                if arr is None:
+                    arr = np.load(os.path.join(self.path, filename), mmap_mode='r')
+                    self._arrays[filename] = arr
+        return arr
+
+    def read(self, papel: str, fields, start: str, end: str):
+        """(dias, valores por campo, posições) de `papel` entre `start` e `end` (inclusive)."""
+        lo = bisect.bisect_left(self.days, start)
+        hi = bisect.bisect_right(self.days, end)
+        row = self.row_index.get(papel)
+        if lo >= hi:
+            return [], {f: np.empty(0) for f in fields}, np.empty(0, dtype=np.int16)
+        n = hi - lo
+        if row is None:
+            return self.days[lo:hi], {f: np.full(n, np.nan) for f in fields}, np.zeros(n, dtype=np.int16)
+        values = {}
+        for field in fields:
+            filename = self.files.get(field)
+            values[field] = np.array(self._array(filename)[row, lo:hi]) if filename else np.full(n, np.nan)
+        return self.days[lo:hi], values, np.array(self._array(POSITION_FILE)[row, lo:hi])
+
+
+class SeriesStore:
+    """Partições abertas do processo + cache LRU de respostas, invalidados pelo STAMP."""
+
+    def __init__(self, root: str = None, cache_size: int = None):
+        self.root = series_root(root)
+        self.cache_size = cache_size if cache_size is not None else int(os.environ.get('HISTORY_CACHE_SIZE', '256'))
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._partitions = {}
+        self._months = []
+        self._cache = OrderedDict()
+
+    def _current_stamp(self):
+        try:
+            st = os.stat(os.path.join(self.root, STAMP_FILE))
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _refresh(self):
+        stamp = self._current_stamp()
+        if stamp == self._stamp:
+            return stamp
+        with self._lock:
+            if stamp != self._stamp:
+                try:
+                    months = sorted(name for name in os.listdir(self.root)
+                                    if len(name) == 7 and name[4] == '-' and os.path.isdir(os.path.join(self.root, name)))
+                except FileNotFoundError:
+                    months = []
+                self._partitions = {}
+                self._months = months
+                self._cache.clear()
+                self._stamp = stamp
+        return stamp
+
+    def _partition(self, month: str):
+        part = self._partitions.get(month)
+        if part is None:
+            part = Partition(os.path.join(self.root, month))
+            self._partitions[month] = part
+        return part
+
+    @property
+    def months(self) -> list:
+        self._refresh()
+        return list(self._months)
+
+    def fields(self) -> list:
+        """Colunas disponíveis na partição mais recente."""
+        months = self.months
+        return list(self._partition(months[-1]).files) if months else []
+
+    def history(self, papel: str, start: str = None, end: str = None, fields=None,
+                freq: str = 'diaria', version: str = None) -> dict:
+        """Série de `papel` (dict pronto para JSON), em cache por (Papel, intervalo, campos, freq, versão)."""
+        stamp = self._refresh()
+        fields = list(fields or DEFAULT_FIELDS)
+        key = (papel, start, end, tuple(fields), freq, version, stamp)
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit is not None:
+                self._cache.move_to_end(key)
+                return hit
+
+        result = self._query(papel, start or '0000-00-00', end or '9999-99-99', fields, freq)
+        result["version"] = version
+        with self._lock:
+            self._cache[key] = result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _query(self, papel, start, end, fields, freq) -> dict:
+        lo = bisect.bisect_left(self._months, month_of(start))
+        hi = bisect.bisect_right(self._months, month_of(end))
+        days, positions = [], []
+        values = {f: [] for f in fields}
+        found = False
+        for month in self._months[lo:hi]:
+            part = self._partition(month)
+            found = found or papel in part.row_index
+            part_days, part_values, part_positions = part.read(papel, fields, start, end)
+            days.extend(part_days)
+            positions.append(part_positions)
+            for f in fields:
+                values[f].append(part_values[f])
+        position = np.concatenate(positions) if positions else np.zeros(0, dtype=np.int16)
+        values = {f: (np.concatenate(v) if v else np.empty(0)) for f, v in values.items()}
+        events = list_events(days, position)
+
+        if freq != 'diaria' and days:
+            ends = period_ends(days, freq)
+            values = {f: last_finite(v, ends) for f, v in values.items()}
+            in_list = np.add.reduceat((position > 0).astype(np.int32), np.r_[0, ends[:-1] + 1])
+            position = position[ends]
+            days = [days[i] for i in ends]
+        else:
+            in_list = (position > 0).astype(np.int32)
+
+        return {
+            "papel": papel,
+            "encontrado": found,
+            "de": days[0] if days else None,
+            "ate": days[-1] if days else None,
+            "freq": freq,
+            "campos": fields,
+            "datas": days,
+            "valores": {f: _json_values(v) for f, v in values.items()},
+            "posicao": [int(p) or None for p in position.tolist()],
+            "dias_na_lista": [int(d) for d in in_list.tolist()],
+            "eventos": events,
+        }
+
+
+def _json_values(values: np.ndarray, decimals: int = 4) -> list:
+    values = np.round(np.where(np.isfinite(values), values, np.nan), decimals)
+    return [x if x == x else None for x in values.tolist()]
+
+
+def period_ends(days: list, freq: str) -> np.ndarray:
+    """Índice do último dia de cada semana ISO ('semanal') ou mês ('mensal')."""
+    if freq == 'mensal':
+        keys = [d[:7] for d in days]
+    else:
+        keys = [date.fromisoformat(d).isocalendar()[:2] for d in days]
+    ends = [i for i in range(len(keys) - 1) if keys[i] != keys[i + 1]]
+    ends.append(len(keys) - 1)
+    return np.asarray(ends, dtype=np.int64)
+
+
+def last_finite(values: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Último valor finito de cada período (terminados em `ends`); NaN se o período não tiver dado."""
+    idx = np.where(np.isfinite(values), np.arange(len(values)), -1)
+    np.maximum.accumulate(idx, out=idx)
+    starts = np.r_[0, ends[:-1] + 1]
+    last = idx[ends]
+    out = np.full(len(ends), np.nan)
+    ok = last >= starts
+    out[ok] = values[last[ok]]
+    return out
+
+
+def list_events(days: list, position: np.ndarray) -> list:
+    """Entradas e saídas da lista final no intervalo (na resolução diária)."""
+    inside = position > 0
+    if not len(inside):
+        return []
+    changes = np.flatnonzero(inside[1:] != inside[:-1]) + 1
+    events = []
+    if inside[0]:
+        events.append({"data": days[0], "evento": "na_lista", "posicao": int(position[0])})
+    for i in changes.tolist():
+        if inside[i]:
+            events.append({"data": days[i], "evento": "entrou", "posicao": int(position[i])})
+        else:
+            events.append({"data": days[i], "evento": "saiu", "posicao": None})
+    return events
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(root: str = None) -> SeriesStore:
+    """SeriesStore do processo para o arquivo `root` (padrão: media/history)."""
+    path = series_root(root)
+    store = _stores.get(path)
+    if store is None:
+        with _stores_lock:
+            store = _stores.setdefault(path, SeriesStore(root))
+    return store
@@ -0,0 +1,84 @@
+# structure/updates.py
+# Aviso de nova versão do snapshot para as conexões SSE abertas (views.updates_stream).
+#
+# Um único `VersionBroadcaster` por processo guarda a versão atual e, para cada
+# event loop, UMA future compartilhada por todas as conexões em espera. Quando o
+# listener Redis (ou a detecção pelo disco) troca o snapshot, `publish()` resolve
+# essa future a partir de qualquer thread, acordando todas as conexões do loop de
+# uma vez, sem timers ou polling por conexão além do keep-alive.
+#
+# As conexões entram com `join()` e saem com `leave()`: quando a última conexão de um
+# loop sai, a future e a referência ao loop são descartadas (sob WSGI cada requisição
+# roda num loop novo do async_to_sync, que não pode ficar preso aqui).
+import asyncio
+import threading
+
+
+def _resolve(future, value):
+    if not future.done():
+        future.set_result(value)
+
+
+class VersionBroadcaster:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._waiters = {}
+        self.version = None
+        self.seq = 0
+
+    def future(self) -> asyncio.Future:
+        """Future do loop atual, resolvida na próxima troca de versão."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            future = self._futures.get(loop)
+            if future is None or future.done():
+                future = loop.create_future()
+                self._futures[loop] = future
+            return future
+
+    def join(self):
+        """Registra uma conexão em espera no loop atual. Retorna o loop (para `leave`)."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._waiters[loop] = self._waiters.get(loop, 0) + 1
+        return loop
+
+    def leave(self, loop):
+        """Remove a conexão; a última do loop descarta a future (e o loop)."""
+        with self._lock:
+            remaining = self._waiters.get(loop, 0) - 1
+            if remaining > 0:
+                self._waiters[loop] = remaining
+            else:
+                self._waiters.pop(loop, None)
+                self._futures.pop(loop, None)
+
+    def publish(self, version: str, seq: int = None):
+        """Registra `version` e acorda todas as conexões em espera (thread-safe)."""
+        with self._lock:
+            if version == self.version:
+                return
+            self.version = version
+            self.seq = seq if seq is not None else self.seq + 1
+            waiting = list(self._futures.items())
+            self._futures.clear()
+            value = (self.version, self.seq)
+        for loop, future in waiting:
+            try:
+                loop.call_soon_threadsafe(_resolve, future, value)
+            except RuntimeError:
+                # Loop já encerrado
+                pass
+
+    async def wait(self, future: asyncio.Future, timeout: float):
+        """Espera a troca de versão (ou `timeout`). Retorna (versão, seq) ou None."""
+        try:
+            # shield: o timeout de uma conexão não cancela a future das outras
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+broadcaster = VersionBroadcaster()
@@ -1,6 +1,10 @@
-from django.urls import path
+from django.urls import path, re_path
 from . import views
 
 urlpatterns = [
     path('', views.home, name='index'),  # só página inicial
+    path('atualizacoes/', views.updates_stream, name='atualizacoes'),  # SSE da tabela
+    path('busca/', views.ticker_search, name='busca'),  # busca de Papéis (prefixo/fuzzy)
+    path('api/acoes/<str:papel>/history', views.ticker_history, name='historico'),  # série diária/semanal/mensal
+    re_path(r'^dados/(?P<version>[0-9a-f]{8,64})\.json$', views.snapshot_data, name='dados'),  # snapshot em JSON
 ]
@@ -0,0 +1,208 @@
+# structure/validation.py
+# Checagens de qualidade da tabela raspada antes de ela substituir o snapshot publicado.
+#
+# Tudo roda sobre a matriz float64 do snapshot do staging (colunas x linhas), com
+# operações de coluna: nenhum laço por linha. Erros bloqueiam a publicação; avisos
+# só entram no relatório gravado no metadata.json.
+#
+#   colunas   colunas dos filtros presentes (erro); demais do esquema (aviso)
+#   linhas    mínimo absoluto e faixa relativa às linhas da última publicação da mesma fonte
+#             (`rows_by_source`; falhas e 403 não apagam a referência)
+#   seleção   lista final vazia ou com linhas zeradas (erro); Papéis vazios (erro) ou duplicados (aviso)
+#   NaN       fração de vazios por coluna (erro nas colunas dos filtros)
+#   zeradas   linhas com todas as colunas dos filtros em 0 (ex.: CSTB4)
+#   outliers  z-score robusto (mediana/MAD) da ordem de grandeza, por coluna (zeros ficam de fora)
+#   mediana   salto da mediana de cada coluna em relação ao snapshot publicado
+#             (erro nas colunas dos filtros: mudança de unidade ou de layout)
+import logging
+import os
+import time
+
+import numpy as np
+
+from structure.filters import FILTER_COLUMNS, FINAL_COLUMNS
+from structure.metrics import is_derived
+from structure.sources import FUNDAMENTUS_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_SIZE = 5
+
+
+class ValidationFailed(Exception):
+    """A tabela raspada não passou nas checagens; `report` traz os detalhes."""
+
+    def __init__(self, report: dict):
+        super().__init__("Validação bloqueou a publicação: " + "; ".join(report.get("errors", [])))
+        self.report = report
+
+
+def _env_float(name: str, default: str) -> float:
+    return float(os.environ.get(name, default))
+
+
+def _magnitude(matrix: np.ndarray) -> np.ndarray:
+    # Indicadores financeiros têm cauda longa (liquidez, patrimônio) e sinal legítimo
+    # (patrimônio negativo): compara ordens de grandeza, log10(|x|)
+    return np.log10(np.abs(matrix))
+
+
+def _sample(papeis, mask) -> list:
+    return [papeis[i] for i in np.flatnonzero(mask)[:SAMPLE_SIZE]]
+
+
+def previous_rows(previous: dict, source: str = None):
+    """Linhas da última publicação de `source` (qualquer status atual do metadata).
+
+    Metadata antigo, sem `rows_by_source`, só vale para a fonte que o gravou.
+    """
+    if not isinstance(previous, dict):
+        return None
+    by_source = previous.get('rows_by_source')
+    if source is None:
+        value = previous.get('rows_raw')
+    elif isinstance(by_source, dict):
+        value = by_source.get(source)
+    elif previous.get('source', 'fundamentus') == source:
+        value = previous.get('rows_raw')
+    else:
+        value = None
+    try:
+        return int(value or 0) or None
+    except (TypeError, ValueError):
+        return None
+
+
+def validate_snapshot(snap, header=None, previous: dict = None, published=None, source: str = None) -> dict:
+    """Relatório de qualidade do snapshot `snap` (staging).
+
+    `header` é o cabeçalho lido da página, `previous` o metadata.json atual,
+    `published` o snapshot servido hoje (para comparar medianas) e `source` a fonte
+    dos dados (a faixa de linhas só compara publicações da mesma fonte). O relatório
+    tem `ok`, `errors`, `warnings` e os números de cada checagem.
+    """
+    started = time.perf_counter()
+    errors, warnings = [], []
+    header = list(header) if header is not None else ['Papel'] + [c for c in snap.columns if not is_derived(c)]
+    names = [c for c in snap.columns if not is_derived(c)]
+    n = snap.rows
+    papeis = snap.papeis()
+    report = {"rows": n, "selected": int(len(snap.selected))}
+
+    # Colunas
+    missing = [c for c in FINAL_COLUMNS if c not in header]
+    if missing:
+        errors.append(f"colunas dos filtros ausentes: {missing}")
+    missing_schema = [c for c in FUNDAMENTUS_COLUMNS if c not in header and c not in missing]
+    if missing_schema:
+        warnings.append(f"colunas do esquema ausentes: {missing_schema}")
+    unexpected = [c for c in header if c not in FUNDAMENTUS_COLUMNS]
+    if unexpected:
+        warnings.append(f"colunas inesperadas: {unexpected}")
+
+    # Linhas
+    min_rows = int(_env_float('VALIDATION_MIN_ROWS', '100'))
+    if n < min_rows:
+        errors.append(f"{n} linhas (mínimo {min_rows})")
+    baseline = previous_rows(previous, source)
+    report["previous_rows"] = baseline
+    if baseline:
+        low = _env_float('VALIDATION_ROWS_MIN_RATIO', '0.8')
+        high = _env_float('VALIDATION_ROWS_MAX_RATIO', '1.5')
+        ratio = n / baseline
+        report["rows_ratio"] = round(ratio, 3)
+        if not low <= ratio <= high:
+            errors.append(f"{n} linhas contra {baseline} no último scraping (faixa {low:g}x–{high:g}x)")
+
+    # Seleção e Papéis
+    if n and not len(snap.selected):
+        errors.append("nenhuma ação passou nos filtros")
+    unique, counts = np.unique(np.array(papeis, dtype=object).astype(str), return_counts=True)
+    duplicated = unique[counts > 1].tolist()
+    if duplicated:
+        # O próprio Fundamentus repete alguns Papéis (ex.: MRSA3B)
+        warnings.append(f"Papéis duplicados: {duplicated[:SAMPLE_SIZE]}")
+    empty_papel = int(sum(1 for p in papeis if not p.strip()))
+    if empty_papel:
+        errors.append(f"{empty_papel} linha(s) sem Papel")
+
+    if not names or not n:
+        report.update(ok=not errors, errors=errors, warnings=warnings,
+                      ms=round((time.perf_counter() - started) * 1000, 1))
+        return report
+
+    matrix = np.asarray(snap.numeric[[snap.columns.index(c) for c in names]], dtype=np.float64)
+    finite = np.isfinite(matrix)
+
+    # NaN por coluna
+    max_nan = _env_float('VALIDATION_MAX_NAN_RATIO', '0.2')
+    nan_ratio = 1.0 - finite.mean(axis=1)
+    report["nan_ratio"] = {c: round(float(r), 4) for c, r in zip(names, nan_ratio) if r > 0}
+    for name, ratio in zip(names, nan_ratio):
+        if ratio > max_nan:
+            message = f"{name}: {ratio:.0%} vazios (máximo {max_nan:.0%})"
+            (errors if name in FILTER_COLUMNS else warnings).append(message)
+
+    # Linhas zeradas nas colunas dos filtros
+    filter_idx = [names.index(c) for c in FILTER_COLUMNS if c in names]
+    if filter_idx:
+        zeroed = (matrix[filter_idx] == 0).all(axis=0)
+        count = int(zeroed.sum())
+        report["zeroed_rows"] = {"count": count, "sample": _sample(papeis, zeroed)}
+        max_zeroed = _env_float('VALIDATION_MAX_ZEROED_RATIO', '0.5')
+        if count / n > max_zeroed:
+            errors.append(f"{count} de {n} linhas com {FILTER_COLUMNS} zeradas")
+        elif count:
+            selected_zeroed = int(zeroed[np.asarray(snap.selected, dtype=np.int64)].sum())
+            if selected_zeroed:
+                errors.append(f"{selected_zeroed} ação(ões) zerada(s) na lista final")
+
+    # Outliers: |x - mediana| / (1,4826 * MAD) sobre log10(|x|). O site usa 0 para
+    # "sem dado", então zeros não entram na mediana nem são marcados
+    z_limit = _env_float('VALIDATION_OUTLIER_Z', '8')
+    present = finite & (matrix != 0)
+    outlier = np.zeros(matrix.shape, dtype=bool)
+    has_data = present.any(axis=1)
+    if has_data.any():
+        with np.errstate(invalid='ignore', divide='ignore'):
+            scaled = np.where(present[has_data], _magnitude(np.where(present[has_data], matrix[has_data], 1.0)), np.nan)
+            median = np.nanmedian(scaled, axis=1, keepdims=True)
+            mad = np.nanmedian(np.abs(scaled - median), axis=1, keepdims=True) * 1.4826
+            z = np.abs(scaled - median) / np.where(mad > 0, mad, np.nan)
+        outlier[has_data] = np.nan_to_num(z, nan=0.0) > z_limit
+    outliers = {}
+    max_outliers = _env_float('VALIDATION_MAX_OUTLIER_RATIO', '0.05')
+    for i, name in enumerate(names):
+        count = int(outlier[i].sum())
+        if count:
+            outliers[name] = {"count": count, "sample": _sample(papeis, outlier[i])}
+            if count / n > max_outliers:
+                warnings.append(f"{name}: {count} outliers (z > {z_limit:g})")
+    report["outliers"] = outliers
+    selected = np.asarray(snap.selected, dtype=np.int64)
+    selected_outliers = outlier[:, selected].any(axis=0) if len(selected) else np.zeros(0, dtype=bool)
+    if selected_outliers.any():
+        warnings.append(f"outliers na lista final: {[papeis[r] for r in selected[selected_outliers]]}")
+
+    # Mediana de cada coluna contra o snapshot publicado (mudança de unidade/layout)
+    if published is not None:
+        shift_limit = _env_float('VALIDATION_MAX_MEDIAN_SHIFT', '10')
+        shifts = {}
+        for i, name in enumerate(names):
+            if not published.has_column(name):
+                continue
+            old = np.asarray(published.column(name), dtype=np.float64)
+            old = np.nanmedian(np.abs(old[np.isfinite(old)])) if np.isfinite(old).any() else np.nan
+            new = np.nanmedian(np.abs(matrix[i][finite[i]])) if finite[i].any() else np.nan
+            if old > 0 and new > 0:
+                factor = max(new / old, old / new)
+                if factor > shift_limit:
+                    shifts[name] = round(float(new / old), 3)
+        if shifts:
+            report["median_shift"] = shifts
+            message = f"mediana mudou mais de {shift_limit:g}x: {sorted(shifts)}"
+            (errors if any(c in FILTER_COLUMNS for c in shifts) else warnings).append(message)
+
+    report.update(ok=not errors, errors=errors, warnings=warnings,
+                  ms=round((time.perf_counter() - started) * 1000, 1))
+    return report
@@ -1,214 +1,166 @@
 from django.shortcuts import render
 import requests
-from bs4 import BeautifulSoup
 import pandas as pd
 import os
 from django.conf import settings
 import logging
 from django.utils.timezone import now
 from datetime import datetime
-import pytz
+import gzip
 import json
+import time
 from django.utils import timezone as dj_tz
 
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-from structure.filters import apply_filters
-from structure.filters import clean_numeric
+from structure.formatting import format_display_frame, snapshot_table_html
+from structure.captures import capture_stream
+from structure.filters import FINAL_COLUMNS
+from structure.pipeline import iter_table_rows
+from structure.http_client import fetch, validators_from_response
+from structure.degradation import request_refresh, serve_table
+from structure.scrape_steps import (SOURCE_URL, publish_step, read_metadata, record_precheck_failure, stage_rows,
+                                    validate_step)
+from structure.snapshot import get_snapshot, load_snapshot
+from structure.snapshot_events import start_listener
+from structure.validation import ValidationFailed
 
 logger = logging.getLogger(__name__)
 
 
-def _fetch_table_from_site(url: str):
-    """Tenta obter a tabela do site usando headers de navegador e retries.
+def _fetch_table_from_site(url: str, validators: dict = None):
+    """Tenta obter a tabela do site pelo cliente HTTP compartilhado.
 
-    Levanta requests.HTTPError em caso de resposta ruim (403, 500, etc.)
-    ou ValueError se não encontrar a tabela.
+    Retorna (gerador das linhas da tabela, ETag/Last-Modified da resposta).
+    Levanta requests.HTTPError em caso de resposta ruim (403, 500, etc.),
+    NotModified se a página não mudou desde `validators` (ETag/Last-Modified)
+    e RateLimited se não houver token; ValueError (tabela não encontrada) sai
+    durante o consumo do gerador.
     """
-    session = requests.Session()
-    headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-            "(KHTML, like Gecko) Chrome/117.0.0.0 Safari/537.36"
-        ),
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
-        "Accept-Language": "pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7",
-        "Referer": "https://www.google.com/",
-        "Connection": "keep-alive",
-    }
-    session.headers.update(headers)
-
-    retries = Retry(total=2, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
-    adapter = HTTPAdapter(max_retries=retries)
-    session.mount("https://", adapter)
-
-    # Pequena pausa para simular comportamento humano  # ✅ 4 espaços (CORRETO)
-    time.sleep(1)                                          # ✅ 4 espaços (CORRETO)
-    r = session.get(url, timeout=15)                       # ✅ 4 espaços (CORRETO)
-    r.raise_for_status()    
-
-    soup = BeautifulSoup(r.text, "html.parser")
-    # Preferir o elemento com id 'resultado' (mesma referência do scraper anterior)
-    table_el = soup.find(id="resultado")
-    table = table_el if table_el is not None else soup.find("table")
-    if table is None:
-        raise ValueError("Tabela não encontrada no HTML")
-
-    # Extrai o texto das células para preservar exatamente o formato original
-    rows = []
-    for tr in table.find_all('tr'):
-        tds = [td.get_text(strip=True) for td in tr.find_all(['td', 'th'])]
-        if tds:
-            rows.append(tds)
-
-    df = pd.DataFrame(rows[1:], columns=rows[0])
-
-    # Garantir que todas as colunas sejam strings (preservar formatação BR como '9,99')
-    for col in df.columns:
-        df[col] = df[col].apply(lambda x: str(x) if pd.notna(x) and str(x) != 'nan' else '')
-    return df
-
-
-def _read_cached_table():
-    """Lê `media/acoes_filtradas.csv` e `media/metadata.json` como fallback."""
-    media_dir = os.path.join(settings.BASE_DIR, "media")
-    final_path = os.path.join(media_dir, "acoes_filtradas.csv")
-    metadata_path = os.path.join(media_dir, "metadata.json")
-
-    tabela_html = None
-    data_atual = None
-
-    # Se S3 estiver configurado, tente ler do S3 primeiro
-    bucket = os.environ.get('AWS_S3_BUCKET')
-    if bucket:
-        try:
-            from structure.s3_utils import get_csv_df, get_json
-            csv_io = get_csv_df(bucket, 'acoes_filtradas.csv')
-            df_final = pd.read_csv(csv_io, encoding='utf-8-sig', dtype=str)
-            tabela_html = df_final.to_html(classes="table table-striped", index=False, border=0)
-
-            meta = get_json(bucket, 'metadata.json')
-            last = meta.get('last_scrape')
-            if last:
-                try:
-                    last_dt = datetime.fromisoformat(last)
-                    tz_sp = pytz.timezone('America/Sao_Paulo')
-                    last_sp = last_dt.astimezone(tz_sp)
-                    data_atual = last_sp.strftime("%d/%m/%Y %H:%M")
-                except Exception:
-                    data_atual = last
-            return tabela_html, data_atual
-        except Exception:
-            logger.warning("Falha ao ler arquivos do S3 — fallback para local")
+    # Token bucket compartilhado (Redis): sem token disponível, não espera —
+    # levanta RateLimited e a view cai para o cache
+    r = fetch(url, validators=validators, wait=False, stream=True, headers={"Referer": "https://www.google.com/"})
+    r.raise_for_status()
+    if r.encoding is None:
+        r.encoding = r.apparent_encoding
+
+    # Gerador de linhas: o HTML é consumido em pedaços conforme o pipeline lê.
+    # Prefere o elemento com id 'resultado' (mesma referência do scraper anterior)
+    # O corpo também é gravado comprimido em media/captures/ (replay offline)
+    chunks = capture_stream(r.iter_content(chunk_size=64 * 1024, decode_unicode=True), url)
+    rows = iter_table_rows(chunks, table_id="resultado")
+    return rows, validators_from_response(r)
+
+
+def _snapshot_table_html(snap) -> str:
+    """Tabela HTML das ações selecionadas no snapshot (mesmo formato da página)."""
+    return snapshot_table_html(snap)
+
+
+def _local_data_atual(metadata_path: str = None):
+    """Data da última atualização (dd/mm/aaaa HH:MM) lida do metadata.json local."""
+    metadata_path = metadata_path or os.path.join(settings.BASE_DIR, "media", "metadata.json")
+    if not os.path.exists(metadata_path):
+        return None
+    try:
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        last = meta.get("last_scrape")
+        if last:
+            try:
+                last_dt = datetime.fromisoformat(last)
+                last_sp = last_dt.astimezone(dj_tz.get_default_timezone())
+                return last_sp.strftime("%d/%m/%Y %H:%M")
+            except Exception:
+                return last
+    except Exception as e:
+        logger.warning("Falha ao ler metadata.json: %s", e)
+    return None
 
-    if os.path.exists(final_path):
-        try:
-            df_final = pd.read_csv(final_path, encoding="utf-8-sig", dtype=str)
-            # Formata colunas numéricas para exibição (BR format)
-            df_display = _format_display_df(df_final)
-            tabela_html = df_display.to_html(classes="table table-striped", index=False, border=0)
-        except Exception as e:
-            logger.warning("Falha ao ler acoes_filtradas.csv: %s", e)
-
-    if os.path.exists(metadata_path):
-        try:
-            with open(metadata_path, "r", encoding="utf-8") as f:
-                meta = json.load(f)
-            last = meta.get("last_scrape")
-            if last:
-                try:
-                    last_dt = datetime.fromisoformat(last)
-                    last_sp = last_dt.astimezone(dj_tz.get_default_timezone())
-                    data_atual = last_sp.strftime("%d/%m/%Y %H:%M")
-                except Exception:
-                    data_atual = last
-        except Exception as e:
-            logger.warning("Falha ao ler metadata.json: %s", e)
-    # Caso metadata esteja ausente, tenta inferir última modificação do arquivo
-    if data_atual is None and os.path.exists(final_path):
-        try:
-            mtime = os.path.getmtime(final_path)
-            tz_sp = pytz.timezone('America/Sao_Paulo')
-            dt = datetime.fromtimestamp(mtime, tz=tz_sp)
-            data_atual = dt.strftime("%d/%m/%Y %H:%M")
-        except Exception:
-            pass
 
-    return tabela_html, data_atual
+def _snapshot_version():
+    try:
+        snap = get_snapshot()
+        return snap.version if snap is not None else None
+    except Exception:
+        return None
 
 
-def home(request):
-    url = "https://www.fundamentus.com.br/resultado.php"
+def _unavailable(request, aviso=None):
+    return render(request, "structure/index.html", {
+        "tabela_html": "<p>Dados indisponíveis no momento.</p>",
+        "data_atual": None,
+        "aviso": aviso,
+    })
 
-    # ESTRATÉGIA CACHE-FIRST: Sempre tenta cache primeiro para evitar timeouts
-    logger.info("Verificando cache antes de scraping...")
-    tabela_html, data_atual = _read_cached_table()
 
-    # Verifica se dados são muito antigos (> 6 horas) e força atualização
-    should_force_update = False
-    if tabela_html is not None:
+def _log_http_diagnostics(e, url, status):
+    """Logs diagnósticos opcionais e temporários (controle via env var SCRAPE_VERBOSE_LOGGING=1)."""
+    try:
+        if os.environ.get('SCRAPE_VERBOSE_LOGGING') != '1':
+            return
+        resp = getattr(e, 'response', None)
+        req_hdrs = None
+        resp_hdrs = None
+        body_snip = None
         try:
-            from django.conf import settings
-            metadata_path = os.path.join(settings.BASE_DIR, "media", "metadata.json")
-            if os.path.exists(metadata_path):
-                with open(metadata_path, "r", encoding="utf-8") as f:
-                    meta = json.load(f)
-                    last_scrape = meta.get("last_scrape")
-                    if last_scrape:
-                        from datetime import datetime
-                        last_dt = datetime.fromisoformat(last_scrape.replace('Z', '+00:00'))
-                        age_hours = (now() - last_dt).total_seconds() / 3600
-                        if age_hours > 6:  # Mais de 6 horas
-                            logger.info(".1f")
-                            should_force_update = True
-                            tabela_html = None  # Força novo scraping
-        except Exception as e:
-            logger.warning(f"Erro verificando idade dos dados: {e}")
-
-    if tabela_html is not None and not should_force_update:
-        logger.info("Cache encontrado e atualizado - retornando dados imediatamente")
-        return render(request, "structure/index.html", {"tabela_html": tabela_html, "data_atual": data_atual})
-
-    # Só chega aqui se NÃO houver cache disponível OU dados muito antigos
-    if should_force_update:
-        logger.info("Dados antigos detectados - forçando atualização automática...")
-    else:
-        logger.warning("Nenhum cache encontrado - será necessário fazer scraping (pode ser lento)")
+            if resp is not None:
+                resp_hdrs = dict(resp.headers) if getattr(resp, 'headers', None) is not None else None
+                body_snip = getattr(resp, 'text', '')
+                if isinstance(body_snip, str):
+                    body_snip = body_snip[:1000].replace('\n', ' ').replace('\r', ' ')
+                req = getattr(resp, 'request', None)
+                if req is not None:
+                    req_hdrs = dict(getattr(req, 'headers', {}))
+        except Exception as ex:
+            logger.debug('Erro ao coletar dados de resposta para logging verboso: %s', ex)
+
+        logger.warning('Diagnostic: verbose 403 detected (view). status=%s url=%s', status, url)
+        if req_hdrs:
+            logger.warning('Diagnostic: request headers (sample): %s', {k: req_hdrs.get(k) for k in ['User-Agent', 'Accept', 'Referer'] if k in req_hdrs})
+        if resp_hdrs:
+            logger.warning('Diagnostic: response headers (sample): %s', {k: resp_hdrs.get(k) for k in ['Server', 'Via', 'X-Cache', 'Content-Type'] if k in resp_hdrs})
+        if body_snip:
+            logger.warning('Diagnostic: response body snippet: %s', body_snip)
+    except Exception:
+        logger.debug('Erro durante logging verboso')
+
+
+def home(request):
+    url = SOURCE_URL
+    meta_current = read_metadata()
 
-    # Checa metadata para evitar fetch repetidas vezes quando o site bloqueia (403)
-    media_dir = os.path.join(settings.BASE_DIR, "media")
-    metadata_path = os.path.join(media_dir, "metadata.json")
-    cooldown_hours = int(os.environ.get("SCRAPE_BLOCK_COOLDOWN_HOURS", "24"))
+    # POLÍTICA DE DEGRADAÇÃO (structure/degradation.py): serve a tabela mais recente de
+    # qualquer camada (snapshot, CSV, histórico, Redis, S3) com a idade indicada. Dados
+    # vencidos pelo calendário da B3 são atualizados em segundo plano; a página não espera a fonte.
     try:
-        if os.path.exists(metadata_path):
-            with open(metadata_path, "r", encoding="utf-8") as f:
-                meta_current = json.load(f)
-
-            # Preferimos um campo explícito `next_allowed_attempt` (ISO).
-            # Se presente e no futuro, não tentamos buscar no site.
-            next_allowed = meta_current.get("next_allowed_attempt")
-            if meta_current.get("status") == "forbidden" and next_allowed:
-                try:
-                    next_dt = datetime.fromisoformat(next_allowed)
-                    now_dt = now().astimezone(dj_tz.get_default_timezone())
-                    if next_dt.astimezone(dj_tz.get_default_timezone()) > now_dt:
-                        # Ainda em cooldown → fallback para dados hardcoded (emergência)
-                        logger.warning("Site em cooldown - usando dados de emergência")
-                        tabela_emergencia = """
-                        <tr><td>EMERGENCIA</td><td>Cache indisponível</td><td>Site bloqueado</td><td>Aguardar atualização</td></tr>
-                        """
-                        return render(request, "structure/index.html", {
-                            "tabela_html": f'<table class="table table-striped">{tabela_emergencia}</table>',
-                            "data_atual": "Sistema em modo emergência"
-                        })
-                except Exception:
-                    # se parse falhar, caímos para o comportamento anterior (tentar buscar)
-                    pass
-    except Exception:
-        # não bloqueia a execução se metadata estiver corrompido
-        pass
+        start_listener()
+    except Exception as e:
+        logger.warning("Falha ao iniciar listener do snapshot: %s", e)
+    served = serve_table(meta_current)
+    if served is not None:
+        if served["stale"] or served["tier"] != 'snapshot':
+            logger.info("Servindo dados de %s (camada %s): %s", served["data_atual"], served["tier"], served["aviso"])
+        return render(request, "structure/index.html", {
+            "tabela_html": served["tabela_html"],
+            "data_atual": served["data_atual"],
+            "snapshot_version": served["snapshot_version"],
+            "aviso": served["aviso"],
+        })
+
+    # Nenhuma camada tem dados (primeiro deploy sem S3/Redis): único caso em que a
+    # requisição busca na fonte
+    logger.warning("Nenhum dado em nenhuma camada - será necessário fazer scraping (pode ser lento)")
+    meta_current = meta_current if isinstance(meta_current, dict) else {}
+    next_allowed = meta_current.get("next_allowed_attempt")
+    if meta_current.get("status") == "forbidden" and next_allowed:
+        try:
+            next_dt = datetime.fromisoformat(next_allowed).astimezone(dj_tz.get_default_timezone())
+            if next_dt > now().astimezone(dj_tz.get_default_timezone()):
+                logger.warning("Site em cooldown e sem dados para servir")
+                return _unavailable(request, f"A fonte está em pausa até {next_dt.strftime('%d/%m %H:%M')}.")
+        except Exception:
+            # se parse falhar, tenta buscar normalmente
+            pass
 
-    # Tenta primeiro buscar no site (com circuit breaker)
     try:
         # Circuit breaker: timeout de 30s para evitar travamentos
         import signal
@@ -216,216 +168,50 @@ def home(request):
         def timeout_handler(signum, frame):
             raise TimeoutError("Scraping excedeu timeout de segurança")
 
-        # Define alarme para 30 segundos
         signal.signal(signal.SIGALRM, timeout_handler)
         signal.alarm(30)
 
         try:
-            df = _fetch_table_from_site(url)
+            # Pipeline em streaming num staging: media/ só muda se a tabela passar na validação
+            rows, source_validators = _fetch_table_from_site(url)
+            staged = stage_rows(rows, url, **source_validators)
         finally:
-            # Cancela o alarme
             signal.alarm(0)
-        # Salva raw (sem alterações) para referência e para aplicar filtros de forma consistente
-        media_dir = os.path.join(settings.BASE_DIR, "media")
-        try:
-            os.makedirs(media_dir, exist_ok=True)
-            raw_path = os.path.join(media_dir, "acoes_raw.csv")
-            raw_tmp = raw_path + ".tmp"
-            df.to_csv(raw_tmp, index=False, encoding="utf-8-sig")
-            os.replace(raw_tmp, raw_path)
-        except Exception as e:
-            logger.warning("Falha ao salvar acoes_raw.csv: %s", e)
-
-        tabela_html = None
-        df_final = None
-        try:
-            # Usa a função de filtros compartilhada para gerar a lista de Papéis
-            lista_final = apply_filters(df)
-            lista_final = [x[0] if isinstance(x, (list, tuple)) else x for x in lista_final]
-            lista_final = [str(x).strip() for x in lista_final]
-
-            # Reabre o raw para garantir consistência e monta df_final
-            df_raw_reload = pd.read_csv(raw_path, encoding="utf-8-sig", dtype=str)
-            if 'Papel' in df_raw_reload.columns:
-                df_final = df_raw_reload[df_raw_reload['Papel'].isin(lista_final)]
-                df_final = df_final.set_index('Papel').loc[lista_final].reset_index()
-                colunas_finais = ['Papel', 'Liq.2meses', 'Mrg Ebit', 'EV/EBIT', 'P/L']
-                colunas_existentes = [c for c in colunas_finais if c in df_final.columns]
-                df_final = df_final[colunas_existentes]
-                # Formata para exibição (BR format)
-                df_display = _format_display_df(df_final)
-                tabela_html = df_display.to_html(classes="table table-striped", index=False, border=0)
-        except Exception as e:
-            logger.warning("Falha ao aplicar filtros: %s", e)
-
-        # Se por algum motivo não foi possível montar a tabela filtrada, exibe raw
-        if tabela_html is None:
-            # Se não houver tabela filtrada, formata o raw para exibição
-            df_display = _format_display_df(df)
-            tabela_html = df_display.to_html(classes="table table-striped", index=False, border=0)
 
+        # Raw, filtrado, snapshot e metadata (com o relatório da validação)
+        published = publish_step(validate_step(staged))
+
+        df_final = pd.DataFrame(staged["final_rows"], columns=FINAL_COLUMNS)
+        tabela_html = _format_display_df(df_final).to_html(classes="table table-striped", index=False, border=0)
         data_atual = now().astimezone(dj_tz.get_default_timezone()).strftime("%d/%m/%Y %H:%M")
+        return render(request, "structure/index.html", {
+            "tabela_html": tabela_html,
+            "data_atual": data_atual,
+            "snapshot_version": published["snapshot_version"],
+        })
 
-        # Salva resultado filtrado (se disponível) e metadata
-        try:
-            os.makedirs(media_dir, exist_ok=True)
-            final_path = os.path.join(media_dir, "acoes_filtradas.csv")
-            tmp = final_path + ".tmp"
-            to_save = df_final if df_final is not None else df
-            to_save.to_csv(tmp, index=False, encoding="utf-8-sig")
-            os.replace(tmp, final_path)
-
-            # Adiciona timestamps locais (America/Sao_Paulo) para facilitar leitura nos logs/UI
-            tz_sp = pytz.timezone('America/Sao_Paulo')
-            last_scrape_iso = now().isoformat()
-            last_scrape_local = now().astimezone(tz_sp).strftime("%d/%m/%Y %H:%M:%S %z")
-            metadata = {
-                "last_scrape": last_scrape_iso,
-                "last_scrape_local": last_scrape_local,
-                "rows_raw": len(df),
-                "rows_filtered": len(to_save) if hasattr(to_save, 'shape') else 0,
-                "source_url": url,
-                "status": "success"
-            }
-            metadata_path = os.path.join(media_dir, "metadata.json")
-            with open(metadata_path + ".tmp", "w", encoding="utf-8") as f:
-                json.dump(metadata, f, ensure_ascii=False, indent=4)
-            os.replace(metadata_path + ".tmp", metadata_path)
-        except Exception as e:
-            logger.warning("Falha ao gravar cache em media/: %s", e)
-
-        return render(request, "structure/index.html", {"tabela_html": tabela_html, "data_atual": data_atual})
+    except ValidationFailed as e:
+        # Página parcial ou layout novo: o relatório ficou no metadata
+        logger.warning("%s", e)
+        return _unavailable(request)
 
     except TimeoutError:
-        logger.error("Circuit breaker ativado: scraping excedeu 30s - retornando emergência")
-        tabela_emergencia = """
-        <tr><td>SISTEMA</td><td>Timeout de segurança</td><td>Scraping interrompido</td><td>Cache será atualizado em background</td></tr>
-        """
-        return render(request, "structure/index.html", {
-            "tabela_html": f'<table class="table table-striped">{tabela_emergencia}</table>',
-            "data_atual": "Sistema em proteção contra timeout"
-        })
+        logger.error("Circuit breaker ativado: scraping excedeu 30s - atualização segue em segundo plano")
+        request_refresh()
+        return _unavailable(request, "A fonte está lenta; os dados serão carregados em segundo plano.")
 
     except requests.HTTPError as e:
         status = getattr(e.response, "status_code", None)
         logger.warning("Erro HTTP ao buscar site: %s (status=%s) [origin=view]", e, status)
-        # Logs diagnósticos opcionais e temporários (controle via env var SCRAPE_VERBOSE_LOGGING=1)
-        try:
-            if os.environ.get('SCRAPE_VERBOSE_LOGGING') == '1':
-                resp = getattr(e, 'response', None)
-                req_hdrs = None
-                resp_hdrs = None
-                body_snip = None
-                try:
-                    if resp is not None:
-                        resp_hdrs = dict(resp.headers) if getattr(resp, 'headers', None) is not None else None
-                        body_snip = getattr(resp, 'text', '')
-                        if isinstance(body_snip, str):
-                            body_snip = body_snip[:1000].replace('\n', ' ').replace('\r', ' ')
-                        req = getattr(resp, 'request', None)
-                        if req is not None:
-                            req_hdrs = dict(getattr(req, 'headers', {}))
-                except Exception as ex:
-                    logger.debug('Erro ao coletar dados de resposta para logging verboso: %s', ex)
-
-                logger.warning('Diagnostic: verbose 403 detected (view). status=%s url=%s', status, url)
-                if req_hdrs:
-                    logger.warning('Diagnostic: request headers (sample): %s', {k: req_hdrs.get(k) for k in ['User-Agent', 'Accept', 'Referer'] if k in req_hdrs})
-                if resp_hdrs:
-                    logger.warning('Diagnostic: response headers (sample): %s', {k: resp_hdrs.get(k) for k in ['Server', 'Via', 'X-Cache', 'Content-Type'] if k in resp_hdrs})
-                if body_snip:
-                    logger.warning('Diagnostic: response body snippet: %s', body_snip)
-        except Exception:
-            logger.debug('Erro durante logging verboso')
-        # Se for 403, grava metadata com status forbidden, last_attempt, next_allowed_attempt e forbidden_count
-        try:
-            os.makedirs(media_dir, exist_ok=True)
+        _log_http_diagnostics(e, url, status)
+        # Grava status/backoff no metadata sem apagar o último scraping bem-sucedido
+        level, message = record_precheck_failure(url, status)
+        logger.warning("%s", message)
+        return _unavailable(request)
 
-            # Carrega metadata existente (se houver) para contar ocorrências anteriores
-            existing = None
-            try:
-                if os.path.exists(metadata_path):
-                    with open(metadata_path, "r", encoding="utf-8") as f:
-                        existing = json.load(f)
-            except Exception:
-                existing = None
-
-            existing_count = int(existing.get("forbidden_count", 0)) if isinstance(existing, dict) else 0
-            new_count = existing_count + 1
-
-            # Parâmetros de backoff configuráveis por env vars
-            base_hours = int(os.environ.get("SCRAPE_BACKOFF_BASE_HOURS", "2"))
-            max_hours = int(os.environ.get("SCRAPE_BACKOFF_MAX_HOURS", "168"))
-            # Crescimento exponencial: base * 2^(n-1)
-            backoff_hours = min(base_hours * (2 ** (new_count - 1)), max_hours)
-
-            next_allowed = (now() + pd.Timedelta(hours=backoff_hours)).isoformat()
-            tz_sp = pytz.timezone('America/Sao_Paulo')
-            metadata_forbidden = {
-                "last_scrape": meta_current.get("last_scrape") if 'meta_current' in locals() and isinstance(meta_current, dict) else None,
-                "last_scrape_local": meta_current.get("last_scrape_local") if 'meta_current' in locals() and isinstance(meta_current, dict) else None,
-                "last_attempt": now().isoformat(),
-                "last_attempt_local": now().astimezone(tz_sp).strftime("%d/%m/%Y %H:%M:%S %z"),
-                "next_allowed_attempt": next_allowed,
-                "next_allowed_attempt_local": datetime.fromisoformat(next_allowed).astimezone(tz_sp).strftime("%d/%m/%Y %H:%M:%S %z"),
-                "status": "forbidden",
-                "http_status": status,
-                "forbidden_count": new_count,
-                "backoff_hours": backoff_hours,
-                "source_url": url,
-            }
-
-            # Só grava se não houver um `next_allowed_attempt` futuro já presente
-            try:
-                should_write = True
-                if existing and existing.get("status") == "forbidden" and existing.get("next_allowed_attempt"):
-                    try:
-                        existing_next = datetime.fromisoformat(existing.get("next_allowed_attempt"))
-                        if existing_next > now().astimezone(dj_tz.get_default_timezone()):
-                            # Se já houver cooldown futuro maior, não sobrescreve, mas incrementa contador local
-                            should_write = False
-                    except Exception:
-                        should_write = True
-
-                if should_write:
-                    with open(metadata_path + ".tmp", "w", encoding="utf-8") as f:
-                        json.dump(metadata_forbidden, f, ensure_ascii=False, indent=4)
-                    os.replace(metadata_path + ".tmp", metadata_path)
-                    logger.warning("Gravado metadata forbidden (count=%s backoff=%sh)", new_count, backoff_hours)
-                else:
-                    # Atualiza apenas contador se necessário (evitar sobrescrever next_allowed)
-                    try:
-                        existing = existing or {}
-                        existing["forbidden_count"] = new_count
-                        with open(metadata_path + ".tmp", "w", encoding="utf-8") as f:
-                            json.dump(existing, f, ensure_ascii=False, indent=4)
-                        os.replace(metadata_path + ".tmp", metadata_path)
-                        logger.warning("Cooldown já ativo, atualizado forbidden_count=%s", new_count)
-                    except Exception:
-                        logger.warning("Falha ao atualizar forbidden_count no metadata")
-            except Exception:
-                logger.warning("Falha ao verificar/atualizar metadata de forbidden")
-        except Exception:
-            logger.warning("Não foi possível gravar metadata de forbidden")
-        # Fallback: ler cache local
-        tabela_html, data_atual = _read_cached_table()
-        if tabela_html is not None:
-            # Adiciona nota que foi usado cache
-            nota = "Dados carregados do cache local."
-            if not data_atual:
-                data_atual = now().astimezone(dj_tz.get_default_timezone()).strftime("%d/%m/%Y %H:%M")
-            nota = f"{nota} Última atualização: {data_atual}."
-            tabela_html = tabela_html + f"<p><em>{nota}</em></p>"
-            return render(request, "structure/index.html", {"tabela_html": tabela_html, "data_atual": data_atual})
-        return render(request, "structure/index.html", {"tabela_html": f"<p>Erro: {e}</p>", "data_atual": None})
-        
-    except Exception as e:
+    except Exception:
         logger.exception("Erro ao buscar/parsear tabela:")
-        tabela_html, data_atual = _read_cached_table()
-        if tabela_html is not None:
-            tabela_html = tabela_html + "<p><em>Dados carregados do cache local.</em></p>"
-            return render(request, "structure/index.html", {"tabela_html": tabela_html, "data_atual": data_atual})
-        return render(request, "structure/index.html", {"tabela_html": f"<p>Erro: {e}</p>", "data_atual": None})
+        return _unavailable(request)
 
 
 def _format_display_df(df: pd.DataFrame) -> pd.DataFrame:
@@ -435,35 +221,250 @@ def _format_display_df(df: pd.DataFrame) -> pd.DataFrame:
     - 'Mrg Ebit', 'EV/EBIT', 'P/L' -> duas casas decimais com vírgula
     Mantém valores originais se não conseguirmos converter.
     """
-    df2 = df.copy()
-    def en_to_br(num, decimals=2, thousands=True):
-        try:
-            if pd.isna(num):
-                return ''
-            n = float(num)
-        except Exception:
-            return str(num)
-
-        if thousands and abs(n) >= 1000:
-            fmt = f"{{:,.{decimals}f}}" if decimals > 0 else "{:,.0f}"
-            s = fmt.format(n)
-            # troca: 1,234.56 -> 1.234,56
-            s = s.replace(',', 'X').replace('.', ',').replace('X', '.')
-            # se decimals == 0, remover ,00
-            if decimals == 0:
-                s = s.split(',')[0]
-            return s
-        else:
-            fmt = f"{{:.{decimals}f}}"
-            s = fmt.format(n).replace('.', ',')
-            return s
-
-    # Liq.2meses como inteiro com separador de milhares
-    if 'Liq.2meses' in df2.columns:
-        df2['Liq.2meses'] = df2['Liq.2meses'].apply(lambda x: en_to_br(clean_numeric(x), decimals=0, thousands=True) if pd.notna(clean_numeric(x)) else (x if pd.notna(x) else ''))
-
-    for col in ['Mrg Ebit', 'EV/EBIT', 'P/L']:
-        if col in df2.columns:
-            df2[col] = df2[col].apply(lambda x: en_to_br(clean_numeric(x), decimals=2, thousands=False) if pd.notna(clean_numeric(x)) else (x if pd.notna(x) else ''))
-
-    return df2
+    return format_display_frame(df)
+
+
+# --- Atualizações ao vivo (Server-Sent Events) ---------------------------------
+# Cada aba aberta mantém uma conexão em /atualizacoes/. A conexão dorme na future
+# compartilhada do VersionBroadcaster e só acorda quando um scraping publica uma
+# versão nova do snapshot (ou no keep-alive). O fragmento da tabela é renderizado
+# uma vez por versão e reaproveitado por todas as conexões do processo.
+SSE_KEEPALIVE_SECONDS = int(os.environ.get('SSE_KEEPALIVE_SECONDS', '25'))
+SSE_RETRY_MS = int(os.environ.get('SSE_RETRY_MS', '3000'))
+# Sob WSGI cada conexão prenderia um worker: responde e pede reconexão espaçada
+SSE_WSGI_RETRY_MS = int(os.environ.get('SSE_WSGI_RETRY_MS', '60000'))
+
+_update_payloads = {}
+
+
+def _pushed_version():
+    """Versão do broadcaster se o listener Redis está ativo (avisado a cada troca)."""
+    from structure.updates import broadcaster
+    from structure.snapshot_events import get_listener
+    listener = get_listener()
+    if listener is not None and listener.connected:
+        return broadcaster.version
+    return None
+
+
+def _current_version():
+    """Versão atual do snapshot, avisando o broadcaster se mudou pelo disco."""
+    from structure.updates import broadcaster
+    version = _snapshot_version()
+    if version:
+        broadcaster.publish(version)
+    return version
+
+
+def _update_payload(version: str):
+    """Evento SSE (JSON) com o fragmento da tabela de `version`, em cache por versão."""
+    payload = _update_payloads.get(version)
+    if payload is not None:
+        return payload
+    snap = get_snapshot()
+    if snap is None or snap.version != version:
+        return None
+    from django.urls import reverse
+    payload = json.dumps({
+        "version": snap.version,
+        "dados_url": reverse('dados', args=[snap.version]),
+        "tabela_html": _snapshot_table_html(snap),
+        "data_atual": _local_data_atual(),
+    }, ensure_ascii=False)
+    if len(_update_payloads) >= 4:
+        _update_payloads.clear()
+    _update_payloads[version] = payload
+    return payload
+
+
+async def _latest_event(sent):
+    """(versão, evento SSE) se a versão atual difere de `sent`; senão (sent, None)."""
+    from asgiref.sync import sync_to_async
+
+    # Com o listener ativo não há I/O: evita a ida ao pool de threads
+    version = _pushed_version() or await sync_to_async(_current_version, thread_sensitive=False)()
+    if version and version != sent:
+        payload = _update_payloads.get(version)
+        if payload is None:
+            payload = await sync_to_async(_update_payload, thread_sensitive=False)(version)
+        if payload is not None:
+            return version, f"id: {version}\nevent: tabela\ndata: {payload}\n\n"
+    return sent, None
+
+
+async def _update_events(client_version, streaming: bool):
+    from structure.updates import broadcaster
+
+    yield f"retry: {SSE_RETRY_MS if streaming else SSE_WSGI_RETRY_MS}\n\n"
+    sent = client_version
+    if not streaming:
+        # WSGI: uma resposta só, sem future nem registro no broadcaster
+        sent, event = await _latest_event(sent)
+        if event:
+            yield event
+        return
+    loop = broadcaster.join()
+    try:
+        while True:
+            # Pega a future antes de consultar a versão: uma troca entre as duas
+            # coisas já resolve a future e não se perde
+            future = broadcaster.future()
+            sent, event = await _latest_event(sent)
+            if event:
+                yield event
+            if await broadcaster.wait(future, SSE_KEEPALIVE_SECONDS) is None:
+                yield ": ping\n\n"
+    finally:
+        broadcaster.leave(loop)
+
+
+async def updates_stream(request):
+    """Stream SSE com o fragmento da tabela a cada nova versão do snapshot.
+
+    O cliente informa a versão que já tem por `?v=` ou, na reconexão automática
+    do EventSource, pelo cabeçalho Last-Event-ID.
+    """
+    from django.core.handlers.asgi import ASGIRequest
+    from django.http import StreamingHttpResponse
+
+    client_version = request.headers.get('Last-Event-ID') or request.GET.get('v') or None
+    if isinstance(request, ASGIRequest):
+        events = _update_events(client_version, streaming=True)
+    else:
+        # WSGI: resposta finita (iterador síncrono), o EventSource reconecta depois
+        events = [chunk async for chunk in _update_events(client_version, streaming=False)]
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# --- Dados do snapshot para a tabela interativa ---------------------------------
+# O conteúdo de /dados/<versão>.json nunca muda (a versão é o hash do snapshot),
+# então vai com cache de um ano; o corpo é montado e comprimido uma vez por versão.
+_data_payloads = {}
+
+
+def _data_payload(version: str):
+    payload = _data_payloads.get(version)
+    if payload is not None:
+        return payload
+    snap = get_snapshot()
+    if snap is None or snap.version != version:
+        snap = load_snapshot(version=version)
+    if snap is None:
+        return None
+    body = json.dumps(snap.columnar(), ensure_ascii=False, separators=(',', ':'), allow_nan=False).encode('utf-8')
+    payload = (body, gzip.compress(body, 6))
+    if len(_data_payloads) >= 4:
+        _data_payloads.clear()
+    _data_payloads[version] = payload
+    return payload
+
+
+def snapshot_data(request, version: str):
+    """Snapshot `version` em JSON colunar (cacheável para sempre)."""
+    from django.http import Http404, HttpResponse, HttpResponseNotModified
+    from django.utils.cache import patch_vary_headers
+
+    etag = f'"{version}"'
+    if request.headers.get('If-None-Match') == etag:
+        return HttpResponseNotModified()
+    try:
+        payload = _data_payload(version)
+    except Exception as e:
+        logger.warning("Falha ao montar dados do snapshot %s: %s", version, e)
+        payload = None
+    if payload is None:
+        raise Http404("Versão do snapshot não encontrada")
+    body, compressed = payload
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response = HttpResponse(compressed, content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(body, content_type='application/json')
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response['ETag'] = etag
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+# --- Busca de Papéis -------------------------------------------------------------
+# O índice (prefixo + trigramas) é montado junto com o snapshot, uma vez por versão;
+# a requisição só consulta o índice e serializa alguns resultados.
+SEARCH_MAX_LIMIT = 50
+
+
+def ticker_search(request):
+    """Busca de Papéis na tabela inteira: `?q=PETR&limite=10&modo=auto|prefixo|fuzzy`."""
+    from django.http import JsonResponse
+
+    query = (request.GET.get('q') or '').strip()[:32]
+    mode = request.GET.get('modo', 'auto')
+    if mode not in ('auto', 'prefixo', 'fuzzy'):
+        return JsonResponse({"erro": "modo deve ser auto, prefixo ou fuzzy"}, status=400)
+    try:
+        limit = max(1, min(SEARCH_MAX_LIMIT, int(request.GET.get('limite', '10'))))
+    except ValueError:
+        return JsonResponse({"erro": "limite inválido"}, status=400)
+
+    snap = get_snapshot()
+    if snap is None:
+        return JsonResponse({"erro": "snapshot indisponível"}, status=503)
+    started = time.perf_counter()
+    results = snap.search_index.search(query, limit, mode) if query else []
+    response = JsonResponse({
+        "version": snap.version,
+        "q": query,
+        "modo": mode,
+        "resultados": results,
+        "us": round((time.perf_counter() - started) * 1e6, 1),
+    }, json_dumps_params={"ensure_ascii": False})
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
+
+
+# --- Histórico por Papel ----------------------------------------------------------
+# Lê só as partições mensais do intervalo e só as colunas pedidas (structure/timeseries.py);
+# a resposta fica em cache no processo por (Papel, intervalo, campos, freq, versão).
+HISTORY_MAX_FIELDS = 10
+
+
+def ticker_history(request, papel: str):
+    """Série de um Papel: `?from=AAAA-MM-DD&to=AAAA-MM-DD&fields=EV/EBIT,P/L&freq=diaria|semanal|mensal`."""
+    from django.http import JsonResponse
+    from structure.timeseries import DEFAULT_FIELDS, FREQUENCIES, get_store
+
+    papel = papel.strip().upper()[:16]
+    start, end = request.GET.get('from') or None, request.GET.get('to') or None
+    for value in (start, end):
+        if value is not None:
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                return JsonResponse({"erro": f"data inválida: {value!r} (use AAAA-MM-DD)"}, status=400)
+    if start and end and start > end:
+        return JsonResponse({"erro": "from depois de to"}, status=400)
+    freq = request.GET.get('freq', 'diaria')
+    if freq not in FREQUENCIES:
+        return JsonResponse({"erro": "freq deve ser diaria, semanal ou mensal"}, status=400)
+
+    store = get_store()
+    available = store.fields()
+    if not available:
+        return JsonResponse({"erro": "histórico indisponível"}, status=503)
+    fields = [f.strip() for f in (request.GET.get('fields') or '').split(',') if f.strip()] or DEFAULT_FIELDS
+    unknown = [f for f in fields if f not in available]
+    if unknown or len(fields) > HISTORY_MAX_FIELDS:
+        return JsonResponse({"erro": f"campos inválidos: {unknown}" if unknown else "campos demais",
+                             "disponiveis": available}, status=400)
+
+    snap = get_snapshot()
+    started = time.perf_counter()
+    result = store.history(papel, start, end, fields, freq, version=snap.version if snap else None)
+    if not result["encontrado"]:
+        return JsonResponse({"erro": f"{papel} sem histórico no intervalo"}, status=404)
+    response = JsonResponse({**result, "us": round((time.perf_counter() - started) * 1e6, 1)},
+                            json_dumps_params={"ensure_ascii": False})
+    response['Cache-Control'] = 'public, max-age=300'
+    return response